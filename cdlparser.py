@@ -43,6 +43,96 @@ The above code should create a netCDF file called 'mydataset.nc' in the current
 Note that the CDL text will usually need to be a raw string of the form r'...' in order for the
 string to be passed unmodified to the parser.
 
+CDL text that arrives piecemeal, e.g. over a network connection, can be parsed incrementally by
+passing each chunk to the feed() method and then calling the close() method, thus:
+
+    for chunk in chunks :
+       myparser.feed(chunk)
+    ncdataset = myparser.close()
+
+Client code that does not require a netCDF file can instead receive the contents of a CDL document
+as a series of events by passing an event handler object, typically an instance of a subclass of
+CDLEventHandler, to the parser, e.g.:
+
+    myparser = CDL3Parser(handler=MyEventHandler(), ...)
+    myparser.parse_file(cdlfilename)
+
+Alternatively, the parser can write each variable to a NumPy .npy file, which can be loaded
+lazily via numpy.load(..., mmap_mode='r'), together with a JSON file holding the metadata:
+
+    myparser = CDL3Parser(backend='npy', ...)
+    myparser.parse_file(cdlfilename, ncfile="/my/npy/folder")
+
+A sequence of CDL files that share an identical header can be aggregated into a single netCDF file
+along the unlimited dimension using the aggregate_files() method, as shown below:
+
+    ncdataset = myparser.aggregate_files([cdlfile1, cdlfile2, ...], ncfile="daily.nc")
+
+The same operation is available from the command line:
+
+    python cdlparser.py aggregate daily.nc cdlfile1 cdlfile2 ...
+
+Individual variables can be extracted from large CDL files without parsing the entire data section.
+The first call to the extract() method saves an index of the data section to a sidecar file, which
+is then used to read the requested data block directly:
+
+    tas = myparser.extract(cdlfilename, 'tas')
+
+A string containing several CDL documents back to back can be parsed in a single pass using the
+parse_stream() method, which produces one netCDF file per document:
+
+    ncdatasets = myparser.parse_stream(cdltext, ncdir="/my/nc/folder")
+
+Scripts and interactive tools that convert many small CDL files can avoid the cost of starting a
+new interpreter each time by using a conversion server, which keeps a pool of ready-built parsers:
+
+    python cdlparser.py serve workers=4
+    python cdlparser.py client cdlfilename
+
+The CDLClient class provides the same facility to python code.
+
+Output that is too large for a single netCDF file can be split into several files, or shards, by
+groups of variables or by ranges of records along the unlimited dimension, e.g.:
+
+    myparser = CDL3Parser(shard_records=1000, ...)
+    myparser.parse_file(cdlfilename, ncfile="/my/nc/folder/stuff.nc")
+    shardnames = myparser.dataset.filenames   # stuff_000.nc, stuff_001.nc, ...
+
+Conversely, the same output can be written to several netCDF files, e.g. in different formats,
+from a single parse of the CDL text:
+
+    myparser = CDL3Parser(targets=["legacy.nc",
+       dict(ncfile="compressed.nc", file_format='NETCDF4', zlib=True)])
+
+A quick preview of a large CDL file can be produced by keeping only the first few records, or
+data values, of each variable. Data values past the limit are skipped without being lexed:
+
+    myparser = CDL3Parser(max_records=10)
+    myparser.parse_file("huge.cdl", ncfile="preview.nc")
+
+If the delta keyword argument is set to True then hashes of the header declarations and data are
+saved alongside the netCDF file, and later conversions of modified CDL input to the same netCDF
+file rewrite only those attributes and variables which have changed:
+
+    myparser = CDL3Parser(delta=True)
+    myparser.parse_file("stuff.cdl", ncfile="stuff.nc")   # creates stuff.nc and stuff.nc.hashes
+
+A directory tree of CDL files can be watched for changes, with new or modified files converted
+into a mirror tree of netCDF files, using the CDLWatcher class or the equivalent command:
+
+    python cdlparser.py watch cdldir ncdir workers=4
+
+CDL files can be checked for errors, without producing any output, using the validate_file() and
+validate_text() methods. Setting the header_only keyword argument to True skips the data section:
+
+    myparser.validate_file(cdlfilename, header_only=True)
+
+An existing netCDF file can be checked against the CDL file from which it was generated using the
+verify() method, or the equivalent command, which reports the first difference for each variable:
+
+    differences = myparser.verify(cdlfilename, ncfilename)
+    python cdlparser.py verify cdlfilename ncfilename
+
 You can control the format of the netCDF output file using the 'file_format' keyword argument to the
 CDL3Parser constructor. For a description of this and other keyword arguments, read the docstring
 for the CDLParser.__init__ method.
@@ -51,7 +141,9 @@ Error-handling
 --------------
 Error-handling is fairly simple in the current version of cdlparser. A CDLSyntaxError exception is
 raised if the CDL input source contains syntax errors. If the syntax is fine but there are errors
-in the CDL content, then a CDLContentError exception is raised.
+in the CDL content, then a CDLContentError exception is raised. If any of the resource limits
+described in the CDLParser.__init__ docstring are exceeded then a subclass of CDLLimitError (itself
+a subclass of CDLContentError) is raised, e.g. CDLVariableSizeError or CDLTokenLimitError.
 
 The cause of any parsing problems can hopefully be determined by examining the exception text in
 combination with any error messages output by the logger object.
@@ -70,7 +162,9 @@ Creator: Phil Bentley
 __version_info__ = (0, 0, 8, 'beta', 0)
 __version__ = "%d.%d.%d-%s" % __version_info__[0:4]
 
-import sys, os, logging, types
+import sys, os, re, logging, types, tempfile, shutil, hashlib, threading, Queue, struct, json
+import socket, SocketServer, multiprocessing, base64, time, gc
+from collections import OrderedDict
 import ply.lex as lex
 from ply.lex import TOKEN
 import ply.yacc as yacc
@@ -103,6 +197,50 @@ NC_NP_DATA_TYPE_MAP = {
    'double':  'd'
 }
 
+# regular expression matching a run of characters that cannot start any CDL token
+ILLEGAL_CHARS_RE = re.compile(r'[^\sa-zA-Z0-9_.+\-"\'\\=(){};,:/\xC0-\xF7]+')
+
+# maximum number of complete CDL text segments queued up for the parser thread by the feed() method
+FEED_QUEUE_SIZE = 16
+
+# signature and filename suffix of compiled CDL files (see CDLRecorder and CDLReplayer)
+COMPILED_MAGIC = '\x93CDLC\x01\x00\x00'
+COMPILED_SUFFIX = '.cdlc'
+
+# filename suffix of the sidecar file holding the content hashes of a netCDF file when delta=True
+DELTA_SUFFIX = '.hashes'
+
+# types of the tokens which represent data values, and a regular expression matching those
+# characters which need attention when data values are skipped past the max_records/max_values limit
+VALUE_TOKENS = ('BYTE_CONST', 'CHAR_CONST', 'SHORT_CONST', 'INT_CONST', 'FLOAT_CONST',
+   'DOUBLE_CONST', 'TERMSTRING', 'FILLVALUE')
+SKIP_VALUES_RE = re.compile(r'[;"\'/]')
+
+# netCDF file formats in the order in which they are tried when the variables declared in a CDL
+# header are too large for the requested format and the format_policy is 'promote'
+FORMAT_PROMOTIONS = ['NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'NETCDF4_CLASSIC']
+
+# maximum number of pending netCDF operations queued up for the writer thread when pipeline=True
+WRITE_QUEUE_SIZE = 8
+
+# number of tokens between successive checks for cancellation, deadline expiry and progress reports
+CHECK_INTERVAL_TOKENS = 1024
+
+# default address of the conversion server (see CDLServer and CDLClient); a string is taken to be
+# the pathname of a Unix domain socket
+DEFAULT_SERVER_ADDRESS = ('127.0.0.1', 8642)
+
+# approximate number of bytes of data written per block of records (or rows of a fixed-size
+# variable) when record_major=True
+RECORD_BLOCK_SIZE = 1048576
+
+# default maximum number of data values passed to each call of an event handler's on_data_chunk method
+DEFAULT_CHUNK_SIZE = 65536
+
+# approximate number of bytes of memory used to buffer one data value in a python list, i.e. the list
+# slot plus the numpy scalar object it refers to
+BUFFERED_VALUE_SIZE = 48
+
 # default logging options
 DEFAULT_LOG_LEVEL  = logging.WARNING
 DEFAULT_LOG_FORMAT = "[%(levelname)s] %(funcName)s: %(message)s"
@@ -115,6 +253,42 @@ class CDLSyntaxError(Exception) :
 class CDLContentError(Exception) :
    pass
 
+# Exception classes for CDL input that exceeds one of the resource limits set on the parser
+class CDLLimitError(CDLContentError) :
+   pass
+
+class CDLVariableSizeError(CDLLimitError) :
+   pass
+
+class CDLTokenLimitError(CDLLimitError) :
+   pass
+
+class CDLStringLengthError(CDLLimitError) :
+   pass
+
+class CDLIllegalCharError(CDLLimitError) :
+   pass
+
+# Exception class for CDL headers that declare variables too large for the requested file format
+class CDLFormatError(CDLContentError) :
+   pass
+
+# Exception class for errors raised by the netCDF writer thread when pipeline=True
+class CDLWriteError(CDLContentError) :
+   pass
+
+# Exception class for parsing operations cancelled via the parser's cancel token
+class CDLCancelledError(Exception) :
+   pass
+
+# Exception class for parsing operations cancelled because the deadline has passed
+class CDLDeadlineError(CDLCancelledError) :
+   pass
+
+# Exception class raised by CDLClient when the conversion server has too many pending requests
+class CDLServerBusyError(Exception) :
+   pass
+
 #---------------------------------------------------------------------------------------------------
 class CDLParser(object) :
 #---------------------------------------------------------------------------------------------------
@@ -126,7 +300,14 @@ class CDLParser(object) :
    precedence = []
 
    def __init__(self, close_on_completion=False, file_format='NETCDF3_CLASSIC', log_level=None,
-      **kwargs) :
+      memory_limit=None, scratch_dir=None, cache_headers=False, template_dir=None,
+      max_var_size=None, max_tokens=None, max_string_length=None, max_illegal_chars=None,
+      handler=None, chunk_size=DEFAULT_CHUNK_SIZE, backend='netcdf', pipeline=False,
+      format_policy='promote', compute_stats=False, stats_attributes=False, update=False,
+      compiled_cache=False, record_major=False, progress=None, progress_interval=1.0,
+      deadline=None, cancel_token=None, shard_variables=None, shard_records=None, shard_workers=2,
+      delta=False, max_records=None, max_values=None, targets=None, target_workers=0,
+      update_records='append', **kwargs) :
       """
       The currently supported keyword arguments, with their default values, are described below. Any
       other keyword argments are passed through as-is to the PLY parser (via the yacc.yacc function).
@@ -139,20 +320,219 @@ class CDLParser(object) :
       :param file_format: Specifies the netCDF file format to use for the output file generated by
          the parser. The value of this keyword should be one of 'NETCDF3_CLASSIC', 'NETCDF3_64BIT',
          'NETCDF4_CLASSIC' or 'NETCDF4' [default: 'NETCDF3_CLASSIC']
+      :param format_policy: Specifies what to do if the variables declared in the CDL header are
+         too large to be stored in a netCDF-3 file of the requested format. The netCDF file is only
+         created once the header has been parsed, so this is known before any data is written. If
+         set to 'promote' then the first format in the sequence NETCDF3_CLASSIC, NETCDF3_64BIT,
+         NETCDF4_CLASSIC that is able to hold the variables is used instead. If set to 'error' then
+         a CDLFormatError exception is raised, while if set to 'ignore' then the requested format
+         is used regardless. [default: 'promote']
       :param log_level: Sets the logging level to one of the constants defined in the Python logging
          module [default: logging.WARNING]
+      :param memory_limit: The approximate amount of memory, in bytes, that may be used to accumulate
+         the data values of a single numeric variable. Once this limit is exceeded the values are
+         spilled to a memory-mapped scratch file and subsequently written to the netCDF variable in
+         slabs. By default no limit is applied. [default: None]
+      :param scratch_dir: The directory in which to create scratch files when the memory_limit is
+         exceeded. [default: the system's temporary directory]
+      :param cache_headers: If set to true then, for each distinct CDL header (i.e. all of the text
+         preceding the 'data:' section), an empty netCDF template file is saved after the header has
+         been parsed. Subsequent CDL documents having a byte-identical header are then converted by
+         copying the template file and parsing only the data section. [default: False]
+      :param template_dir: The directory in which to save netCDF template files when cache_headers
+         is enabled. [default: a new directory within the system's temporary directory]
+      :param max_var_size: The maximum number of data values, i.e. the product of the dimension
+         lengths, allowed for any one variable. A CDLVariableSizeError exception is raised when a
+         variable is declared, or data is supplied, beyond this limit. [default: None]
+      :param max_tokens: The maximum number of tokens allowed in a CDL document. A
+         CDLTokenLimitError exception is raised when this limit is exceeded. [default: None]
+      :param max_string_length: The maximum length of any quoted string in a CDL document. A
+         CDLStringLengthError exception is raised when this limit is exceeded. [default: None]
+      :param max_illegal_chars: The maximum number of illegal characters that will be skipped over
+         in a CDL document. A CDLIllegalCharError exception is raised when this limit is exceeded.
+         [default: None]
+      :param handler: An event handler object, typically an instance of a CDLEventHandler subclass.
+         If specified then no netCDF file is created. Instead, the handler's on_dimension,
+         on_variable, on_attribute, on_data_chunk and on_end methods are called as the corresponding
+         CDL constructs are parsed. [default: None]
+      :param chunk_size: The maximum number of data values passed to each call of the event
+         handler's on_data_chunk method, or compared at a time by the verify method.
+         [default: 65536]
+      :param backend: Specifies the type of output generated by the parser. The value of this
+         keyword should be either 'netcdf', for a netCDF file, or 'npy', for a directory containing
+         a NumPy .npy file for each variable plus a JSON file describing the dimensions, variables
+         and attributes. In the latter case the directory is named after the netCDF name token in
+         the CDL input, unless one is specified via the ncfile argument. [default: 'netcdf']
+      :param compute_stats: If set to true then summary statistics - the minimum, maximum and mean
+         of the valid values, plus the number of fill values and NaNs - are accumulated for each
+         numeric variable as its data is written. Values equal to the variable's _FillValue (or
+         the default fill value) or missing_value attribute are excluded from the minimum, maximum
+         and mean. Once parsing is complete the statistics may be obtained from the parser's stats
+         attribute, a dictionary of VariableStats objects keyed by variable name. [default: False]
+      :param stats_attributes: If set to true then compute_stats is implied, and the statistics for
+         each variable are also saved as the attributes actual_range, actual_mean, fill_count and
+         nan_count once all of the data has been written. Note that, for netCDF-3 files, this may
+         entail rewriting the file if its header no longer fits in the space reserved for it.
+         [default: False]
+      :param update: If set to true, and the output netCDF file already exists, then the file is
+         opened for update instead of being overwritten. Any dimensions, variables and attributes
+         declared in the CDL header that are not present in the file are created, while those that
+         are already present are checked for compatibility; attribute values are overwritten if
+         they differ. Data is then written to the variables referenced in the data section, with
+         the data for record variables written as specified by the update_records option.
+         [default: False]
+      :param compiled_cache: If set to true then the parse_file method saves a compiled form of each
+         CDL file parsed, in a file having the same name plus a '.cdlc' suffix. The compiled file
+         contains the tokens of the CDL header followed by the values in each data block, the
+         latter stored as raw little-endian arrays. Subsequent calls to parse_file for the same
+         CDL file then replay the compiled file, via memory-mapped arrays, instead of lexing the
+         CDL text. The compiled file is recreated whenever the CDL file is modified.
+         [default: False]
+      :param pipeline: If set to true then all operations on the netCDF dataset are carried out by
+         a background writer thread, which receives them via a bounded queue. This allows the
+         parser to lex and parse the next variable while the data for the previous one is being
+         written to disk. Any error raised by the writer thread is re-raised in the parser as a
+         CDLWriteError exception that identifies the variable and line number concerned.
+         [default: False]
+      :param record_major: If set to true then the data for all variables is buffered until the end
+         of the data section. Fixed-size variables are then written in header declaration order,
+         followed by the record variables, which are written a block of records at a time across
+         all record variables, i.e. in the order in which records are interleaved in a netCDF-3
+         file. The number of records is taken from the largest record variable. For newly created
+         files, fill mode is turned off and variables not assigned any data are written explicitly
+         with fill values. Memory use is bounded only by the memory_limit option. [default: False]
+      :param progress: A callable object to which progress reports are passed while parsing. Each
+         report is a dictionary containing the items 'bytes_read' and 'total_bytes' (either of which
+         may be None if unknown, e.g. for CDL text passed in via the feed() method), 'values_written',
+         'variable' (the name of the current variable, if any) and 'elapsed' (in seconds). A final
+         report is made on successful completion. [default: None]
+      :param progress_interval: The minimum interval, in seconds, between progress reports.
+         [default: 1.0]
+      :param deadline: The time, as returned by time.time(), by which parsing must be complete. If
+         it is exceeded then a CDLDeadlineError exception is raised. [default: None]
+      :param cancel_token: An object, typically a threading.Event, whose is_set() method returns
+         true if the current parsing operation should be cancelled, in which case a
+         CDLCancelledError exception is raised. The token is also set by the cancel() method. A
+         token passed in by the client remains set until it is cleared by the client, whereas the
+         parser's own token, used if none is passed in, is cleared at the start of each parsing
+         operation. When parsing is cancelled or the deadline
+         is exceeded, the netCDF dataset is closed and, if it was created by the parser, the
+         partially written output file is deleted. [default: None]
+      :param shard_variables: A list of lists of variable names. If specified then the output is
+         split into several netCDF files, or shards, one for each group of variables, plus one for
+         any remaining variables. See the ShardDataset class for details. [default: None]
+      :param shard_records: The number of records, i.e. indices along the unlimited dimension, in
+         each shard. If specified then the output is split into shards by ranges of records. The
+         first shard also receives all fixed-size variables. Sharded output cannot be combined
+         with the handler, backend='npy', update or delta options, nor used to aggregate CDL files,
+         and only one of shard_variables and shard_records may be specified; a ValueError is
+         raised otherwise. [default: None]
+      :param shard_workers: The number of writer processes used to write the shards concurrently,
+         or zero to write them in turn from the parser process. [default: 2]
+      :param delta: If set to true then hashes of the header declarations and of the data defined
+         for each variable are saved in a sidecar file alongside the netCDF file. When the same
+         netCDF file is next generated it is updated in place, only those attributes and variables
+         whose hashes have changed being written. The file is rebuilt if any dimension or variable
+         definitions have changed, or if the number of records has decreased. [default: False]
+      :param max_records: If specified then only the first max_records records of each record
+         variable are kept, the unlimited dimension being sized to match. Along with max_values,
+         this produces a small preview of a large CDL file: the remaining values of each data
+         block are skipped by scanning for the terminating ';' character rather than being lexed,
+         and so are not checked for errors. [default: None]
+      :param max_values: If specified then only the first max_values data values of each variable
+         are kept, the remainder of each fixed-size variable being set to the fill value. For
+         record variables the limit is rounded down to a whole number of records, with a minimum
+         of one record. [default: None]
+      :param targets: A list of output targets, each of which is either the pathname of a netCDF
+         file or a dictionary holding the pathname ('ncfile'), optionally the file format
+         ('file_format'), and any keyword arguments to pass to the netCDF4 createVariable method,
+         e.g. zlib=True. If specified then the output is written to every target from a single
+         parse of the CDL text. See the FanoutDataset class for details. This option cannot be
+         combined with the handler, backend='npy', shard_variables, shard_records, update or delta
+         options, nor used to aggregate CDL files; a ValueError is raised if it is. [default: None]
+      :param target_workers: The number of writer processes used to write the output targets
+         concurrently, or zero to write them in turn from the parser process. [default: 0]
+      :param update_records: Specifies how the data for record variables is written in update mode.
+         If set to 'append' then the records defined in the CDL are appended after the existing
+         records. If set to 'overwrite' then they are written from the first record, thus replacing
+         the existing data for each record variable referenced in the data section; as when a new
+         file is created, data for fewer records than the file holds is padded with fill values,
+         while any additional records are appended. [default: 'append']
       """
       self.close_on_completion = close_on_completion
       self.file_format = file_format
       self.log_level = DEFAULT_LOG_LEVEL if log_level is None else log_level
+      self.memory_limit = memory_limit
+      self.scratch_dir = scratch_dir
+      self.cache_headers = cache_headers
+      self.template_dir = template_dir
+      self.header_cache = {}
+      self.max_var_size = max_var_size
+      self.max_tokens = max_tokens
+      self.max_string_length = max_string_length
+      self.max_illegal_chars = max_illegal_chars
+      self.handler = handler
+      self.chunk_size = chunk_size
+      if backend not in ('netcdf', 'npy') :
+         raise ValueError("Unsupported output backend: '%s'" % backend)
+      self.backend = backend
+      self.pipeline = pipeline
+      if format_policy not in ('promote', 'error', 'ignore') :
+         raise ValueError("Unsupported format policy: '%s'" % format_policy)
+      self.format_policy = format_policy
+      self.compute_stats = compute_stats or stats_attributes
+      self.stats_attributes = stats_attributes
+      self.update = update
+      if update_records not in ('append', 'overwrite') :
+         raise ValueError("Unsupported update_records option: '%s'" % update_records)
+      self.update_records = update_records
+      self.compiled_cache = compiled_cache
+      self.record_major = record_major
+      self.progress = progress
+      self.progress_interval = progress_interval
+      self.deadline = deadline
+      self.own_cancel_token = cancel_token is None
+      self.cancel_token = cancel_token or threading.Event()
+      self.shard_variables = shard_variables
+      self.shard_records = shard_records
+      self.shard_workers = shard_workers
+      if shard_variables and shard_records :
+         raise ValueError("The shard_variables and shard_records options cannot be combined")
+      if shard_variables or shard_records :
+         # sharded output cannot be combined with any other kind of output
+         option = 'shard_variables' if shard_variables else 'shard_records'
+         for other, value in (('handler', handler), ("backend='npy'", backend == 'npy'),
+            ('update', update), ('delta', delta)) :
+            if value : raise ValueError("The %s option cannot be combined with %s" % (option, other))
+      self.delta = delta
+      self.max_records = max_records
+      self.max_values = max_values
+      self.preview = max_records is not None or max_values is not None
+      self.targets = targets
+      self.target_workers = target_workers
+      if targets :
+         # fan-out output cannot be combined with any other kind of output
+         for option, value in (('handler', handler), ("backend='npy'", backend == 'npy'),
+            ('shard_variables', shard_variables), ('shard_records', shard_records),
+            ('update', update), ('delta', delta)) :
+            if value : raise ValueError("The targets option cannot be combined with %s" % option)
+      self.recorder = None
       self.cdlfile = None
+      self.ncfile = None
+      self.output_dir = None
       self.ncdataset = None
+      self.dataset = None
+      self.append_dataset = None
+      self.extract_counts = None
+      self.segments = None
+      self.feed_thread = None
       #self.dryrun = kwargs.pop('dryrun', False)   # TODO: enable dry-run option
       self.init_logger()
 
-      # Build the lexer and parser
-      self.lexer = lex.lex(module=self, debug=kwargs.get('debug', 0))
-      self.parser = yacc.yacc(module=self, **kwargs)
+      # The lexer and parser are built on demand by the build_parser method
+      self.yacc_kwargs = kwargs
+      self.lexer = None
+      self.parser = None
 
    def parse_file(self, cdlfile, ncfile=None) :
       """
@@ -171,10 +551,41 @@ class CDLParser(object) :
       :returns: A handle to a netCDF4.Dataset object.
       """
       self.cdlfile = cdlfile
-      f = open(cdlfile)
-      data = f.read()   # FIXME: can we parse input w/o reading entire CDL file into memory?
-      f.close()
-      return self.parse_text(data, ncfile=ncfile)
+      if self.compiled_cache :
+         cachefile = cdlfile + COMPILED_SUFFIX
+         if is_compiled_current(cachefile, cdlfile) :
+            self.logger.info("Replaying compiled CDL file %s" % cachefile)
+            return self.parse_compiled(cachefile, ncfile=ncfile)
+         # preview conversions hold only part of the data, so are not saved as compiled files
+         if not self.preview : self.recorder = CDLRecorder(cachefile)
+      try :
+         f = open(cdlfile)
+         data = f.read()   # FIXME: can we parse input w/o reading entire CDL file into memory?
+         f.close()
+         ncdataset = self.parse_text(data, ncfile=ncfile)
+         if self.recorder :
+            self.recorder.finish(cdlfile)
+            self.logger.info("Saved compiled CDL file %s" % self.recorder.filename)
+      finally :
+         if self.recorder : self.recorder.abort()
+         self.recorder = None
+      return ncdataset
+
+   def parse_compiled(self, cachefile, ncfile=None) :
+      """
+      Parse a compiled CDL file, as saved by the parse_file method when the compiled_cache option is
+      enabled, writing the output to the netCDF file specified via the optional ncfile argument.
+      The tokens and data arrays in the compiled file are passed directly to the parser, so no
+      lexing of CDL text is required.
+
+      :param cachefile: Pathname of the compiled CDL file to parse.
+      :param ncfile: Optional pathname of the netCDF file to receive output.
+      :returns: A handle to a netCDF4.Dataset object.
+      """
+      self.init_parse(ncfile)
+      self.token_source = CDLReplayer(cachefile)
+      self.run_parser()
+      return self.ncdataset
 
    def parse_text(self, cdltext, ncfile=None) :
       """
@@ -192,26 +603,673 @@ class CDLParser(object) :
       :param ncfile: Optional pathname of the netCDF file to receive output.
       :returns: A handle to a netCDF4.Dataset object.
       """
+      self.init_parse(ncfile)
+      if self.cache_headers and self.append_dataset is None and self.handler is None \
+         and self.extract_counts is None and self.backend == 'netcdf' and not self.update \
+         and self.recorder is None and not self.delta and not self.targets \
+         and not (self.shard_variables or self.shard_records) :
+         self.header_entry = self.find_cached_header(cdltext)
+      if self.header_entry :
+         # skip the header: the template file already contains everything declared therein
+         hdrlen = self.header_entry['length']
+         prefix = self.header_entry['prefix']
+         self.lexer.lineno += cdltext.count('\n', 0, hdrlen) - prefix.count('\n')
+         cdltext = prefix + cdltext[hdrlen:]
+      self.run_parser(cdltext)
+      if self.delta_rebuild :
+         # the changes could not be applied in place, so the netCDF file is generated afresh
+         self.init_parse(ncfile)
+         self.run_parser(cdltext)
+      return self.ncdataset
+
+   def parse_stream(self, cdltext, ncdir=None) :
+      """
+      Parse a stream of consecutive CDL documents, as received for example from a message bus, in a
+      single pass. Each document produces its own output, the name of which is derived from the
+      netCDF name in the first line of the document. The same lexer and parser are used for all of
+      the documents, and line numbers in error messages are counted from the start of the stream.
+
+      If successful, this method returns a list of handles to netCDF4.Dataset objects, one for each
+      document. As with the parse_text method, client code is responsible for closing them unless
+      the close_on_completion keyword argument was set to True when instantiating the parser. If any
+      document cannot be parsed then the datasets produced for the preceding documents are closed,
+      leaving their output files in place, before the error is re-raised.
+
+      :param cdltext: String containing the CDL documents to parse.
+      :param ncdir: Optional name of the directory to receive the output files. By default this is
+         the current working directory.
+      :returns: A list of handles to netCDF4.Dataset objects.
+      """
+      datasets = []
+      self.init_parse()
+      self.output_dir = ncdir
+      self.lexer.input(cdltext)
+      try :
+         while True :
+            tok = self.lexer.token()
+            if tok is None : break
+            self.token_source = TokenStream(self.document_tokens(tok))
+            self.run_parser()
+            datasets.append(self.ncdataset)
+            # reset the parser state, leaving the dataset just produced open and the lexer in place
+            lineno = self.lexer.lineno
+            self.ncdataset = None
+            self.init_parse()
+            self.lexer.lineno = lineno
+      except :
+         # no handles are returned to the caller, so close the datasets produced so far
+         for ncdataset in datasets :
+            if ncdataset is not None and ncdataset.isopen() : ncdataset.close()
+         raise
+      finally :
+         self.output_dir = None
+      return datasets
+
+   def document_tokens(self, tok) :
+      """
+      Generate the tokens of the next CDL document in a stream, starting with the specified token
+      and ending with the closing brace of the document.
+      """
+      while tok is not None :
+         yield tok
+         if tok.type == 'RBRACE' : return
+         tok = self.lexer.token()
+
+   def feed(self, chunk, ncfile=None) :
+      """
+      Feed the next chunk of a CDL document to the parser. This method, together with the close()
+      method, provides an incremental alternative to the parse_text() method for use when the CDL
+      text arrives piecemeal, e.g. over a network connection. Complete statements are passed to a
+      parser thread as soon as they are available, so that variables are written to the netCDF
+      dataset while later chunks are still arriving. Any parsing error raised by the parser thread
+      is re-raised by the next call to feed() or close().
+
+      :param chunk: String containing the next chunk of CDL text. Chunks may be split at any point.
+      :param ncfile: Optional pathname of the netCDF file to receive output. This argument is only
+         used with the first chunk of a CDL document.
+      """
+      if self.feed_thread is None :
+         self.init_parse(ncfile)
+         self.chunker = CDLChunker()
+         self.segments = Queue.Queue(FEED_QUEUE_SIZE)
+         self.feed_error = None
+         self.lexer.input('')
+         self.feed_thread = threading.Thread(target=self.run_feed_parser, name='cdlparser-feed')
+         self.feed_thread.daemon = True
+         self.feed_thread.start()
+      segment = self.chunker.feed(chunk)
+      if segment : self.put_segment(segment)
+
+   def close(self) :
+      """
+      Signal the end of a CDL document passed in via the feed() method, wait for the parser thread
+      to finish, and return a handle to the resulting netCDF4.Dataset object.
+
+      :returns: A handle to a netCDF4.Dataset object.
+      """
+      if self.feed_thread is None :
+         raise CDLSyntaxError("Syntax error: no CDL text has been fed to the parser.")
+      try :
+         segment = self.chunker.close()
+         if segment : self.put_segment(segment)
+         self.put_segment(None)
+         self.feed_thread.join()
+         if self.feed_error : self.raise_feed_error()
+      finally :
+         self.feed_thread = self.segments = self.chunker = None
+      return self.ncdataset
+
+   def put_segment(self, segment) :
+      """Pass a complete CDL text segment, or None at end of input, to the parser thread."""
+      while True :
+         if not self.feed_thread.is_alive() :
+            if segment is None : return
+            self.feed_thread = self.segments = self.chunker = None
+            if self.feed_error : self.raise_feed_error()
+            raise CDLSyntaxError("Syntax error: CDL text follows end of netCDF definition.")
+         try :
+            self.segments.put(segment, timeout=0.1)
+            return
+         except Queue.Full :
+            pass
+
+   def raise_feed_error(self) :
+      """Re-raise the exception caught in the parser thread, with its original traceback."""
+      exc_type, exc_value, exc_tb = self.feed_error
+      self.feed_error = None
+      raise exc_type, exc_value, exc_tb
+
+   def run_feed_parser(self) :
+      """Run the parser over the text segments passed in via the feed() method."""
+      try :
+         self.run_parser()
+      except :
+         self.feed_error = sys.exc_info()
+
+   def run_parser(self, cdltext=None) :
+      """
+      Run the PLY parser over the specified CDL text or, if that is None, over the text segments
+      passed in via the feed() method.
+      """
+      cancelled = failed = False
+      try :
+         self.parser.parse(input=cdltext, lexer=self.lexer, tokenfunc=self.next_token)
+         if self.progress : self.report_progress()
+      except CDLCancelledError :
+         cancelled = True
+         raise
+      except :
+         failed = True
+         raise
+      finally :
+         # remove any scratch files left behind by a failed parse
+         for sarr in self.scratch_arrays : sarr.close()
+         self.scratch_arrays = []
+         # stop any writer thread left running by a failed parse
+         if self.writer : self.writer.stop()
+         self.writer = None
+         # likewise any shard writer processes
+         if isinstance(self.dataset, ShardDataset) : self.dataset.stop()
+         if cancelled : self.discard_output()
+         # a partially written netCDF file is closed rather than left open until the next parse
+         if failed : self.close_output()
+
+   def cancel(self) :
+      """
+      Request cancellation of the current parsing operation, which may be running in another thread,
+      by setting the cancel token.
+      """
+      self.cancel_token.set()
+
+   def check_progress(self, tok) :
+      """
+      Check for cancellation and deadline expiry, and make a progress report if one is due. This
+      method is called by the next_token method every CHECK_INTERVAL_TOKENS tokens.
+      """
+      self.next_check = self.ntokens + CHECK_INTERVAL_TOKENS
+      if self.cancel_token.is_set() :
+         raise CDLCancelledError("Parsing cancelled at line number %d" % tok.lineno)
+      now = time.time()
+      if self.deadline and now > self.deadline :
+         raise CDLDeadlineError("Parsing deadline exceeded at line number %d" % tok.lineno)
+      if self.progress and now >= self.next_report :
+         self.next_report = now + self.progress_interval
+         self.report_progress(tok)
+
+   def report_progress(self, tok=None) :
+      """Pass a progress report to the progress callback (see the CDLParser.__init__ docstring)."""
+      bytes_read = total_bytes = None
+      if self.token_source is self.lexer :
+         lexpos = tok.lexpos if tok else min(self.lexer.lexpos, len(self.lexer.lexdata))
+         bytes_read = self.lex_offset + lexpos
+         if self.segments is None : total_bytes = len(self.lexer.lexdata)
+      self.progress(dict(bytes_read=bytes_read, total_bytes=total_bytes,
+         values_written=self.nvalues+self.nflushed, variable=getattr(self.curr_var, '_name', None),
+         elapsed=time.time()-self.start_time))
+
+   def close_output(self) :
+      """Close the netCDF dataset, unless it is the dataset being appended to."""
+      if self.ncdataset is None or self.ncdataset is self.append_dataset : return
+      try :
+         if self.ncdataset.isopen() : self.ncdataset.close()
+      except Exception, exc :
+         self.logger.warning("Error closing netCDF dataset: %s" % str(exc))
+
+   def discard_output(self) :
+      """
+      Close the netCDF dataset following cancellation and, if the output file was created by the
+      parser, delete it.
+      """
+      if self.ncdataset is None or self.ncdataset is self.append_dataset : return
+      self.close_output()
+      if self.created_output and os.path.exists(self.ncfile) :
+         os.remove(self.ncfile)
+         self.logger.info("Deleted partially written netCDF file %s" % self.ncfile)
+
+   def init_parse(self, ncfile=None) :
+      """Reset the parser state ahead of parsing a new CDL document."""
       self.ncfile = ncfile
       # if netcdf dataset handle exists, e.g. from previous parsing operation, try to close it
-      if self.ncdataset :
-         try :    self.ncdataset.close()
-         except : pass
+      # (closing a dataset that is already closed could close a reused netCDF id, hence the check)
+      self.close_output()
       self.ncdataset = None
+      self.dataset = None
+      self.schema = None
       self.curr_var = None
       self.curr_dim = None
       self.rec_dimname = None
-      self.parser.parse(input=cdltext, lexer=self.lexer)
-      return self.ncdataset
+      self.record_offset = 0
+      self.scratch_arrays = []
+      self.writer = None
+      self.var_lineno = 0
+      self.stats = OrderedDict()
+      self.deferred_data = OrderedDict()
+      self.fill_off = False
+      self.created_output = False
+      self.start_time = time.time()
+      self.next_check = CHECK_INTERVAL_TOKENS
+      self.next_report = self.start_time + self.progress_interval
+      self.lex_offset = 0
+      self.nvalues = self.nflushed = 0
+      self.delta_state = self.delta_hashes = None
+      self.delta_inplace = self.delta_rebuild = False
+      self.delta_data = OrderedDict()
+      self.delta_records = {}
+      self.in_data = self.skipping = False
+      self.nkept = self.value_limit = None
+      self.stream_chunks = False
+      self.netcdf_lexend = self.data_lexpos = None
+      self.ntokens = self.nillegal = 0
+      self.validating = False
+      self.verify_target = None
+      if self.own_cancel_token : self.cancel_token.clear()
+      self.build_parser()
+      self.lexer.lineno = 1
+      self.header_entry = None
+      self.token_source = self.lexer
+
+   def build_parser(self) :
+      """
+      Build the PLY lexer and parser, unless this has already been done. This is deferred until the
+      first CDL document is parsed so that creating a parser object is cheap. The parser tables are
+      read from the parsetab module that PLY saves alongside this module, and are only regenerated
+      if the grammar has changed.
+      """
+      if self.lexer is None :
+         self.lexer = lex.lex(module=self, debug=self.yacc_kwargs.get('debug', 0))
+      if self.parser is None :
+         self.parser = yacc.yacc(module=self, **self.yacc_kwargs)
+
+   def validate_file(self, cdlfile, header_only=False) :
+      """
+      Check the specified CDL file for syntax and content errors without producing any output. See
+      the validate_text method for details.
+
+      :param cdlfile: Pathname of the CDL file to validate.
+      :param header_only: If set to true then only the header section is validated. [default: False]
+      :returns: A SchemaDataset object describing the declarations in the CDL header.
+      """
+      f = open(cdlfile)
+      try :
+         data = f.read()
+      finally :
+         f.close()
+      return self.validate_text(data, header_only=header_only)
+
+   def validate_text(self, cdltext, header_only=False) :
+      """
+      Check the specified CDL text for syntax and content errors without producing any output. The
+      declarations and data values are checked in exactly the same way as by the parse_text method,
+      but no netCDF file is created. If header_only is set to true then lexing stops at the 'data:'
+      keyword, thus avoiding the cost of scanning a potentially large data section. Errors are
+      reported by raising the usual exceptions, i.e. CDLSyntaxError or CDLContentError (or one of
+      its subclasses).
+
+      :param cdltext: String containing the CDL text to validate.
+      :param header_only: If set to true then only the header section is validated. [default: False]
+      :returns: A SchemaDataset object describing the declarations in the CDL header.
+      """
+      self.init_parse()
+      self.validating = True
+      if header_only : self.token_source = TokenStream(self.header_tokens())
+      self.run_parser(cdltext)
+      return self.dataset
+
+   def header_tokens(self) :
+      """
+      Generate the tokens in the header section of the CDL text being lexed, followed by a closing
+      brace in place of the data section.
+      """
+      for tok in iter(self.lexer.token, None) :
+         yield tok
+         if tok.type == 'DATA' :
+            yield make_token('RBRACE', '}', tok.lineno, tok.lexpos)
+            return
+
+   def verify(self, cdlfile, ncfile) :
+      """
+      Verify that the specified netCDF file is an exact rendition of the specified CDL file. The CDL
+      file is parsed without producing any output, and its declarations and data are compared with
+      those in the netCDF file: see the VerifyDataset class for details. Only the first differing
+      data value is reported for each variable. Syntax and content errors in the CDL file are
+      reported by raising the usual exceptions.
+
+      :param cdlfile: Pathname of the CDL file to parse.
+      :param ncfile: Pathname of the netCDF file to verify.
+      :returns: A list of messages describing the differences found, which is empty if the netCDF
+         file matches the CDL file.
+      """
+      f = open(cdlfile)
+      try :
+         data = f.read()
+      finally :
+         f.close()
+      ncdataset = nc4.Dataset(ncfile)
+      try :
+         ncdataset.set_auto_maskandscale(False)
+         self.init_parse()
+         self.validating = True
+         self.verify_target = ncdataset
+         self.run_parser(data)
+      finally :
+         self.verify_target = None
+         ncdataset.close()
+      for msg in self.dataset.differences : self.logger.warning(msg)
+      self.logger.info("Found %d difference(s) between CDL file %s and netCDF file %s" \
+         % (len(self.dataset.differences), cdlfile, ncfile))
+      return self.dataset.differences
+
+   def aggregate_files(self, cdlfiles, ncfile=None) :
+      """
+      Aggregate a sequence of CDL files, which must share identical headers, into a single netCDF
+      file along the unlimited dimension. The first CDL file is parsed as normal. The header of each
+      subsequent file is then checked against the netCDF dataset and its record variable data is
+      appended directly to the record dimension. The data for any fixed-size variables is taken
+      from the first file only. If any of the CDL files cannot be parsed, e.g. because its header
+      does not match, then the netCDF dataset is closed and, if it was created by this method, the
+      partially aggregated netCDF file is deleted.
+
+      :param cdlfiles: Sequence of pathnames of the CDL files to aggregate.
+      :param ncfile: Optional pathname of the netCDF file to receive output. If not specified then
+         the output filename is derived from the first CDL file, as per the parse_file method.
+      :returns: A handle to a netCDF4.Dataset object.
+      """
+      if not cdlfiles :
+         raise ValueError("At least one CDL file must be specified for aggregation")
+      if self.targets :
+         raise ValueError("The targets option cannot be combined with aggregation")
+      if self.shard_variables or self.shard_records :
+         raise ValueError("Sharded output cannot be combined with aggregation")
+      close_on_completion = self.close_on_completion
+      self.close_on_completion = False
+      ncdataset = None
+      try :
+         ncdataset = self.parse_file(cdlfiles[0], ncfile=ncfile)
+         created, ncfile = self.created_output, self.ncfile
+         if len(cdlfiles) > 1 and not self.rec_dimname :
+            raise CDLContentError("CDL file %s has no unlimited dimension to aggregate along." \
+               % cdlfiles[0])
+         self.append_dataset = ncdataset
+         for cdlfile in cdlfiles[1:] :
+            self.parse_file(cdlfile, ncfile=ncfile)
+            self.logger.info("Appended records from CDL file %s" % cdlfile)
+      except :
+         # no handle to the partially aggregated dataset is returned to the caller, so close it here
+         self.append_dataset = None
+         if ncdataset is None :
+            created, ncfile = self.created_output, self.ncfile
+         else :
+            self.ncdataset = ncdataset
+            self.close_output()
+         if created and ncfile and os.path.exists(ncfile) :
+            os.remove(ncfile)
+            self.logger.info("Deleted partially aggregated netCDF file %s" % ncfile)
+         raise
+      finally :
+         self.append_dataset = None
+         self.close_on_completion = close_on_completion
+      if self.close_on_completion : ncdataset.close()
+      return ncdataset
+
+   def index_file(self, cdlfile, indexfile=None) :
+      """
+      Scan the specified CDL file and record the byte offset, line number, value count and length
+      (in bytes) of each 'varname = ... ;' block in the data section. The resulting index is saved
+      as JSON to a sidecar file and returned as a dictionary. The data values are not lexed, so
+      indexing a CDL file is considerably faster than parsing it.
+
+      :param cdlfile: Pathname of the CDL file to index.
+      :param indexfile: Optional pathname of the index file. [default: cdlfile + '.idx']
+      :returns: A dictionary containing the index.
+      """
+      if not indexfile : indexfile = cdlfile + '.idx'
+      indexer = CDLIndexer()
+      f = open(cdlfile, 'rb')
+      try :
+         for line in f : indexer.scan(line)
+      finally :
+         f.close()
+      stat = os.stat(cdlfile)
+      index = OrderedDict([('cdlfile', os.path.basename(cdlfile)), ('size', stat.st_size),
+         ('mtime', stat.st_mtime)])
+      index.update(indexer.results())
+      f = open(indexfile, 'w')
+      try :
+         json.dump(index, f, indent=1)
+      finally :
+         f.close()
+      self.logger.info("Indexed %d data block(s) in CDL file %s" % (len(index['blocks']), cdlfile))
+      return index
+
+   def load_index(self, cdlfile, indexfile=None) :
+      """
+      Load the index for the specified CDL file from its sidecar file. If the sidecar file does not
+      exist, or if the CDL file has changed since it was indexed, then the file is re-indexed.
+      """
+      if not indexfile : indexfile = cdlfile + '.idx'
+      if os.path.exists(indexfile) :
+         f = open(indexfile)
+         try :
+            index = json.load(f)
+         finally :
+            f.close()
+         stat = os.stat(cdlfile)
+         if index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime :
+            return index
+         self.logger.info("Index file %s is out of date; re-indexing" % indexfile)
+      return self.index_file(cdlfile, indexfile=indexfile)
+
+   def extract(self, cdlfile, varname, indexfile=None) :
+      """
+      Extract the data for a single variable from the specified CDL file. The header of the CDL
+      file is parsed in order to obtain the schema, after which the data block for the variable is
+      read directly from the byte offset recorded in the file's index. No other part of the data
+      section is read or lexed. The index is created first if necessary (see index_file).
+
+      The data is returned as a numpy array having the declared shape and type of the variable,
+      with any unspecified elements set to the variable's fill value. The length of the unlimited
+      dimension, if any, is determined from the value counts of all of the record variables in the
+      index, as would be the case when parsing the whole file. Any netCDF dataset returned by an
+      earlier parse is left open.
+
+      :param cdlfile: Pathname of the CDL file.
+      :param varname: Name of the variable to extract.
+      :param indexfile: Optional pathname of the index file. [default: cdlfile + '.idx']
+      :returns: A numpy array containing the variable's data.
+      """
+      index = self.load_index(cdlfile, indexfile=indexfile)
+      blocks = [b for b in index['blocks'] if b['name'] == varname]
+      f = open(cdlfile, 'rb')
+      try :
+         hdrlen = index['data_offset'] if index['data_offset'] is not None else index['end_offset']
+         text = [f.read(hdrlen), 'data:']
+         if blocks :
+            # pad with newlines so that line numbers in error messages refer to the CDL file
+            f.seek(blocks[-1]['offset'])
+            text.append('\n' * (blocks[-1]['line'] - index['data_line']))
+            text.append(f.read(blocks[-1]['length']))
+         text.append('\n}')
+      finally :
+         f.close()
+      self.extract_counts = dict([(b['name'], b['count']) for b in index['blocks']])
+      # detach any dataset returned by an earlier parse so that init_parse does not close it
+      ncdataset, ncfile = self.ncdataset, self.ncfile
+      self.ncdataset = None
+      try :
+         self.cdlfile = cdlfile
+         self.parse_text(''.join(text))
+      finally :
+         self.extract_counts = None
+         self.ncdataset, self.ncfile = ncdataset, ncfile
+      if varname not in self.dataset.variables :
+         raise CDLContentError("Variable %s is not defined in CDL file %s" % (varname, cdlfile))
+      return self.dataset.get_array(varname)
+
+   def init_writer(self, ncdataset) :
+      """
+      Return the dataset object that grammar actions should write to, i.e. ncdataset itself or, if
+      the pipeline option is enabled, a WriterDataset that forwards operations to ncdataset via a
+      background writer thread.
+      """
+      if not self.pipeline : return ncdataset
+      self.writer = WriterDataset(ncdataset, lineno=lambda : self.var_lineno)
+      return self.writer
+
+   def next_token(self) :
+      """
+      Return the next token from the lexer (or from the compiled CDL file being replayed), checking
+      the token count against max_tokens and periodically checking for cancellation. When the
+      lexer runs out of input while CDL text is being passed in via the feed() method, this method
+      waits for the next text segment to arrive.
+      """
+      tok = self.fetch_token()
+      while tok is not None and self.preview and not self.keep_token(tok) :
+         tok = self.fetch_token()
+      if tok is not None :
+         self.ntokens += 1
+         if self.max_tokens and self.ntokens > self.max_tokens :
+            raise CDLTokenLimitError("Number of tokens exceeds the limit of %d at line number %d" \
+               % (self.max_tokens, tok.lineno))
+         if self.ntokens >= self.next_check : self.check_progress(tok)
+         if self.recorder : self.recorder.add_token(tok)
+      return tok
+
+   def fetch_token(self) :
+      """
+      Fetch the next token from the token source, switching to the next text segment passed in via
+      the feed() method if need be. Data values past the preview limit are skipped over first.
+      """
+      if self.skipping and self.token_source is self.lexer : self.skip_values()
+      tok = self.token_source.token()
+      while tok is None and self.segments is not None :
+         segment = self.segments.get()
+         if segment is None : break
+         self.lex_offset += len(self.lexer.lexdata)
+         self.lexer.input(segment)
+         if self.skipping : self.skip_values()
+         tok = self.lexer.token()
+      return tok
+
+   def keep_token(self, tok) :
+      """
+      Count the data values in each data block for a preview conversion. Returns false for those
+      values, and separating commas, which lie past the value limit for the current variable.
+      """
+      if not self.in_data :
+         self.in_data = tok.type == 'DATA'
+      elif tok.type == 'EQUALS' :
+         self.nkept = 0
+      elif tok.type == 'EOL' :
+         self.nkept = None
+         self.skipping = False
+      elif self.skipping :
+         return False
+      elif self.nkept is not None and tok.type in VALUE_TOKENS :
+         if self.nkept == 0 : self.value_limit = self.preview_limit(self.curr_var)
+         self.nkept += 1
+         if self.value_limit is not None and self.nkept >= self.value_limit :
+            self.logger.info("Preview limit of %d value(s) reached for variable %s; skipping "
+               "remaining values" % (self.value_limit, self.curr_var._name))
+            self.skipping = True
+      return True
+
+   def preview_limit(self, var) :
+      """
+      Returns the number of data values kept for variable var in a preview conversion, or None if
+      all values are kept.
+      """
+      if var is None : return None
+      if self.rec_dimname not in var.dimensions : return self.max_values
+      recshape = var.shape[1:-1] if var.dtype.kind == 'S' else var.shape[1:]
+      reclen = max(1, int(np.prod(recshape)))
+      nrecs = self.max_records
+      if self.max_values is not None :
+         nrecs = min(sys.maxint if nrecs is None else nrecs, max(1, self.max_values / reclen))
+      return nrecs * reclen
+
+   def skip_values(self) :
+      """
+      Advance the lexer to the ';' character terminating the current data block, without lexing the
+      intervening data values. Only strings, character constants and comments are recognised, so
+      that any ';' characters within them are ignored.
+      """
+      text = self.lexer.lexdata
+      start = pos = self.lexer.lexpos
+      while True :
+         match = SKIP_VALUES_RE.search(text, pos)
+         if match is None :
+            pos = len(text)
+            break
+         char = match.group()
+         pos = match.end()
+         if char == ';' :
+            pos = match.start()
+            break
+         elif char == '/' :
+            if text.startswith('/', pos) :   # comment
+               pos = text.find('\n', pos)
+               if pos < 0 : pos = len(text)
+         else :
+            pos = find_closing_quote(text, pos, char)
+      self.lexer.lineno += text.count('\n', start, pos)
+      self.lexer.lexpos = pos
+
+   def find_cached_header(self, cdltext) :
+      """
+      Return the header cache entry, if any, for the header of the specified CDL text. Cache entries
+      are indexed by header length and then by header hash. This avoids having to locate the start
+      of the data section in the CDL text, which cannot be done reliably without lexing it.
+      """
+      for hdrlen, entries in self.header_cache.items() :
+         if cdltext[hdrlen:hdrlen+5] not in ('data:', 'DATA:') : continue
+         entry = entries.get(self.header_key(cdltext[:hdrlen]))
+         if entry :
+            self.logger.info("Found cached netCDF template %s for CDL header" % entry['template'])
+            return entry
+      return None
+
+   def cache_header(self) :
+      """Save an empty netCDF template file for the CDL header just parsed."""
+      hdrlen = self.data_lexpos
+      header = self.lexer.lexdata[:hdrlen]
+      key = self.header_key(header)
+      if key in self.header_cache.get(hdrlen, {}) : return
+      if not self.template_dir : self.template_dir = tempfile.mkdtemp(prefix='cdlparser_')
+      fd, template = tempfile.mkstemp(suffix='.nc', prefix='template_', dir=self.template_dir)
+      os.close(fd)
+      self.dataset.sync()
+      shutil.copyfile(self.ncfile, template)
+      entry = dict(template=template, length=hdrlen, rec_dimname=self.rec_dimname,
+         prefix=header[:self.netcdf_lexend+1])
+      self.header_cache.setdefault(hdrlen, {})[key] = entry
+      self.logger.info("Saved netCDF template %s for CDL header" % template)
+
+   def clear_header_cache(self) :
+      """Clear the header cache and delete any netCDF template files created by the parser."""
+      for entries in self.header_cache.values() :
+         for entry in entries.values() :
+            if os.path.exists(entry['template']) : os.remove(entry['template'])
+      self.header_cache = {}
+
+   def header_key(self, header) :
+      """Return the key used to index the specified header text in the header cache."""
+      return hashlib.sha1(self.file_format + '\0' + header).hexdigest()
 
    def init_logger(self) :
-      """Configure a logger object for the parser."""
-      console = logging.StreamHandler(stream=sys.stderr)
-      console.setLevel(self.log_level)
-      fmtr = logging.Formatter(DEFAULT_LOG_FORMAT)
-      console.setFormatter(fmtr)
+      """
+      Configure a logger object for the parser. The console handler is created by the first parser
+      object and shared by all subsequent ones, since the 'cdlparser' logger is itself shared.
+      """
       self.logger = logging.getLogger('cdlparser')
-      self.logger.addHandler(console)
+      consoles = [h for h in self.logger.handlers if getattr(h, 'cdlparser_console', False)]
+      if consoles :
+         console = consoles[0]
+      else :
+         console = logging.StreamHandler(stream=sys.stderr)
+         console.setFormatter(logging.Formatter(DEFAULT_LOG_FORMAT))
+         console.cdlparser_console = True
+         self.logger.addHandler(console)
+      console.setLevel(self.log_level)
       self.logger.setLevel(self.log_level)
 
 #---------------------------------------------------------------------------------------------------
@@ -257,7 +1315,8 @@ class CDL3Parser(CDLParser) :
    tokens = [
       'NETCDF', 'DIMENSIONS', 'VARIABLES', 'DATA', 'IDENT', 'TERMSTRING',
       'BYTE_CONST', 'CHAR_CONST', 'SHORT_CONST', 'INT_CONST', 'FLOAT_CONST', 'DOUBLE_CONST',
-      'FILLVALUE', 'COMMENT', 'EQUALS', 'LBRACE', 'RBRACE', 'LPAREN', 'RPAREN', 'EOL'
+      'FILLVALUE', 'COMMENT', 'EQUALS', 'LBRACE', 'RBRACE', 'LPAREN', 'RPAREN', 'EOL',
+      'DATAARRAY'   # array of data values replayed from a compiled CDL file; never lexed
    ] + list(set(reserved_words.values()))
 
    # literal characters
@@ -309,6 +1368,7 @@ class CDL3Parser(CDLParser) :
       if len(parts) < 2 :
          raise CDLSyntaxError("A netCDF name is required")
       netcdfname = parts[1]
+      self.netcdf_lexend = t.lexpos + len(t.value)   # i.e. lexical position of the opening brace
       t.value = deescapify(netcdfname)
       return t
 
@@ -316,11 +1376,15 @@ class CDL3Parser(CDLParser) :
    def t_SECTION(self, t) :
       r'dimensions:|DIMENSIONS:|variables:|VARIABLES:|data:|DATA:'
       t.type = t.value[:-1].upper()
+      if t.type == 'DATA' : self.data_lexpos = t.lexpos
       return t
 
    # character strings
    @TOKEN(termstring)
    def t_TERMSTRING(self, t) :
+      if self.max_string_length and len(t.value)-2 > self.max_string_length :
+         raise CDLStringLengthError("String at line number %d exceeds the length limit of %d" \
+            % (t.lineno, self.max_string_length))
       tstring = expand_escapes(t.value)
       i = 0 ; j = len(tstring)
       if tstring[0]  == '"' : i = 1
@@ -430,12 +1494,18 @@ class CDL3Parser(CDLParser) :
       t.lexer.lineno += len(t.value)
 
    def t_error(self, t):
-      """Handles token errors."""
+      """Handles token errors. Runs of characters that cannot start a token are skipped in bulk."""
+      match = ILLEGAL_CHARS_RE.match(t.value)
+      nchars = match.end() if match else 1
       msg  = "Illegal character(s) encountered at line number %d, lexical position %d\n" \
-         % (t.lineno, t.lexpos)
-      msg += "Token value = '%s'" % t.value
+         % (t.lineno, self.lex_offset + t.lexpos)
+      msg += "Token value = '%s'" % t.value[:min(nchars,20)]
       self.logger.warning(msg)
-      t.lexer.skip(1)
+      self.nillegal += nchars
+      if self.max_illegal_chars and self.nillegal > self.max_illegal_chars :
+         raise CDLIllegalCharError("Number of illegal characters exceeds the limit of %d" \
+            % self.max_illegal_chars)
+      t.lexer.skip(nchars)
 
    ### PARSING RULES
    ### Note that the p_xxx method-naming convention used below is a requirement of the ply package.
@@ -443,17 +1513,104 @@ class CDL3Parser(CDLParser) :
    ### requirement.
 
    def p_ncdesc(self, p) :
-      """ncdesc : NETCDF init_netcdf LBRACE dimsection vasection datasection RBRACE"""
-      if self.ncdataset :
+      """ncdesc : NETCDF init_netcdf LBRACE dimsection vasection endheader datasection RBRACE"""
+      if self.deferred_data or self.fill_off : self.write_deferred_data()
+      if self.delta_hashes is not None : self.save_delta_hashes()
+      if self.stats_attributes and self.dataset is not None : self.write_stats_attributes()
+      if self.dataset is not None and self.dataset is not self.ncdataset :
+         self.dataset.close()
+      if self.ncdataset and self.ncdataset is not self.append_dataset :
          if self.close_on_completion : self.ncdataset.close()
          self.logger.info("Closed netCDF file " + self.ncfile)
       self.logger.info("Finished parsing")
 
    def p_init_netcdf(self, p) :
       """init_netcdf :"""
+      if self.validating :
+         # declarations and data are checked against an in-memory schema, and compared with the
+         # existing netCDF dataset when verifying; no output is produced
+         if self.verify_target is not None :
+            self.dataset = VerifyDataset(self.verify_target, chunk_size=self.chunk_size)
+            # data is compared in chunks as it is parsed, rather than once each array is complete
+            self.stream_chunks = self.recorder is None
+         else :
+            self.dataset = SchemaDataset()
+         return
+      if self.handler :
+         # declarations and data are passed to the event handler; no netCDF dataset is created
+         self.dataset = EventDataset(self.handler, chunk_size=self.chunk_size)
+         # data is passed on in chunks as it is parsed, unless whole arrays are being recorded
+         self.stream_chunks = self.recorder is None
+         return
+      if self.extract_counts is not None :
+         # data is extracted into in-memory arrays; no netCDF dataset is created
+         self.dataset = ArrayDataset(self.extract_counts)
+         return
+      if self.targets :
+         self.dataset = FanoutDataset(self.targets, self.file_format, workers=self.target_workers)
+         self.logger.info("Writing output to %d netCDF files using %d writer processes" \
+            % (len(self.targets), len(self.dataset.writers)))
+         return
       if not self.ncfile : self.set_filename(p[-1])
-      self.ncdataset = nc4.Dataset(self.ncfile, 'w', format=self.file_format)
-      self.logger.info("Initialised netCDF file " + self.ncfile)
+      if self.backend == 'npy' :
+         self.dataset = NpyDataset(self.ncfile, p[-1])
+         self.logger.info("Initialised NumPy output directory " + self.ncfile)
+         return
+      if self.shard_variables or self.shard_records :
+         self.dataset = ShardDataset(self.ncfile, self.file_format,
+            shard_variables=self.shard_variables, shard_records=self.shard_records,
+            workers=self.shard_workers)
+         self.logger.info("Started %d shard writer processes for %s" \
+            % (len(self.dataset.writers), self.ncfile))
+         return
+      if self.append_dataset is not None :
+         # header declarations are collected in memory and checked against the existing dataset
+         self.ncdataset = self.append_dataset
+         self.dataset = SchemaDataset()
+         return
+      if self.header_entry :
+         # clone the empty netCDF template saved for an identical CDL header
+         shutil.copyfile(self.header_entry['template'], self.ncfile)
+         self.created_output = True
+         self.ncdataset = nc4.Dataset(self.ncfile, 'a')
+         if self.record_major : self.set_fill_off()
+         self.dataset = self.init_writer(self.ncdataset)
+         self.rec_dimname = self.header_entry['rec_dimname']
+         self.logger.info("Initialised netCDF file %s from template" % self.ncfile)
+         return
+      if self.delta and os.path.exists(self.ncfile) :
+         # changes are applied to the existing file, if possible, once the header is parsed
+         self.delta_state = self.load_delta_hashes()
+      if self.update and not self.delta and os.path.exists(self.ncfile) :
+         # header declarations are reconciled with the existing file once the header is parsed
+         self.ncdataset = nc4.Dataset(self.ncfile, 'a')
+         self.dataset = self.schema = SchemaDataset()
+         self.logger.info("Opened netCDF file %s for update" % self.ncfile)
+         return
+      # the netCDF dataset is only created once the header has been parsed (see create_dataset)
+      self.dataset = self.schema = SchemaDataset()
+
+   def p_endheader(self, p) :
+      """endheader :"""
+      if self.append_dataset is not None :
+         check_schema(self.dataset, self.ncdataset)
+         self.dataset = self.init_writer(self.ncdataset)
+         self.record_offset = len(self.dataset.dimensions[self.rec_dimname])
+         self.logger.info("Header matches existing netCDF file %s; appending records after record %d" \
+            % (self.ncfile, self.record_offset))
+      elif self.schema is not None and self.ncdataset is not None :
+         self.update_dataset()
+      elif self.schema is not None and self.delta_state is not None :
+         self.apply_delta()
+      elif self.schema is not None :
+         if self.delta : self.delta_hashes = schema_hashes(self.schema)
+         self.create_dataset()
+         # templates can only be cached for headers lexed from the start of the CDL text
+         if self.cache_headers and self.data_lexpos is not None and self.segments is None \
+            and self.token_source is self.lexer :
+            self.cache_header()
+      elif self.dataset is not None and self.dataset is not self.ncdataset :
+         self.dataset.end_header()
 
    def p_dimsection(self, p) :
       """dimsection : DIMENSIONS dimdecls
@@ -487,13 +1644,13 @@ class CDL3Parser(CDLParser) :
          if dimlen <= 0 :
             raise CDLContentError("Length of dimension '%s' must be positive." % dimname)
       if dimname :
-         self.curr_dim = self.ncdataset.createDimension(dimname, dimlen)
+         self.curr_dim = self.dataset.createDimension(dimname, dimlen)
          unlim = " (unlimited)" if dimlen == 0 else ""
          self.logger.info("Created dimension %s with length %s%s" % (dimname, dimlen, unlim))
 
    def p_dimd(self, p) :
       """dimd : dim"""
-      if p[1] in self.ncdataset.dimensions :
+      if p[1] in self.dataset.dimensions :
          raise CDLContentError("Duplicate declaration for dimension '%s'." % p[1])
       p[0] = p[1]
 
@@ -528,16 +1685,20 @@ class CDL3Parser(CDLParser) :
 
    def p_varspec(self, p) :
       """varspec : var dimspec"""
-      if p[1] in self.ncdataset.variables :
+      if p[1] in self.dataset.variables :
          raise CDLContentError("Duplicate declaration of variable %s." % p[1])
       dims = len(p)==3 and p[2] or ()
-      self.curr_var = self.ncdataset.createVariable(p[1], self.datatype, dimensions=dims,
+      if self.max_var_size :
+         dimlens = [len(self.dataset.dimensions[d]) for d in dims if d in self.dataset.dimensions]
+         self.check_var_size(p[1], int(np.prod(dimlens, dtype=np.int64)))
+      self.curr_var = self.dataset.createVariable(p[1], self.datatype, dimensions=dims,
          shuffle=False)
       self.logger.info("Created variable %s with data type '%s' and dimensions %s" \
          % (p[1], self.datatype, dims))
 
    def p_var(self, p) :
       """var : IDENT"""
+      self.var_lineno = p.lineno(1)
       p[0] = p[1]
 
    def p_dimspec(self, p) :
@@ -566,12 +1727,12 @@ class CDL3Parser(CDLParser) :
    # attribute value. They cannot be prefixed with a type declaration, as is possible at CDL v4.
    def p_gattdecl(self, p) :
       """gattdecl : gatt EQUALS attvallist"""
-      if self.ncdataset :
+      if self.dataset :
          self.set_attribute(':'+p[1], p[3])
 
    def p_attdecl(self, p) :
       """attdecl : att EQUALS attvallist"""
-      if self.ncdataset :
+      if self.dataset :
          self.set_attribute(p[1], p[3])
 
    def p_att(self, p) :
@@ -585,11 +1746,11 @@ class CDL3Parser(CDLParser) :
    def p_avar(self, p) :
       """avar : var"""
       varname = p[1]
-      if self.ncdataset :
-         if varname not in self.ncdataset.variables :
+      if self.dataset :
+         if varname not in self.dataset.variables :
             raise CDLContentError("Variable %s is not defined or reference precedes definition." \
                % varname)
-         self.curr_var = self.ncdataset.variables[varname]
+         self.curr_var = self.dataset.variables[varname]
          self.logger.debug("Current variable set to '%s'" % varname)
       p[0] = varname
 
@@ -631,26 +1792,61 @@ class CDL3Parser(CDLParser) :
 
    def p_datadecl(self, p) :
       """datadecl : avar EQUALS constlist"""
-      if self.ncdataset :
-         if p[1] not in self.ncdataset.variables :
+      # values already spilled or streamed are counted in nvalues below, if they are kept
+      self.nflushed = 0
+      if self.dataset :
+         if p[1] not in self.dataset.variables :
             raise CDLContentError("Variable %s referenced in data section is not defined." % p[1])
-         var = self.ncdataset.variables[p[1]]
+         var = self.dataset.variables[p[1]]
          arr = p[3]
+         if self.recorder :
+            if isinstance(arr, list) and var.dtype.kind != 'S' :
+               arr = np.array(arr, dtype=var.dtype)
+            self.recorder.add_block(p[1], self.var_lineno, arr)
+         if self.append_dataset is not None and self.rec_dimname not in var.dimensions :
+            self.logger.info("Skipped data for fixed-size variable %s" % p[1])
+            return
+         if self.preview and not isinstance(arr, (ScratchArray, StreamedArray)) :
+            # data arrays replayed from compiled CDL files are truncated here
+            limit = self.preview_limit(var)
+            if limit is not None and len(arr) > limit : arr = arr[:limit]
          try :
+            if self.delta_hashes is not None and self.check_delta(var, arr) :
+               self.logger.info("Skipped unchanged data for variable %s" % p[1])
+               return
             self.write_var_data(var, arr)
+            self.nvalues += len(arr)
             self.logger.info("Wrote %d data value(s) for variable %s" % (len(arr), p[1]))
          except Exception, exc :
             self.logger.error(str(exc))
             raise
+         finally :
+            # scratch arrays holding deferred data are closed once parsing has finished
+            if isinstance(arr, ScratchArray) and p[1] not in self.deferred_data :
+               arr.close()
+               self.scratch_arrays.remove(arr)
 
    def p_constlist(self, p) :
       """constlist : constlist ',' dconst
                    | dconst"""
-      # FIXME: repeatedly appending values to a list will be inefficient for large data arrays
       if len(p) == 2 :
          p[0] = p[1:]
       else :
-         p[0] = p[1] + p[3:]
+         p[0] = p[1]
+         p[0].append(p[3])
+         # the size of a record variable is only known once all of its values have been read, so
+         # the running count is checked here rather than waiting for the whole list to accumulate
+         if self.max_var_size and len(p[0]) > self.max_var_size and self.curr_var is not None :
+            self.check_var_size(self.curr_var._name, len(p[0]))
+         if self.stream_chunks and isinstance(p[0], list) and len(p[0]) >= self.chunk_size :
+            p[0] = self.check_chunk_size(p[0])
+         if self.memory_limit and isinstance(p[0], list) : p[0] = self.check_memory_limit(p[0])
+         # values spilled to a scratch file or passed to the variable are reported as written
+         if isinstance(p[0], (ScratchArray, StreamedArray)) : self.nflushed = p[0].size
+
+   def p_constlist_array(self, p) :
+      """constlist : DATAARRAY"""
+      p[0] = p[1]
 
    def p_dconst(self, p) :
       """dconst : const"""
@@ -697,7 +1893,9 @@ class CDL3Parser(CDLParser) :
    def p_error(self, p) :
       """Handles parsing errors."""
       if p :
-         errmsg  = "Syntax error at line number %d, lexical position %d\n" % (p.lineno, p.lexpos)
+         # lexical positions within text passed in via feed() are relative to the current segment
+         errmsg  = "Syntax error at line number %d, lexical position %d\n" \
+            % (p.lineno, self.lex_offset + p.lexpos)
          errmsg += "Token = %s, value = '%s'" % (p.type, p.value)
       else :
          errmsg = "Syntax error: premature EOF encountered."
@@ -708,12 +1906,40 @@ class CDL3Parser(CDLParser) :
 
    # TODO: consider adding a '_' prefix to these methods to make them pseudo-private.
    def set_filename(self, ncname) :
-      """Sets the netCDF filename based on the netCDF name token in the CDL input."""
-      if self.cdlfile :
+      """
+      Sets the netCDF filename (or the output directory name for the 'npy' backend) based on the
+      netCDF name token in the CDL input.
+      """
+      if self.output_dir :
+         basedir = self.output_dir
+      elif self.cdlfile :
          basedir = os.path.dirname(self.cdlfile)
       else :
          basedir = os.path.abspath(".")
-      self.ncfile = os.path.join(basedir, ncname+'.nc')
+      ext = '.nc' if self.backend == 'netcdf' else ''
+      self.ncfile = os.path.join(basedir, ncname+ext)
+
+   def create_dataset(self) :
+      """
+      Create the netCDF dataset and the dimensions, variables and attributes recorded in the schema
+      of the CDL header. If the variables are too large for the requested file format then the
+      format is either promoted or an exception is raised, according to the format_policy.
+      """
+      file_format = self.file_format
+      if self.format_policy != 'ignore' and not format_can_hold(self.schema, file_format) :
+         errmsg = "Variables declared in CDL header are too large for netCDF file format %s" \
+            % file_format
+         if self.format_policy == 'error' : raise CDLFormatError(errmsg)
+         start = 1 if file_format.startswith('NETCDF3_64BIT') else 0
+         for file_format in FORMAT_PROMOTIONS[start+1:] :
+            if format_can_hold(self.schema, file_format) : break
+         self.logger.warning(errmsg + "; promoted to format %s" % file_format)
+      self.ncdataset = nc4.Dataset(self.ncfile, 'w', format=file_format)
+      self.created_output = True
+      if self.record_major : self.set_fill_off()
+      copy_schema(self.schema, self.ncdataset)
+      self.dataset = self.init_writer(self.ncdataset)
+      self.logger.info("Initialised netCDF file %s with format %s" % (self.ncfile, file_format))
 
    def set_attribute(self, attid, attvallist) :
       """Set a global or variable-scope attribute value."""
@@ -723,15 +1949,15 @@ class CDL3Parser(CDLParser) :
          attval = attvallist
       # global-scope attribute
       if attid[0] == ':' :
-         if attid[1:] in self.ncdataset.ncattrs() :
+         if attid[1:] in self.dataset.ncattrs() :
             raise CDLContentError("Duplicate global attribute: %s" % attid)
-         self.ncdataset.setncattr(attid[1:], attval)
+         self.dataset.setncattr(attid[1:], attval)
          self.logger.info("Created global attribute %s = %s" % (attid, repr(attval)))
       # variable-scope attribute
       else :
          try :
             (varname,attname) = attid.split(':')
-            var = self.ncdataset.variables[varname]
+            var = self.dataset.variables[varname]
             if attname in var.ncattrs() :
                raise CDLContentError("Duplicate attribute: %s" % attid)
             if attname == "_FillValue" :
@@ -741,6 +1967,44 @@ class CDL3Parser(CDLParser) :
          except :
             raise CDLContentError("Invalid attribute name specification: '%s'" % attid)
 
+   def check_chunk_size(self, arr) :
+      """
+      Check whether the data values accumulated in list arr have reached the chunk size. If so then
+      the values are transferred to a StreamedArray object, which is returned in place of arr, and
+      which passes each subsequent chunk of values to the dataset as soon as it has been parsed.
+      """
+      var = self.curr_var
+      if var is None or var.ndim == 0 or var.dtype.kind == 'S' : return arr
+      stats = None
+      if self.compute_stats : stats = self.stats.setdefault(var._name, VariableStats(var))
+      maxrows = None if self.rec_dimname in var.dimensions else var.shape[0]
+      sarr = StreamedArray(var, self.chunk_size, start=self.record_offset, maxrows=maxrows,
+         stats=stats)
+      sarr.extend(arr)
+      self.logger.debug("Streaming data values for variable %s in chunks" % var._name)
+      return sarr
+
+   def check_memory_limit(self, arr) :
+      """
+      Check whether the data values accumulated in list arr have exceeded the memory limit. If so
+      then the values are transferred to a ScratchArray object, which is returned in place of arr.
+      """
+      var = self.curr_var
+      if var is None or var.dtype.kind == 'S' : return arr   # only numeric variables get spilled
+      if len(arr) * BUFFERED_VALUE_SIZE <= self.memory_limit : return arr
+      sarr = ScratchArray(var.dtype, self.memory_limit, dirname=self.scratch_dir)
+      self.scratch_arrays.append(sarr)
+      sarr.extend(arr)
+      self.logger.info("Spilled data values for variable %s to scratch file %s" \
+         % (var._name, sarr.filename))
+      return sarr
+
+   def check_var_size(self, varname, nvalues) :
+      """Check the number of values in the specified variable against the max_var_size limit."""
+      if nvalues > self.max_var_size :
+         raise CDLVariableSizeError("Size of variable %s (%d values) exceeds the limit of %d" \
+            % (varname, nvalues, self.max_var_size))
+
    # FIXME: this method is too long - consider refactoring
    def write_var_data(self, var, arr) :
       """Write data array to variable var."""
@@ -755,12 +2019,21 @@ class CDL3Parser(CDLParser) :
       is_scalar = (var.ndim == 0)
       is_charvar = (var.dtype.kind == 'S')
       is_recvar = self.rec_dimname in var.dimensions
+      stats = None
+      if self.compute_stats and not is_charvar :
+         stats = self.stats.setdefault(var._name, VariableStats(var))
 
       # scalar variables ought to be fairly straightforward      
       if is_scalar :
          try :
+            if self.defer_writes() :
+               self.defer_var_data(var, [arr[0]], stats=stats)
+               return
             var.assignValue(arr[0])
             self.logger.debug("Assigned value %r to scalar variable %s" % (arr[0], var._name))
+            if stats : stats.update(np.asarray(arr[0], dtype=var.dtype))
+         except CDLWriteError :
+            raise
          except :
             errmsg = "Error attempting to assign data value to scalar variable %s" % var._name
             self.logger.error(errmsg)
@@ -779,14 +2052,15 @@ class CDL3Parser(CDLParser) :
 
       # see if we're dealing with a record variable; if so then work out the record length and, if
       # length of record dimension is 0, assume that total variable length = length of input array
+      # (records appended to an existing dataset are counted from the current record offset)
       if is_recvar :
-         rec_dimlen = len(self.ncdataset.dimensions[self.rec_dimname])
+         rec_dimlen = len(self.dataset.dimensions[self.rec_dimname]) - self.record_offset
+         recshape = var.shape[1:-1] if is_charvar else var.shape[1:]
+         reclen = int(np.prod(recshape))
          if rec_dimlen > 0 :   # record dimension has been set to non-zero
-            reclen = varlen / rec_dimlen
+            varlen = rec_dimlen * reclen
          else :                # record dimension is still equal to zero
             varlen = arrlen
-            reclen = 1
-            if var.ndim > 1 : reclen = reduce(lambda x,y: x*y, [x for x in var.shape if x > 0])
             self.logger.debug("Expected length of variable = %d" % varlen)
          # check that reclen is integer factor of variable length
          if varlen % reclen != 0 :
@@ -795,52 +2069,2355 @@ class CDL3Parser(CDLParser) :
          self.logger.debug("Length of one data record = %d" % reclen)
 
       # pad out data array with fill values if too few values were defined in the CDL source
+      if self.max_var_size : self.check_var_size(var._name, varlen)
       if arrlen < varlen :
-         pad_array(var, varlen, arr)
+         arr = pad_array(var, varlen, arr)
          self.logger.info("Padded input data array with %d fill values" % (varlen-arrlen))
          arrlen = len(arr)
 
       # convert input data to suitably shaped numpy array
       try :
-         if is_charvar :
-            put_char_data(var, arr, reclen)
+         if self.defer_writes() :
+            self.defer_var_data(var, arr, reclen, stats=stats)
+         elif isinstance(arr, StreamedArray) :
+            arr.flush(final=True)
+         elif is_charvar :
+            put_char_data(var, arr, reclen, start=self.record_offset)
          else :
-            put_numeric_data(var, arr, reclen)
+            put_numeric_data(var, arr, reclen, start=self.record_offset, stats=stats)
+      except CDLWriteError :
+         raise
       except Exception, exc :
          errmsg = "Error attempting to write data array for variable %s\n" % var._name
          errmsg += "Exception details are as follows:\n%s" % str(exc)
          raise CDLContentError(errmsg)
 
-   def _lextest(self, data) :
-      """private method - for test purposes only"""
-      self.lexer.input(data)
-      print "-----"
-      while 1 :
-         t = self.lexer.token()
-         if not t : break
-         print "type: %-15s\tvalue: %s" % (t.type, t.value)
-      print "-----"
-
-#---------------------------------------------------------------------------------------------------
-def put_numeric_data(var, arr, reclen=0) :
-#---------------------------------------------------------------------------------------------------
-   """Write numeric data array to netcdf variable."""
-   nparr = np.array(arr, dtype=var.dtype)
-   shape = list(var.shape)
-   if reclen : shape[0] = len(arr) / reclen
-   nparr.shape = shape
-   var[:] = nparr
+   def defer_writes(self) :
+      """
+      Return true if data is being buffered for writing in record-major order. This is not done
+      when a netCDF file is updated in place, since unchanged record variables would be overwritten.
+      """
+      return self.record_major and self.ncdataset is not None and not self.validating \
+         and not self.delta_inplace
 
-#---------------------------------------------------------------------------------------------------
-def put_char_data(var, arr, reclen=0) :
-#---------------------------------------------------------------------------------------------------
-   """Write character data array to netcdf variable."""
-   maxlen = var.shape[-1] if var.ndim > 0 else 1
-   nparr = str_list_to_char_arr(arr, maxlen)
-   shape = list(var.shape)
-   if reclen : shape[0] = len(arr) / reclen
-   nparr.shape = shape
-   var[:] = nparr
+   def set_fill_off(self) :
+      """
+      Turn off fill mode for the newly created netCDF dataset. Fill values are then only written
+      explicitly by the write_deferred_data method, for variables not assigned any data.
+      """
+      self.ncdataset.set_fill_off()
+      self.fill_off = True
+
+   def defer_var_data(self, var, arr, reclen=0, stats=None) :
+      """
+      Convert data array arr to a numpy array having the shape of variable var, and buffer it for
+      writing by the write_deferred_data method. For record variables the length of the first
+      axis is the number of records defined by arr.
+      """
+      shape = list(var.shape)
+      if reclen : shape[0] = len(arr) / reclen
+      if var.dtype.kind == 'S' :
+         maxlen = var.shape[-1] if var.ndim > 0 else 1
+         nparr = str_list_to_char_arr(arr, maxlen).reshape(shape)
+      elif isinstance(arr, ScratchArray) :
+         nparr = arr.asarray().reshape(shape)
+      else :
+         nparr = np.asarray(arr, dtype=var.dtype).reshape(shape)
+      if stats : stats.update(nparr)
+      self.deferred_data[var._name] = nparr
+
+   def write_deferred_data(self) :
+      """
+      Write the data buffered in record-major mode. Fixed-size variables are written first, in
+      header declaration order. Record variables are then written a block of records at a time,
+      cycling through all of the record variables for each block, so that the output file is
+      written more or less sequentially. Record variables with fewer records than the largest
+      one are padded with fill values.
+      """
+      variables = self.dataset.variables.values()
+      recvars = [var for var in variables if self.rec_dimname in var.dimensions]
+      for var in variables :
+         if var in recvars : continue
+         nparr = self.deferred_data.get(var._name)
+         if nparr is None and not self.fill_off : continue
+         if var.ndim == 0 :
+            var.assignValue(get_fill_value(var) if nparr is None else nparr)
+            continue
+         nrows = max(1, RECORD_BLOCK_SIZE / max(1, row_size(var)))
+         for i in range(0, var.shape[0], nrows) :
+            stop = min(i+nrows, var.shape[0])
+            var[i:stop] = data_block(var, nparr, i, stop)
+      self.logger.debug("Wrote data for fixed-size variables in declaration order")
+
+      nrecs = max([len(self.deferred_data.get(var._name, [])) for var in recvars] or [0])
+      if not nrecs : return
+      start = self.record_offset
+      if self.fill_off :
+         # set the length of the record dimension once by writing the last record first
+         var = recvars[0]
+         var[start+nrecs-1] = data_block(var, self.deferred_data.get(var._name), nrecs-1, nrecs)[0]
+      nrows = max(1, RECORD_BLOCK_SIZE / max(1, sum([row_size(var) for var in recvars])))
+      for i in range(0, nrecs, nrows) :
+         stop = min(i+nrows, nrecs)
+         for var in recvars :
+            var[start+i:start+stop] = data_block(var, self.deferred_data.get(var._name), i, stop)
+      self.logger.info("Wrote %d record(s) for %d record variable(s) in record-major order" \
+         % (nrecs, len(recvars)))
+
+   def update_dataset(self) :
+      """
+      Apply the dimensions, variables and attributes recorded in the schema of the CDL header to
+      the netCDF dataset opened for update, and arrange for record data to be appended after the
+      existing records or, if update_records is 'overwrite', written from the first record.
+      """
+      nchanges = update_schema(self.schema, self.ncdataset)
+      self.dataset = self.init_writer(self.ncdataset)
+      self.rec_dimname = None
+      for dimname, dim in self.dataset.dimensions.items() :
+         if dim.isunlimited() : self.rec_dimname = dimname
+      if self.rec_dimname and self.update_records == 'append' :
+         self.record_offset = len(self.dataset.dimensions[self.rec_dimname])
+         self.logger.info("Applied %d header change(s) to netCDF file %s; appending records after "
+            "record %d" % (nchanges, self.ncfile, self.record_offset))
+      else :
+         self.record_offset = 0
+         self.logger.info("Applied %d header change(s) to netCDF file %s; overwriting records" \
+            % (nchanges, self.ncfile))
+
+   def load_delta_hashes(self) :
+      """
+      Load the hashes saved for the existing netCDF file. Returns None if the sidecar file does not
+      exist or cannot be read, in which case the netCDF file is rebuilt.
+      """
+      try :
+         f = open(self.ncfile + DELTA_SUFFIX)
+         try :
+            return json.load(f)
+         finally :
+            f.close()
+      except (IOError, ValueError) :
+         return None
+
+   def apply_delta(self) :
+      """
+      Open the existing netCDF file for update in place and rewrite the attributes of any variables,
+      or the global attributes, whose declarations have changed. If any dimension or variable
+      definitions have changed then the netCDF file is rebuilt instead.
+      """
+      self.delta_hashes = schema_hashes(self.schema)
+      structure, declarations = self.delta_hashes
+      if structure != self.delta_state['schema'] :
+         self.logger.info("Dimension or variable definitions have changed; rebuilding netCDF file "
+            + self.ncfile)
+         self.delta_state = None
+         self.create_dataset()
+         return
+      self.ncdataset = nc4.Dataset(self.ncfile, 'a')
+      nchanges = 0
+      for name, digest in declarations.items() :
+         if digest == self.delta_state['declarations'].get(name) : continue
+         obj = self.schema.variables[name] if name else self.schema
+         ncobj = self.ncdataset.variables[name] if name else self.ncdataset
+         for attname in ncobj.ncattrs() :
+            if attname not in obj.ncattrs() : ncobj.delncattr(attname)
+         for attname in obj.ncattrs() :
+            if attname != '_FillValue' : ncobj.setncattr(attname, obj.getncattr(attname))
+         nchanges += 1
+      self.dataset = self.init_writer(self.ncdataset)
+      self.delta_inplace = True
+      self.logger.info("Opened netCDF file %s for update in place; rewrote attributes of %d "
+         "declaration(s)" % (self.ncfile, nchanges))
+
+   def check_delta(self, var, arr) :
+      """
+      Record the hash of data array arr, and for record variables the number of records, defined
+      for variable var. Returns true if the netCDF file is being updated in place and the data is
+      unchanged, in which case it need not be written again.
+      """
+      digest = data_hash(var, arr)
+      self.delta_data[var._name] = digest
+      if self.rec_dimname in var.dimensions :
+         recshape = var.shape[1:-1] if var.dtype.kind == 'S' else var.shape[1:]
+         self.delta_records[var._name] = len(arr) / max(1, int(np.prod(recshape)))
+      if not self.delta_inplace or digest is None : return False
+      return self.delta_state['data'].get(var._name) == digest
+
+   def save_delta_hashes(self) :
+      """
+      Save the hashes for the netCDF file just generated to the sidecar file. If the file has been
+      updated in place but contains data no longer defined in the CDL input, i.e. if data for a
+      variable has been removed or the number of records has decreased, then the file is marked
+      for rebuilding instead.
+      """
+      hashfile = self.ncfile + DELTA_SUFFIX
+      if self.delta_inplace :
+         old_nrecs = max(self.delta_state['records'].values() or [0])
+         new_nrecs = max(self.delta_records.values() or [0])
+         removed = [name for name in self.delta_state['data'] if name not in self.delta_data]
+         if new_nrecs < old_nrecs or removed :
+            self.logger.info("Data removed from CDL input; rebuilding netCDF file " + self.ncfile)
+            os.remove(hashfile)
+            self.delta_rebuild = True
+            return
+      structure, declarations = self.delta_hashes
+      hashes = dict(schema=structure, declarations=declarations, data=self.delta_data,
+         records=self.delta_records)
+      f = open(hashfile, 'w')
+      try :
+         json.dump(hashes, f, indent=1)
+      finally :
+         f.close()
+      self.logger.info("Saved content hashes to file " + hashfile)
+
+   def write_stats_attributes(self) :
+      """Save the statistics computed for each variable as attributes of that variable."""
+      for varname, stats in self.stats.items() :
+         var = self.dataset.variables[varname]
+         for attname, attval in stats.attributes(var.dtype).items() :
+            var.setncattr(attname, attval)
+         self.logger.info("Saved summary statistics for variable %s as attributes" % varname)
+
+   def _lextest(self, data) :
+      """private method - for test purposes only"""
+      self.build_parser()
+      self.lexer.input(data)
+      print "-----"
+      while 1 :
+         t = self.lexer.token()
+         if not t : break
+         print "type: %-15s\tvalue: %s" % (t.type, t.value)
+      print "-----"
+
+#---------------------------------------------------------------------------------------------------
+class SchemaDimension(object) :
+#---------------------------------------------------------------------------------------------------
+   """An in-memory stand-in for a netCDF4.Dimension object."""
+   def __init__(self, name, size=None) :
+      self._name = name
+      self.size = size or 0
+      self.unlimited = not size
+
+   def __len__(self) :
+      return self.size
+
+   def isunlimited(self) :
+      return self.unlimited
+
+#---------------------------------------------------------------------------------------------------
+class SchemaVariable(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   An in-memory stand-in for a netCDF4.Variable object. Only the parts of the netCDF4.Variable
+   interface used by the parser are implemented, i.e. the dtype, dimensions, shape, ndim and size
+   properties, plus methods for setting and querying attributes. As with netCDF4.Variable objects,
+   attribute values can also be retrieved using regular attribute syntax, e.g. var.units
+   """
+   def __init__(self, dataset, name, datatype, dimensions=()) :
+      self.__dict__['_dataset'] = dataset
+      self.__dict__['_name'] = name
+      self.__dict__['_attrs'] = OrderedDict()
+      self.__dict__['dtype'] = np.dtype(datatype)
+      self.__dict__['dimensions'] = tuple(dimensions)
+
+   def __getattr__(self, name) :
+      attrs = self.__dict__.get('_attrs', {})
+      if name not in attrs :
+         raise AttributeError("Variable has no attribute '%s'" % name)
+      return attrs[name]
+
+   @property
+   def shape(self) :
+      return tuple([len(self._dataset.dimensions[d]) for d in self.dimensions])
+
+   @property
+   def ndim(self) :
+      return len(self.dimensions)
+
+   @property
+   def size(self) :
+      return int(np.prod(self.shape))
+
+   def ncattrs(self) :
+      return self._attrs.keys()
+
+   def getncattr(self, name) :
+      return self._attrs[name]
+
+   def setncattr(self, name, value) :
+      self._attrs[name] = value
+      self._dataset.attribute_set(self, name, value)
+
+   def __setitem__(self, key, value) :
+      self._dataset.write_data(self, key, np.asarray(value))
+
+   def assignValue(self, value) :
+      self._dataset.write_data(self, Ellipsis, np.asarray(value, dtype=self.dtype))
+
+#---------------------------------------------------------------------------------------------------
+class SchemaDataset(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   An in-memory stand-in for a netCDF4.Dataset object, which records the dimensions, variables and
+   attributes declared in the header section of a CDL document. Only the parts of the
+   netCDF4.Dataset interface used by the parser are implemented.
+
+   Subclasses can act upon declarations and data by overriding the hook methods attribute_set and
+   write_data, and by extending the createDimension and createVariable methods.
+   """
+   def __init__(self) :
+      self.__dict__['dimensions'] = OrderedDict()
+      self.__dict__['variables'] = OrderedDict()
+      self.__dict__['_attrs'] = OrderedDict()
+
+   def __getattr__(self, name) :
+      attrs = self.__dict__.get('_attrs', {})
+      if name not in attrs :
+         raise AttributeError("Dataset has no attribute '%s'" % name)
+      return attrs[name]
+
+   def createDimension(self, dimname, size=None) :
+      dim = SchemaDimension(dimname, size)
+      self.dimensions[dimname] = dim
+      return dim
+
+   def createVariable(self, varname, datatype, dimensions=(), **kwargs) :
+      var = SchemaVariable(self, varname, datatype, dimensions)
+      if kwargs.get('fill_value') is not None : var.setncattr('_FillValue', kwargs['fill_value'])
+      self.variables[varname] = var
+      return var
+
+   def ncattrs(self) :
+      return self._attrs.keys()
+
+   def getncattr(self, name) :
+      return self._attrs[name]
+
+   def setncattr(self, name, value) :
+      self._attrs[name] = value
+      self.attribute_set(None, name, value)
+
+   def attribute_set(self, var, name, value) :
+      """
+      Hook method called when an attribute is set on the dataset (var is None) or on a variable.
+      The base class implementation does nothing.
+      """
+      pass
+
+   def end_header(self) :
+      """
+      Hook method called once all of the declarations in the header section have been parsed. The
+      base class implementation does nothing.
+      """
+      pass
+
+   def write_data(self, var, key, value) :
+      """
+      Hook method called when a numpy array is assigned to a region of a variable, as defined by
+      key. The base class implementation discards the data, but updates the current length of the
+      unlimited dimension if var is a record variable.
+      """
+      if var.dimensions and self.dimensions[var.dimensions[0]].isunlimited() :
+         dim = self.dimensions[var.dimensions[0]]
+         dim.size = max(dim.size, first_axis_range(key, value)[1])
+
+   def close(self) :
+      pass
+
+#---------------------------------------------------------------------------------------------------
+class EventDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that passes each dimension, variable, attribute and data array to the
+   corresponding method of an event handler object. Data arrays are split into chunks along the
+   first dimension such that no chunk contains more than chunk_size values (unless a single
+   row along the first dimension is larger than that). The parser passes the data values for
+   each numeric variable to the dataset, via a StreamedArray object, as each chunk is parsed.
+   """
+   def __init__(self, handler, chunk_size=DEFAULT_CHUNK_SIZE) :
+      super(EventDataset, self).__init__()
+      self.__dict__['handler'] = handler
+      self.__dict__['chunk_size'] = chunk_size
+
+   def createDimension(self, dimname, size=None) :
+      dim = super(EventDataset, self).createDimension(dimname, size)
+      self.handler.on_dimension(dimname, size or None)
+      return dim
+
+   def createVariable(self, varname, datatype, dimensions=(), **kwargs) :
+      var = super(EventDataset, self).createVariable(varname, datatype, dimensions, **kwargs)
+      self.handler.on_variable(varname, var.dtype, var.dimensions)
+      return var
+
+   def attribute_set(self, var, name, value) :
+      self.handler.on_attribute(var._name if var is not None else None, name, value)
+
+   def write_data(self, var, key, value) :
+      super(EventDataset, self).write_data(var, key, value)
+      if value.ndim == 0 :
+         self.handler.on_data_chunk(var._name, value, 0)
+         return
+      start = first_axis_range(key, value)[0]
+      rowlen = value.size / value.shape[0] if value.shape[0] else 1
+      nrows = max(1, self.chunk_size / max(1, rowlen))
+      for i in range(0, value.shape[0], nrows) :
+         self.handler.on_data_chunk(var._name, value[i:i+nrows], start+i)
+
+   def close(self) :
+      self.handler.on_end()
+
+#---------------------------------------------------------------------------------------------------
+class VerifyDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that compares the declarations and data in a CDL document with those in an
+   existing netCDF dataset, which should be opened with automatic masking and scaling turned off.
+   Messages describing the differences are appended to the differences list.
+
+   Dimensions, variable definitions and attributes, including attribute types, are compared once
+   the header has been parsed. Each data array is then compared, as padded by the parser, with the
+   corresponding region of the netCDF variable, which is read a chunk of no more than chunk_size
+   values at a time (unless a single row along the first dimension is larger than that). Numeric
+   data is passed to the dataset by the parser in chunks of this size as it is parsed, so the values
+   of a large variable are never all held in memory at once. Values are compared exactly, bar NaNs,
+   which compare equal. Only the first differing index is reported for each variable. Finally, any
+   variables, or records, not assigned data in the CDL document are checked for fill values, as
+   written by the netCDF library.
+   """
+   def __init__(self, ncdataset, chunk_size=DEFAULT_CHUNK_SIZE) :
+      super(VerifyDataset, self).__init__()
+      self.__dict__['ncdataset'] = ncdataset
+      self.__dict__['chunk_size'] = chunk_size
+      self.__dict__['differences'] = []
+      self.__dict__['comparable'] = set()   # names of variables with matching definitions
+      self.__dict__['nrows'] = {}           # number of rows compared, keyed by variable name
+
+   def difference(self, msg) :
+      self.differences.append(msg)
+
+   def end_header(self) :
+      ncdataset = self.ncdataset
+      for dimname in merge_names(self.dimensions, ncdataset.dimensions) :
+         if dimname not in ncdataset.dimensions or dimname not in self.dimensions :
+            self.difference("Dimension '%s' is not defined in both CDL and netCDF files" % dimname)
+            continue
+         dim, ncdim = self.dimensions[dimname], ncdataset.dimensions[dimname]
+         if dim.isunlimited() != ncdim.isunlimited() or \
+            (not dim.isunlimited() and len(dim) != len(ncdim)) :
+            self.difference("Definition of dimension '%s' differs" % dimname)
+      for varname in merge_names(self.variables, ncdataset.variables) :
+         if varname not in ncdataset.variables or varname not in self.variables :
+            self.difference("Variable '%s' is not defined in both CDL and netCDF files" % varname)
+            continue
+         var, ncvar = self.variables[varname], ncdataset.variables[varname]
+         if var.dtype != ncvar.dtype or tuple(var.dimensions) != tuple(ncvar.dimensions) :
+            self.difference("Definition of variable '%s' differs" % varname)
+            continue
+         self.compare_attributes(var, ncvar, varname+':')
+         self.comparable.add(varname)
+      self.compare_attributes(self, ncdataset, ':')
+
+   def compare_attributes(self, obj, ncobj, prefix) :
+      """Compare the names, values and types of the attributes attached to obj and ncobj."""
+      for attname in merge_names(obj.ncattrs(), ncobj.ncattrs()) :
+         if attname not in obj.ncattrs() or attname not in ncobj.ncattrs() :
+            self.difference("Attribute %s%s is not defined in both CDL and netCDF files" \
+               % (prefix, attname))
+            continue
+         val, ncval = obj.getncattr(attname), ncobj.getncattr(attname)
+         if isinstance(val, basestring) and isinstance(ncval, basestring) :
+            same = val == ncval
+         else :
+            same = np.asarray(val).dtype == np.asarray(ncval).dtype and \
+               attribute_values_equal(val, ncval)
+         if not same :
+            self.difference("Value of attribute %s%s differs: %r (CDL) != %r (netCDF)" \
+               % (prefix, attname, val, ncval))
+
+   def write_data(self, var, key, value) :
+      super(VerifyDataset, self).write_data(var, key, value)
+      if var._name not in self.comparable : return
+      ncvar = self.ncdataset.variables[var._name]
+      if value.ndim == 0 :
+         self.compare_chunk(var, value, ncvar.getValue(), 0)
+         self.nrows[var._name] = 1
+         return
+      start = first_axis_range(key, value)[0]
+      stop = min(start + value.shape[0], len(ncvar))
+      rowlen = value.size / value.shape[0] if value.shape[0] else 1
+      step = max(1, self.chunk_size / max(1, rowlen))
+      for i in range(start, stop, step) :
+         end = min(i+step, stop)
+         if not self.compare_chunk(var, value[i-start:end-start], ncvar[i:end], i) : break
+      self.nrows[var._name] = max(self.nrows.get(var._name, 0), stop)
+
+   def compare_chunk(self, var, expected, actual, start) :
+      """
+      Compare the expected values for variable var with the actual values read from the netCDF
+      variable, beginning at index start of the first dimension. If they differ then the first
+      differing index is reported, and the variable is excluded from further comparison.
+      """
+      expected = np.asarray(expected, dtype=var.dtype)
+      actual = np.asarray(actual).reshape(expected.shape)
+      equal = np.atleast_1d(expected == actual)
+      if var.dtype.kind == 'f' : equal |= np.atleast_1d(np.isnan(expected) & np.isnan(actual))
+      if equal.all() : return True
+      pos = np.argmin(equal.ravel())
+      index = np.unravel_index(pos, expected.shape) if expected.ndim else ()
+      if index : index = (start + index[0],) + tuple(index[1:])
+      self.difference("Data for variable %s differs at index %s: %r (CDL) != %r (netCDF)" \
+         % (var._name, tuple([int(i) for i in index]), expected.ravel()[pos],
+         np.asarray(actual).ravel()[pos]))
+      self.comparable.discard(var._name)
+      return False
+
+   def close(self) :
+      for dimname, dim in self.dimensions.items() :
+         if dim.isunlimited() and dimname in self.ncdataset.dimensions and \
+            len(dim) != len(self.ncdataset.dimensions[dimname]) :
+            self.difference("Number of records differs: %d (CDL) != %d (netCDF)" \
+               % (len(dim), len(self.ncdataset.dimensions[dimname])))
+      for varname in self.variables :
+         if varname not in self.comparable : continue
+         # unwritten values are set to the _FillValue or, failing that, the default fill value
+         var, ncvar = self.variables[varname], self.ncdataset.variables[varname]
+         if '_FillValue' in var.ncattrs() :
+            fill_value = var._FillValue
+         else :
+            fill_value = get_default_fill_value(var.dtype.char)
+         nrows = self.nrows.get(varname, 0)
+         if var.ndim == 0 :
+            if not nrows : self.compare_chunk(var, fill_value, ncvar.getValue(), 0)
+            continue
+         rowlen = int(np.prod(ncvar.shape[1:]))
+         step = max(1, self.chunk_size / max(1, rowlen))
+         for i in range(nrows, len(ncvar), step) :
+            actual = ncvar[i:i+step]
+            expected = np.empty(actual.shape, dtype=var.dtype)
+            expected.fill(fill_value)
+            if not self.compare_chunk(var, expected, actual, i) : break
+
+#---------------------------------------------------------------------------------------------------
+class NpyDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that writes the data for each variable to a NumPy .npy file, named after the
+   variable, within the specified output directory. The arrays have the shape and data type of the
+   declared variables and can be opened without copying via numpy.load(filename, mmap_mode='r').
+   On closing the dataset any unwritten elements are set to the variable's fill value, and a JSON
+   file (named after the dataset) describing the dimensions, variables and attributes is saved. If
+   the JSON file cannot be written then the output directory is deleted, if it was created by the
+   dataset.
+
+   Since the length of the unlimited dimension is not known until all data has been written, each
+   .npy file is created with a fixed-length header large enough to hold any shape. Data is written
+   via numpy.memmap views onto the relevant region of each file, and the header is updated with the
+   final shape of the array when the dataset is closed.
+   """
+   def __init__(self, dirname, name) :
+      super(NpyDataset, self).__init__()
+      self.__dict__['dirname'] = dirname
+      self.__dict__['name'] = name
+      self.__dict__['files'] = {}
+      self.__dict__['created'] = not os.path.isdir(dirname)
+      if self.created : os.makedirs(dirname)
+
+   def npy_filename(self, var) :
+      return os.path.join(self.dirname, var._name + '.npy')
+
+   def open_npy_file(self, var) :
+      """Create the .npy file for var, if necessary, returning the length of its header."""
+      if var._name not in self.files :
+         maxshape = (10**18,) * var.ndim
+         header = npy_header(var.dtype, maxshape)
+         f = open(self.npy_filename(var), 'wb')
+         f.write(header)
+         f.close()
+         self.files[var._name] = dict(hdrlen=len(header), nrows=0)
+      return self.files[var._name]['hdrlen']
+
+   def write_region(self, var, start, value) :
+      """Write array value to var via a memory-mapped view beginning at the specified row."""
+      hdrlen = self.open_npy_file(var)
+      if value.size == 0 : return
+      rowbytes = var.dtype.itemsize * int(np.prod(var.shape[1:]))
+      mm = np.memmap(self.npy_filename(var), dtype=var.dtype, mode='r+',
+         offset=hdrlen + start*rowbytes, shape=value.shape or (1,))
+      mm[...] = value.reshape(mm.shape)
+      mm.flush()
+      del mm
+
+   def write_data(self, var, key, value) :
+      super(NpyDataset, self).write_data(var, key, value)
+      value = np.asarray(value, dtype=var.dtype)
+      if var.ndim == 0 :
+         self.write_region(var, 0, value)
+         self.files[var._name]['nrows'] = 1
+         return
+      start, stop = first_axis_range(key, value)
+      self.write_region(var, start, value.reshape((stop-start,) + var.shape[1:]))
+      self.files[var._name]['nrows'] = max(self.files[var._name]['nrows'], stop)
+
+   def close(self) :
+      for var in self.variables.values() :
+         # fill any rows not written from the CDL data section, then record the final shape
+         nrows = self.files[var._name]['nrows'] if var._name in self.files else 0
+         hdrlen = self.open_npy_file(var)
+         shape = var.shape
+         rowshape = shape[1:]
+         step = max(1, DEFAULT_CHUNK_SIZE / max(1, int(np.prod(rowshape))))
+         nrows_total = shape[0] if shape else 1
+         for i in range(nrows, nrows_total, step) :
+            fill = np.empty((min(step, nrows_total-i),) + rowshape, dtype=var.dtype)
+            fill.fill(get_fill_value(var))
+            self.write_region(var, i, fill)
+         f = open(self.npy_filename(var), 'r+b')
+         f.write(npy_header(var.dtype, shape, hdrlen))
+         f.close()
+      try :
+         self.write_metadata()
+      except :
+         # don't leave a partially written output directory behind
+         if self.created : shutil.rmtree(self.dirname, ignore_errors=True)
+         raise
+
+   def write_metadata(self) :
+      """Write the JSON file describing the dimensions, variables and attributes."""
+      meta = OrderedDict()
+      meta['name'] = self.name
+      meta['dimensions'] = OrderedDict([(dim._name, OrderedDict([('size', len(dim)),
+         ('unlimited', dim.isunlimited())])) for dim in self.dimensions.values()])
+      meta['variables'] = OrderedDict()
+      for var in self.variables.values() :
+         meta['variables'][var._name] = OrderedDict([
+            ('file', os.path.basename(self.npy_filename(var))),
+            ('dtype', var.dtype.str),
+            ('dimensions', list(var.dimensions)),
+            ('shape', list(var.shape)),
+            ('attributes', OrderedDict([(name, json_value(var.getncattr(name))) \
+               for name in var.ncattrs()])),
+         ])
+      meta['attributes'] = OrderedDict([(name, json_value(self.getncattr(name))) \
+         for name in self.ncattrs()])
+      f = open(os.path.join(self.dirname, self.name + '.json'), 'w')
+      json.dump(meta, f, indent=2)
+      f.close()
+
+#---------------------------------------------------------------------------------------------------
+class WriterDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that mirrors the schema of a netCDF4.Dataset object and forwards all dimension,
+   variable, attribute and data operations to it via a bounded queue serviced by a writer thread.
+   The writer thread has sole use of the netCDF4.Dataset object until the close() method has been
+   called; in the meantime the parser obtains any information it needs from the in-memory mirror.
+
+   If a netCDF operation fails then the exception is saved, along with the name of the variable
+   (or dimension or attribute) concerned and the line number supplied by the optional lineno
+   callable, and any further operations are discarded. The error is re-raised as a CDLWriteError
+   exception by the next call to write_data, sync or close.
+   """
+   def __init__(self, ncdataset, lineno=None, queue_size=WRITE_QUEUE_SIZE) :
+      super(WriterDataset, self).__init__()
+      self.__dict__['ncdataset'] = ncdataset
+      self.__dict__['lineno'] = lineno or (lambda : 0)
+      self.__dict__['queue'] = Queue.Queue(queue_size)
+      self.__dict__['error'] = None
+      # mirror any declarations already present in the netCDF dataset
+      for dimname, ncdim in ncdataset.dimensions.items() :
+         size = None if ncdim.isunlimited() else len(ncdim)
+         SchemaDataset.createDimension(self, dimname, size).size = len(ncdim)
+      for varname, ncvar in ncdataset.variables.items() :
+         var = SchemaDataset.createVariable(self, varname, ncvar.dtype, ncvar.dimensions)
+         for attname in ncvar.ncattrs() : var._attrs[attname] = ncvar.getncattr(attname)
+      for attname in ncdataset.ncattrs() : self._attrs[attname] = ncdataset.getncattr(attname)
+      thread = threading.Thread(target=self.run_writer, name='cdlparser-writer')
+      thread.daemon = True
+      thread.start()
+      self.__dict__['thread'] = thread
+
+   def createDimension(self, dimname, size=None) :
+      dim = super(WriterDataset, self).createDimension(dimname, size)
+      self.submit("dimension " + dimname, self.ncdataset.createDimension, dimname, size)
+      return dim
+
+   def createVariable(self, varname, datatype, dimensions=(), **kwargs) :
+      var = SchemaVariable(self, varname, datatype, dimensions)
+      if kwargs.get('fill_value') is not None : var._attrs['_FillValue'] = kwargs['fill_value']
+      self.variables[varname] = var
+      self.submit("variable " + varname, self.ncdataset.createVariable, varname, datatype,
+         dimensions, **kwargs)
+      return var
+
+   def attribute_set(self, var, name, value) :
+      if var is None :
+         self.submit("global attribute " + name, self.ncdataset.setncattr, name, value)
+      else :
+         self.submit("attribute %s:%s" % (var._name, name), self.set_nc_attribute, var._name,
+            name, value)
+
+   def write_data(self, var, key, value) :
+      self.check_error()
+      super(WriterDataset, self).write_data(var, key, value)
+      # views onto scratch files must be copied since the files may be deleted before writing
+      if not value.flags.owndata : value = value.copy()
+      self.submit("variable " + var._name, self.write_nc_data, var._name, key, value)
+
+   def sync(self) :
+      """Wait for all pending operations to complete, then sync the netCDF dataset to disk."""
+      self.queue.join()
+      self.check_error()
+      self.ncdataset.sync()
+
+   def close(self) :
+      """Wait for all pending operations to complete and stop the writer thread."""
+      self.stop()
+      self.check_error()
+
+   def stop(self) :
+      """Stop the writer thread, if it is still running, once all pending operations are done."""
+      if self.thread.is_alive() :
+         self.queue.put(None)
+         self.thread.join()
+
+   def submit(self, target, func, *args, **kwargs) :
+      """Queue a call to func for the writer thread, blocking while the queue is full."""
+      self.queue.put((target, self.lineno(), func, args, kwargs))
+
+   def check_error(self) :
+      """Re-raise any error caught by the writer thread as a CDLWriteError exception."""
+      if self.error :
+         target, lineno, exc = self.error
+         raise CDLWriteError("Error writing %s (CDL line number %d) to netCDF dataset:\n%s" \
+            % (target, lineno, str(exc)))
+
+   def run_writer(self) :
+      """Perform queued netCDF operations until a None item is received."""
+      while True :
+         item = self.queue.get()
+         try :
+            if item is None : return
+            target, lineno, func, args, kwargs = item
+            if self.error : continue   # discard operations following an error
+            try :
+               func(*args, **kwargs)
+            except Exception, exc :
+               self.__dict__['error'] = (target, lineno, exc)
+         finally :
+            self.queue.task_done()
+
+   def set_nc_attribute(self, varname, name, value) :
+      self.ncdataset.variables[varname].setncattr(name, value)
+
+   def write_nc_data(self, varname, key, value) :
+      ncvar = self.ncdataset.variables[varname]
+      if key is Ellipsis and ncvar.ndim == 0 :
+         ncvar.assignValue(value)
+      else :
+         ncvar[key] = value
+
+#---------------------------------------------------------------------------------------------------
+class ShardDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that splits its output across several netCDF files, or shards, named after the
+   specified netCDF file with a shard number appended, e.g. out_000.nc, out_001.nc, etc. The output
+   is split either by groups of variables, as specified by shard_variables, or by ranges of records
+   along the unlimited dimension, as specified by shard_records. Every shard contains all of the
+   dimensions and global attributes, plus the coordinate variables (i.e. variables named after
+   their sole dimension) for the dimensions used by its other variables. The names of the shards
+   are available via the filenames attribute.
+
+   The shards are written concurrently by a number of writer processes. Each shard is assigned to
+   one of the processes, which is sent the declarations, data and any attributes set after the
+   header, such as summary statistics, for the shard via a bounded queue. Any error raised by a
+   writer process is re-raised as a CDLWriteError exception by the next call to write_data or
+   close. If workers is zero then the shards are written in turn by the calling process instead.
+   """
+   def __init__(self, ncfile, file_format, shard_variables=None, shard_records=None, workers=2) :
+      super(ShardDataset, self).__init__()
+      self.__dict__['ncfile'] = ncfile
+      self.__dict__['file_format'] = file_format
+      self.__dict__['shard_variables'] = shard_variables
+      self.__dict__['shard_records'] = shard_records
+      self.__dict__['filenames'] = []
+      self.__dict__['shard_varnames'] = []
+      self.__dict__['coord_data'] = OrderedDict()
+      self.__dict__['errors'] = multiprocessing.Queue()
+      self.__dict__['writers'] = []
+      self.__dict__['datasets'] = OrderedDict()   # netCDF datasets written by the calling process
+      for i in range(workers) :
+         queue = multiprocessing.Queue(WRITE_QUEUE_SIZE)
+         proc = multiprocessing.Process(target=run_shard_writer, args=(queue, self.errors),
+            name='cdlparser-shard-%d' % i)
+         proc.daemon = True
+         proc.start()
+         self.writers.append((proc, queue))
+
+   def end_header(self) :
+      if self.shard_records :
+         self.add_shard(self.variables.keys())
+         return
+      groups = [list(group) for group in self.shard_variables]
+      listed = set(sum(groups, []))
+      for varname in listed :
+         if varname not in self.variables :
+            raise CDLContentError("Variable %s named in shard_variables is not defined" % varname)
+      rest = [varname for varname, var in self.variables.items() \
+         if varname not in listed and not is_coordinate_variable(var)]
+      if rest : groups.append(rest)
+      for group in groups : self.add_shard(group)
+
+   def attribute_set(self, var, name, value) :
+      # attributes set once the shards have been opened, e.g. summary statistics, are forwarded
+      varname = var._name if var is not None else None
+      for index, filename in enumerate(self.filenames) :
+         if varname is None or varname in self.shard_varnames[index] :
+            self.send(index, ('attribute', filename, varname, name, value))
+
+   def add_shard(self, varnames) :
+      """Start a new shard containing the specified variables plus any coordinate variables."""
+      index = len(self.filenames)
+      root, ext = os.path.splitext(self.ncfile)
+      filename = "%s_%03d%s" % (root, index, ext or '.nc')
+      varnames = set(varnames)
+      dimnames = set([dimname for varname in varnames \
+         for dimname in self.variables[varname].dimensions])
+      schema = SchemaDataset()
+      for dimname, dim in self.dimensions.items() :
+         schema.createDimension(dimname, None if dim.isunlimited() else len(dim))
+      for varname, var in self.variables.items() :
+         if is_coordinate_variable(var) and var.dimensions[0] in dimnames : varnames.add(varname)
+         if varname in varnames :
+            schema.createVariable(varname, var.dtype, var.dimensions)._attrs.update(var._attrs)
+      schema._attrs.update(self._attrs)
+      self.filenames.append(filename)
+      self.shard_varnames.append(varnames)
+      self.send(index, ('open', filename, self.file_format, schema, {}))
+      # shards added part way through the data section need any coordinate data already written
+      for varname, (key, value) in self.coord_data.items() :
+         if varname in varnames : self.send(index, ('write', filename, varname, key, value))
+
+   def write_data(self, var, key, value) :
+      self.check_error()
+      super(ShardDataset, self).write_data(var, key, value)
+      # views onto scratch files must be copied since the files may be deleted before writing
+      if not value.flags.owndata : value = value.copy()
+      if key is Ellipsis : key = None   # Ellipsis cannot be pickled
+      if self.shard_records and var.ndim and self.dimensions[var.dimensions[0]].isunlimited() :
+         start, stop = first_axis_range(key, value)
+         value = value.reshape((stop-start,) + var.shape[1:])
+         nrecs = self.shard_records
+         recvars = [name for name, v in self.variables.items() \
+            if v.ndim and self.dimensions[v.dimensions[0]].isunlimited()]
+         for index in range(start / nrecs, (stop+nrecs-1) / nrecs) :
+            while len(self.filenames) <= index : self.add_shard(recvars)
+            lo, hi = max(start, index*nrecs), min(stop, (index+1)*nrecs)
+            self.send(index, ('write', self.filenames[index], var._name,
+               slice(lo-index*nrecs, hi-index*nrecs), value[lo-start:hi-start]))
+         return
+      if is_coordinate_variable(var) : self.coord_data[var._name] = (key, value)
+      for index, varnames in enumerate(self.shard_varnames) :
+         if var._name in varnames :
+            self.send(index, ('write', self.filenames[index], var._name, key, value))
+
+   def send(self, index, message) :
+      """Send a message to the writer process for the specified shard."""
+      if not self.writers :
+         try :
+            apply_shard_message(self.datasets, message)
+         except Exception, exc :
+            raise CDLWriteError(shard_error_message(message[1], exc))
+         return
+      proc, queue = self.writers[index % len(self.writers)]
+      if not proc.is_alive() :
+         self.check_error()
+         raise CDLWriteError("Shard writer process %s has stopped unexpectedly" % proc.name)
+      queue.put(message)
+
+   def check_error(self) :
+      """Raise a CDLWriteError exception if any writer process has reported an error."""
+      try :
+         errmsg = self.errors.get_nowait()
+      except Queue.Empty :
+         return
+      raise CDLWriteError(errmsg)
+
+   def stop(self) :
+      """Wait for the writer processes to write any pending data and close their shards."""
+      for proc, queue in self.writers :
+         if proc.is_alive() : queue.put(None)
+      for proc, queue in self.writers :
+         proc.join()
+      for ncdataset in self.datasets.values() :
+         if ncdataset.isopen() : ncdataset.close()
+
+   def close(self) :
+      self.stop()
+      self.check_error()
+
+#---------------------------------------------------------------------------------------------------
+class FanoutDataset(ShardDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A ShardDataset that writes all of its output to every one of several netCDF files, or targets,
+   so that the same CDL document can be converted to several netCDF files, e.g. in different
+   formats, from a single parse. Each target is either the pathname of a netCDF file or a
+   dictionary holding the pathname ('ncfile'), optionally the file format ('file_format'), and any
+   keyword arguments to pass to the netCDF4.Dataset.createVariable method, e.g. zlib=True. The
+   default file format is that specified by file_format. The netCDF files are created once the
+   header has been parsed, and their names are available via the filenames attribute.
+
+   If workers is zero then the targets are written in turn by the calling process. Otherwise they
+   are shared among that number of writer processes, as per the ShardDataset class.
+   """
+   def __init__(self, targets, file_format, workers=0) :
+      super(FanoutDataset, self).__init__(None, file_format, workers=min(workers, len(targets)))
+      self.__dict__['targets'] = [dict(ncfile=t) if isinstance(t, basestring) else dict(t)
+         for t in targets]
+
+   def end_header(self) :
+      schema = SchemaDataset()
+      for dimname, dim in self.dimensions.items() :
+         schema.createDimension(dimname, None if dim.isunlimited() else len(dim))
+      for varname, var in self.variables.items() :
+         schema.createVariable(varname, var.dtype, var.dimensions)._attrs.update(var._attrs)
+      schema._attrs.update(self._attrs)
+      for index, target in enumerate(self.targets) :
+         options = dict(target)
+         filename = options.pop('ncfile')
+         file_format = options.pop('file_format', self.file_format)
+         self.filenames.append(filename)
+         self.send(index, ('open', filename, file_format, schema, options))
+
+   def attribute_set(self, var, name, value) :
+      varname = var._name if var is not None else None
+      for index, filename in enumerate(self.filenames) :
+         self.send(index, ('attribute', filename, varname, name, value))
+
+   def write_data(self, var, key, value) :
+      self.check_error()
+      SchemaDataset.write_data(self, var, key, value)
+      # views onto scratch files must be copied if they are to be written by another process
+      if self.writers and not value.flags.owndata : value = value.copy()
+      if key is Ellipsis : key = None   # Ellipsis cannot be pickled
+      for index, filename in enumerate(self.filenames) :
+         self.send(index, ('write', filename, var._name, key, value))
+
+#---------------------------------------------------------------------------------------------------
+class ArrayDataset(SchemaDataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A SchemaDataset that stores the data for each variable in an in-memory numpy array, which can
+   be retrieved via the get_array() method. If the counts argument is specified then it should be
+   a dictionary of the number of data values defined for each variable in the CDL source. This is
+   used to set the length of the unlimited dimension once the header has been parsed, in the same
+   way that the parser would if it had processed the data for all of the record variables.
+   """
+   def __init__(self, counts=None) :
+      super(ArrayDataset, self).__init__()
+      self.__dict__['counts'] = counts or {}
+      self.__dict__['arrays'] = {}
+
+   def end_header(self) :
+      for var in self.variables.values() :
+         if not var.dimensions or var._name not in self.counts : continue
+         dim = self.dimensions[var.dimensions[0]]
+         if not dim.isunlimited() : continue
+         recshape = var.shape[1:-1] if var.dtype.kind == 'S' else var.shape[1:]
+         reclen = max(1, int(np.prod(recshape)))
+         dim.size = max(dim.size, (self.counts[var._name] + reclen - 1) / reclen)
+
+   def write_data(self, var, key, value) :
+      super(ArrayDataset, self).write_data(var, key, value)
+      self.get_array(var._name)[key] = value
+
+   def get_array(self, varname) :
+      """
+      Return the array holding the data for the named variable, enlarging it first if the length
+      of the unlimited dimension has increased. Elements without data are set to the fill value.
+      """
+      var = self.variables[varname]
+      arr = self.arrays.get(varname)
+      if arr is None or arr.shape != var.shape :
+         newarr = np.empty(var.shape, dtype=var.dtype)
+         newarr.fill(get_fill_value(var))
+         if arr is not None : newarr[tuple([slice(0,n) for n in arr.shape])] = arr
+         arr = self.arrays[varname] = newarr
+      return arr
+
+#---------------------------------------------------------------------------------------------------
+class CDLEventHandler(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Base class for event handlers passed to the CDLParser via the handler keyword argument. Each
+   method is called as the corresponding CDL construct is parsed. The default implementations do
+   nothing, so subclasses need only override the methods of interest.
+   """
+   def on_dimension(self, name, size) :
+      """Called for each dimension. The size is None for the unlimited dimension."""
+      pass
+
+   def on_variable(self, name, dtype, dimensions) :
+      """Called for each variable with its numpy dtype and tuple of dimension names."""
+      pass
+
+   def on_attribute(self, varname, attname, value) :
+      """Called for each attribute. The varname argument is None for global attributes."""
+      pass
+
+   def on_data_chunk(self, varname, data, start) :
+      """
+      Called for each chunk of data values. The data argument is a numpy array holding a slab of
+      the variable along its first dimension, beginning at index start. Character data is passed
+      as an array of single characters, i.e. with the string length as the last dimension.
+      """
+      pass
+
+   def on_end(self) :
+      """Called when parsing of the CDL document is complete."""
+      pass
+
+#---------------------------------------------------------------------------------------------------
+class CDLChunker(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Splits a stream of CDL text chunks into segments that each end at a token boundary, i.e. just
+   after a ';', ',', '{' or '}' character that lies outside of any string, character constant or
+   comment. Such characters always form tokens in their own right, so each segment can be lexed
+   independently. A simple state machine is used to track strings, character constants, comments
+   and escape sequences across chunks.
+   """
+   # regular expressions used to find the next character of interest in each scanner state
+   patterns = {
+      'normal':  re.compile(r'["\'/\;,{}]'),
+      'string':  re.compile(r'["\\]'),
+      'char':    re.compile(r"['\\]"),
+      'comment': re.compile(r'\n'),
+   }
+
+   def __init__(self) :
+      self.pending = []
+      self.carry = ''
+      self.state = 'normal'
+
+   def feed(self, chunk) :
+      """Add a chunk of CDL text, returning the text up to the last token boundary, if any."""
+      buf = self.carry + chunk
+      boundary, end = self.scan(buf)
+      self.carry = buf[end:]
+      if not boundary :
+         self.pending.append(buf[:end])
+         return ''
+      segment = ''.join(self.pending) + buf[:boundary]
+      self.pending = [buf[boundary:end]]
+      return segment
+
+   def close(self) :
+      """Return any remaining CDL text."""
+      segment = ''.join(self.pending) + self.carry
+      self.pending = []
+      self.carry = ''
+      self.state = 'normal'
+      return segment
+
+   def scan(self, buf) :
+      """
+      Scan the text in buf, returning the position just after the last token boundary (or 0 if
+      there is none) and the position up to which the text could be scanned. The latter is less
+      than the length of buf if the final character can only be interpreted in light of the next.
+      """
+      buflen = len(buf)
+      pos = boundary = 0
+      while pos < buflen :
+         match = self.patterns[self.state].search(buf, pos)
+         if not match : return boundary, buflen
+         i = match.start()
+         c = buf[i]
+         if c == '\\' :
+            if i+1 >= buflen : return boundary, i   # wait for the escaped character
+            pos = i+2
+         elif self.state == 'normal' :
+            if c == '/' :
+               if i+1 >= buflen : return boundary, i   # wait for a possible second '/'
+               if buf[i+1] == '/' : self.state = 'comment'
+               pos = i+1
+            elif c == '"' :
+               self.state = 'string'
+               pos = i+1
+            elif c == "'" :
+               self.state = 'char'
+               pos = i+1
+            else :
+               boundary = pos = i+1
+         else :
+            self.state = 'normal'
+            pos = i+1
+      return boundary, pos
+
+#---------------------------------------------------------------------------------------------------
+class CDLIndexer(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Scans the lines of a CDL document, recording the position of the data section and the byte
+   offset, line number, value count and length of each 'varname = ... ;' block therein. Strings,
+   character constants and comments are skipped over, and data values are counted by counting the
+   separating commas rather than by lexing the values themselves.
+   """
+   # regular expressions used to find the next character sequence of interest
+   token_re = re.compile(r'"|\'(?:[^\'\\]|\\.)*\'|//|[;,=}]|(?<![\w.@+\-\\])(?:data|DATA):')
+   string_end_re = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+   def __init__(self) :
+      self.offset = 0
+      self.lineno = 0
+      self.in_string = False
+      self.in_data = False
+      self.data_offset = self.data_line = self.end_offset = None
+      self.block = None
+      self.blocks = []
+
+   def scan(self, line) :
+      """Scan the next line of CDL text."""
+      self.lineno += 1
+      pos = 0
+      linelen = len(line)
+      while pos < linelen :
+         if self.in_string :
+            match = self.string_end_re.match(line, pos)
+            if not match : break   # string continues onto the next line
+            self.in_string = False
+            pos = match.end()
+            continue
+         match = self.token_re.search(line, pos)
+         end = match.start() if match else linelen
+         if self.in_data and end > pos : self.scan_text(line, pos, end)
+         if not match : break
+         tok = match.group()
+         pos = match.end()
+         if tok == '//' :
+            break
+         elif tok == '"' :
+            self.in_string = True
+            if self.in_data : self.add_value()
+         elif tok == '}' :
+            self.end_offset = self.offset + match.start()
+            self.in_data = False
+         elif not self.in_data :
+            if tok[-1] == ':' and self.data_offset is None :
+               self.in_data = True
+               self.data_offset = self.offset + match.start()
+               self.data_line = self.lineno
+         elif tok[0] == "'" :
+            self.add_value()
+         elif tok == '=' :
+            if self.block and self.block['count'] is None : self.block['count'] = 0
+         elif tok == ',' :
+            if self.block and self.block['count'] is not None : self.block['count'] += 1
+         elif tok == ';' :
+            if self.block and self.block['count'] is not None :
+               self.blocks.append(OrderedDict([
+                  ('name', deescapify(''.join(self.block['name']).strip())),
+                  ('offset', self.block['offset']),
+                  ('line', self.block['line']),
+                  ('count', self.block['count'] + int(self.block['valued'])),
+                  ('length', self.offset + pos - self.block['offset'])]))
+            self.block = None
+      self.offset += linelen
+
+   def scan_text(self, line, start, end) :
+      """Scan a run of text lying outside of any string, character constant or comment."""
+      text = line[start:end]
+      if not text.strip() : return
+      if self.block is None :
+         nspaces = len(text) - len(text.lstrip())
+         self.block = dict(name=[], offset=self.offset+start+nspaces, line=self.lineno, count=None,
+            valued=False)
+      if self.block['count'] is None :
+         self.block['name'].append(text)
+      else :
+         self.add_value()
+
+   def add_value(self) :
+      """Note that the current data block contains at least one data value."""
+      if self.block and self.block['count'] is not None : self.block['valued'] = True
+
+   def results(self) :
+      """Return a dictionary describing the data section and the data blocks found therein."""
+      return OrderedDict([('data_offset', self.data_offset), ('data_line', self.data_line),
+         ('end_offset', self.end_offset), ('blocks', self.blocks)])
+
+#---------------------------------------------------------------------------------------------------
+class CDLRecorder(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Records a CDL document, as it is parsed, to a compiled CDL file. The file comprises the
+   COMPILED_MAGIC signature, the offset of a JSON trailer, the data blocks and then the trailer.
+   The latter holds the header tokens (up to and including the 'data:' token), a description
+   of each data block and the closing brace token, plus the size and modification time of the
+   CDL file. Each data block is stored as a raw little-endian array, aligned on a 64-byte boundary,
+   in the type of the variable. Character data is stored as an array of string lengths followed
+   by the concatenated strings. The file is written under a temporary name and renamed by finish().
+   """
+   def __init__(self, filename) :
+      self.filename = filename
+      self.tmpname = filename + '.tmp'
+      self.tokens = []
+      self.trailer = []
+      self.blocks = []
+      self.in_data = False
+      self.f = open(self.tmpname, 'wb')
+      self.f.write(COMPILED_MAGIC + struct.pack('<Q', 0))
+
+   def add_token(self, tok) :
+      """Record a token returned by the lexer. Data section tokens, bar the last, are ignored."""
+      if not self.in_data :
+         self.tokens.append(token_entry(tok))
+         self.in_data = tok.type == 'DATA'
+      elif tok.type == 'RBRACE' :
+         self.trailer.append(token_entry(tok))
+
+   def add_block(self, varname, lineno, arr) :
+      """Record the data values, a list of strings or a numeric array, defined for a variable."""
+      self.f.seek(0, 2)
+      self.f.write('\0' * (-self.f.tell() % 64))
+      block = OrderedDict([('name', varname.decode('latin-1')), ('line', lineno),
+         ('offset', self.f.tell()), ('count', len(arr))])
+      if isinstance(arr, list) :
+         lengths = np.array([len(x) for x in arr], dtype='<u4')
+         self.f.write(lengths.tostring())
+         self.f.write(''.join(arr))
+         block['dtype'] = 'str'
+      else :
+         if isinstance(arr, ScratchArray) : arr = arr.asarray()
+         dtype = arr.dtype.newbyteorder('<')
+         for i in range(0, len(arr), DEFAULT_CHUNK_SIZE) :
+            self.f.write(arr[i:i+DEFAULT_CHUNK_SIZE].astype(dtype).tostring())
+         block['dtype'] = dtype.str
+      self.blocks.append(block)
+
+   def finish(self, cdlfile) :
+      """Write the trailer, recording the state of the specified CDL file, and rename the file."""
+      stat = os.stat(cdlfile)
+      trailer = OrderedDict([('size', stat.st_size), ('mtime', stat.st_mtime),
+         ('tokens', self.tokens), ('blocks', self.blocks), ('trailer', self.trailer)])
+      self.f.seek(0, 2)
+      offset = self.f.tell()
+      json.dump(trailer, self.f)
+      self.f.seek(len(COMPILED_MAGIC))
+      self.f.write(struct.pack('<Q', offset))
+      self.f.close()
+      os.rename(self.tmpname, self.filename)
+
+   def abort(self) :
+      """Close and delete the temporary file, if it still exists."""
+      self.f.close()
+      if os.path.exists(self.tmpname) : os.remove(self.tmpname)
+
+#---------------------------------------------------------------------------------------------------
+class CDLReplayer(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Replays a compiled CDL file, as written by CDLRecorder, as a stream of tokens for the parser.
+   Each data block is returned as the token sequence IDENT EQUALS DATAARRAY EOL, where the value of
+   the DATAARRAY token is a read-only numpy.memmap array, or a list of strings for character data.
+   """
+   def __init__(self, filename) :
+      self.filename = filename
+      self.trailer = read_compiled_trailer(filename)
+      self.stream = self.generate_tokens()
+
+   def token(self) :
+      """Return the next token, or None at the end of the compiled file."""
+      return next(self.stream, None)
+
+   def generate_tokens(self) :
+      for entry in self.trailer['tokens'] : yield make_token(*entry)
+      for block in self.trailer['blocks'] :
+         name = block['name'].encode('latin-1')
+         yield make_token('IDENT', name, block['line'])
+         yield make_token('EQUALS', '=', block['line'])
+         yield make_token('DATAARRAY', self.load_block(block), block['line'])
+         yield make_token('EOL', ';', block['line'])
+      for entry in self.trailer['trailer'] : yield make_token(*entry)
+
+   def load_block(self, block) :
+      """Load the data values in the specified block."""
+      if block['dtype'] != 'str' :
+         return np.memmap(self.filename, dtype=block['dtype'], mode='r', offset=block['offset'],
+            shape=(block['count'],))
+      f = open(self.filename, 'rb')
+      try :
+         f.seek(block['offset'])
+         lengths = np.frombuffer(f.read(4*block['count']), dtype='<u4')
+         data = f.read(int(lengths.sum()))
+      finally :
+         f.close()
+      ends = np.cumsum(lengths).tolist()
+      return [data[i-n:i] for i, n in zip(ends, lengths.tolist())]
+
+#---------------------------------------------------------------------------------------------------
+class TokenStream(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Adapts an iterator over tokens to the token() method of the lexer interface used by the parser.
+   """
+   def __init__(self, tokens) :
+      self.tokens = tokens
+
+   def token(self) :
+      """Return the next token, or None when the token iterator is exhausted."""
+      return next(self.tokens, None)
+
+#---------------------------------------------------------------------------------------------------
+class VariableStats(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Accumulates summary statistics for the data values of a numeric variable, one array at a time.
+   Values equal to the variable's fill value - its _FillValue attribute or, failing that, the
+   default netCDF fill value - or to any of the values of its missing_value attribute are counted
+   as fill values. These, together with any NaN values, are excluded from the minimum, maximum
+   and mean. The statistics are available as the attributes count, fill_count, nan_count, min,
+   max and mean, the last three of which are None if no valid values have been encountered.
+   """
+   def __init__(self, var) :
+      if '_FillValue' in var.ncattrs() :
+         fill_values = [var._FillValue]
+      else :
+         fill_values = [get_default_fill_value(var.dtype.char)]
+      if 'missing_value' in var.ncattrs() :
+         fill_values.extend(np.atleast_1d(var.missing_value))
+      self.fill_values = np.array(fill_values, dtype=var.dtype)
+      self.count = self.fill_count = self.nan_count = self.nvalid = 0
+      self.min = self.max = None
+      self.total = 0.0
+
+   @property
+   def mean(self) :
+      return self.total / self.nvalid if self.nvalid else None
+
+   def update(self, arr) :
+      """Update the statistics with the values in the numpy array arr."""
+      arr = np.asarray(arr).reshape(-1)
+      if not arr.size : return
+      self.count += arr.size
+      invalid = arr == self.fill_values[0]
+      for fill_value in self.fill_values[1:] : invalid |= (arr == fill_value)
+      self.fill_count += int(invalid.sum())
+      if arr.dtype.kind == 'f' :
+         nans = np.isnan(arr)
+         self.nan_count += int(nans.sum())
+         invalid |= nans
+      valid = arr[~invalid] if invalid.any() else arr
+      if not valid.size : return
+      vmin, vmax = valid.min(), valid.max()
+      self.min = vmin if self.min is None else min(self.min, vmin)
+      self.max = vmax if self.max is None else max(self.max, vmax)
+      self.total += float(valid.sum(dtype=np.float64))
+      self.nvalid += valid.size
+
+   def asdict(self) :
+      """Return the statistics as a dictionary."""
+      return dict(count=self.count, fill_count=self.fill_count, nan_count=self.nan_count,
+         min=self.min, max=self.max, mean=self.mean)
+
+   def attributes(self, dtype) :
+      """
+      Return the statistics as a dictionary of netCDF attribute values. The actual_range attribute
+      has the specified data type and is omitted if there are no valid values, as is actual_mean.
+      """
+      attrs = OrderedDict()
+      if self.nvalid :
+         attrs['actual_range'] = np.array([self.min, self.max], dtype=dtype)
+         attrs['actual_mean'] = np.float64(self.mean)
+      for name in ('fill_count', 'nan_count') :
+         count = getattr(self, name)
+         attrs[name] = np.int32(count) if count <= XDR_INT_MAX else np.float64(count)
+      return attrs
+
+#---------------------------------------------------------------------------------------------------
+class ScratchArray(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A one-dimensional array of numeric data values that is backed by a scratch file rather than main
+   memory. Values are appended to a small in-memory buffer which is flushed to the scratch file each
+   time it reaches the size implied by the memory limit. Once all values have been added the array
+   can be accessed, in whole or in part, as a numpy.memmap object via the asarray() method. Client
+   code should call the close() method in order to delete the scratch file.
+   """
+   def __init__(self, dtype, memory_limit, dirname=None) :
+      self.dtype = np.dtype(dtype)
+      self.buflen = max(1, memory_limit / BUFFERED_VALUE_SIZE)
+      self.slablen = max(1, memory_limit / self.dtype.itemsize)
+      self.size = 0
+      self.buffer = []
+      fd, self.filename = tempfile.mkstemp(suffix='.dat', prefix='cdlparser_', dir=dirname)
+      self.fh = os.fdopen(fd, 'wb')
+
+   def __len__(self) :
+      return self.size + len(self.buffer)
+
+   def __getitem__(self, index) :
+      return self.asarray()[index]
+
+   def append(self, value) :
+      """Append a single value to the array."""
+      self.buffer.append(value)
+      if len(self.buffer) >= self.buflen : self.flush()
+
+   def extend(self, values) :
+      """Append a sequence of values to the array."""
+      for value in values : self.append(value)
+
+   def pad(self, value, count) :
+      """Append count copies of value to the array, writing them to the scratch file in slabs."""
+      self.flush()
+      while count > 0 :
+         n = min(count, self.slablen)
+         slab = np.empty(n, dtype=self.dtype)
+         slab.fill(value)
+         slab.tofile(self.fh)
+         self.size += n
+         count -= n
+
+   def flush(self) :
+      """Flush any buffered values to the scratch file."""
+      if not self.buffer : return
+      np.array(self.buffer, dtype=self.dtype).tofile(self.fh)
+      self.size += len(self.buffer)
+      self.buffer = []
+
+   def asarray(self) :
+      """Return a read-only numpy.memmap view of the array."""
+      self.flush()
+      self.fh.flush()
+      return np.memmap(self.filename, dtype=self.dtype, mode='r', shape=(self.size,))
+
+   def close(self) :
+      """Close and delete the scratch file."""
+      if not self.fh.closed : self.fh.close()
+      if os.path.exists(self.filename) : os.remove(self.filename)
+
+#---------------------------------------------------------------------------------------------------
+class StreamedArray(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A one-dimensional array of numeric data values for variable var which is passed to the variable
+   a chunk at a time, rather than being held in memory. Values are appended to an in-memory buffer
+   which, each time it holds at least chunk_size values, is assigned, in whole rows along the first
+   dimension, to the variable beginning at index start. If maxrows is specified then no more than
+   that number of rows may be assigned. Client code should call flush(final=True) once all values
+   have been added. This is used with datasets, such as EventDataset, that act upon each chunk of
+   data as it arrives, so that memory use is bounded by the chunk size rather than by the size of
+   the variable.
+   """
+   def __init__(self, var, chunk_size, start=0, maxrows=None, stats=None) :
+      self.var = var
+      self.dtype = var.dtype
+      self.rowlen = max(1, int(np.prod(var.shape[1:])))
+      self.buflen = max(1, chunk_size / self.rowlen) * self.rowlen
+      self.start = start
+      self.maxrows = maxrows
+      self.stats = stats
+      self.size = 0
+      self.buffer = []
+
+   def __len__(self) :
+      return self.size + len(self.buffer)
+
+   def append(self, value) :
+      """Append a single value to the array."""
+      self.buffer.append(value)
+      if len(self.buffer) >= self.buflen : self.flush()
+
+   def extend(self, values) :
+      """Append a sequence of values to the array."""
+      for value in values : self.append(value)
+
+   def pad(self, value, count) :
+      """Append count copies of value to the array, passing them to the variable in chunks."""
+      while count > 0 :
+         n = min(count, self.buflen)
+         self.buffer.extend([value] * n)
+         self.flush()
+         count -= n
+
+   def flush(self, final=False) :
+      """
+      Assign the whole rows of buffered values to the variable or, if final is true, all of them,
+      in which case they must make up a whole number of rows.
+      """
+      nvalues = len(self.buffer) if final else len(self.buffer) - len(self.buffer) % self.rowlen
+      if final and nvalues % self.rowlen :
+         raise CDLContentError("Record length %d is not a factor of variable length %d" \
+            % (self.rowlen, len(self)))
+      if not nvalues : return
+      first, nrows = self.size / self.rowlen, nvalues / self.rowlen
+      if self.maxrows is not None and first + nrows > self.maxrows :
+         raise CDLContentError("Too many data values specified for variable %s" % self.var._name)
+      nparr = np.array(self.buffer[:nvalues], dtype=self.dtype)
+      nparr.shape = (nrows,) + tuple(self.var.shape[1:])
+      if self.stats : self.stats.update(nparr)
+      self.var[self.start+first:self.start+first+nrows] = nparr
+      del self.buffer[:nvalues]
+      self.size += nvalues
+
+#---------------------------------------------------------------------------------------------------
+class CDLServer(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A long-running CDL conversion server, which listens on a localhost port or a Unix domain socket
+   and passes each conversion request to a pool of worker processes, each of which holds a ready
+   built CDL3Parser object. This avoids the cost of interpreter startup and grammar construction
+   for every CDL file converted.
+
+   Requests and responses are JSON objects, one per line. A conversion request contains either a
+   'cdltext' or a 'cdlfile' item, plus optional 'ncfile' and 'return_bytes' items. The response
+   contains either the pathname of the netCDF file ('ncfile') or, if return_bytes is true, its
+   base64-encoded contents ('data'), together with latency metrics for the request. Requests of
+   the form {"command": "metrics"} return the server's cumulative metrics.
+
+   At most max_pending conversion requests may be queued or in progress at any one time. Further
+   requests are rejected with a response whose status is 'busy', thus applying backpressure to
+   clients, which can retry later.
+
+   The worker processes are forked from the server process, so the server should be started before
+   any netCDF datasets are opened in the same process. Normally the server is run on its own, e.g.
+   via 'python cdlparser.py serve'.
+   """
+   def __init__(self, address=DEFAULT_SERVER_ADDRESS, workers=2, max_pending=None, **kwargs) :
+      """
+      :param address: The (host, port) tuple or the Unix domain socket pathname on which to listen.
+         [default: DEFAULT_SERVER_ADDRESS]
+      :param workers: The number of worker processes in the parser pool. [default: 2]
+      :param max_pending: The maximum number of conversion requests that may be queued or in
+         progress at any one time. [default: 4 * workers]
+      :param kwargs: Keyword arguments passed to the CDL3Parser constructor in each worker.
+      """
+      self.address = address
+      self.workers = workers
+      self.max_pending = max_pending or 4*workers
+      self.parser_kwargs = kwargs
+      self.pending = threading.BoundedSemaphore(self.max_pending)
+      self.metrics_lock = threading.Lock()
+      self.metrics = dict(requests=0, errors=0, rejected=0, total_latency=0.0, max_latency=0.0)
+      self.logger = logging.getLogger('cdlparser')
+      self.pool = None
+      self.server = None
+
+   def start(self) :
+      """Start the worker processes and open the server socket."""
+      self.pool = multiprocessing.Pool(self.workers, initializer=init_parser_worker,
+         initargs=(self.parser_kwargs,))
+      if isinstance(self.address, basestring) :
+         if os.path.exists(self.address) : os.remove(self.address)
+         self.server = SocketServer.ThreadingUnixStreamServer(self.address, CDLRequestHandler)
+      else :
+         self.server = SocketServer.ThreadingTCPServer(self.address, CDLRequestHandler)
+         self.address = self.server.server_address
+      self.server.daemon_threads = True
+      self.server.cdlserver = self
+      self.server.handle_error = self.handle_error
+      self.logger.info("CDL conversion server listening on %s" % (self.address,))
+
+   def serve_forever(self) :
+      """Start the server, if necessary, and handle requests until shutdown() is called."""
+      if self.server is None : self.start()
+      try :
+         self.server.serve_forever()
+      finally :
+         self.close()
+
+   def shutdown(self) :
+      """Stop the serve_forever loop, which may be running in another thread."""
+      if self.server : self.server.shutdown()
+
+   def close(self) :
+      """Close the server socket and terminate the worker processes."""
+      if self.server :
+         self.server.server_close()
+         if isinstance(self.address, basestring) and os.path.exists(self.address) :
+            os.remove(self.address)
+         self.server = None
+      if self.pool :
+         self.pool.terminate()
+         self.pool.join()
+         self.pool = None
+
+   def handle_error(self, request, client_address) :
+      """
+      Handle an exception raised while the socket server was dispatching a request. The socket
+      server catches every exception at that point, so KeyboardInterrupt and SystemExit are
+      re-raised here, otherwise an interrupt received while a connection is being accepted would
+      be lost and the server would not stop.
+      """
+      exc_type, exc = sys.exc_info()[:2]
+      if issubclass(exc_type, (KeyboardInterrupt, SystemExit)) : raise
+      self.logger.error("Error dispatching request from %s: %s" % (client_address, str(exc)))
+
+   def handle_request(self, request) :
+      """Handle a single decoded request and return the response as a dictionary."""
+      if request.get('command') == 'metrics' : return self.get_metrics()
+      if not self.pending.acquire(False) :
+         with self.metrics_lock : self.metrics['rejected'] += 1
+         return dict(status='busy', message="Server has %d pending requests" % self.max_pending)
+      received = time.time()
+      try :
+         response = self.pool.apply_async(run_parser_request, (request,)).get()
+      finally :
+         self.pending.release()
+      latency = time.time() - received
+      response['queue_time'] = max(0.0, response.pop('started') - received)
+      response['latency'] = latency
+      with self.metrics_lock :
+         self.metrics['requests'] += 1
+         if response['status'] != 'ok' : self.metrics['errors'] += 1
+         self.metrics['total_latency'] += latency
+         self.metrics['max_latency'] = max(self.metrics['max_latency'], latency)
+      self.logger.info("Handled request in %.3fs (queued %.3fs, parsed %.3fs): %s" \
+         % (latency, response['queue_time'], response['parse_time'], response['status']))
+      return response
+
+   def get_metrics(self) :
+      """Return a dictionary of cumulative request metrics."""
+      with self.metrics_lock :
+         metrics = dict(self.metrics)
+      nreq = metrics['requests']
+      metrics['mean_latency'] = metrics['total_latency'] / nreq if nreq else 0.0
+      metrics.update(status='ok', workers=self.workers, max_pending=self.max_pending)
+      return metrics
+
+#---------------------------------------------------------------------------------------------------
+class CDLRequestHandler(SocketServer.StreamRequestHandler) :
+#---------------------------------------------------------------------------------------------------
+   """Reads JSON requests, one per line, from a client connection and writes the responses."""
+   def handle(self) :
+      for line in iter(self.rfile.readline, '') :
+         if not line.strip() : continue
+         try :
+            response = self.server.cdlserver.handle_request(json.loads(line))
+         except ValueError, exc :
+            response = dict(status='error', error='ValueError', message=str(exc))
+         self.wfile.write(json.dumps(response) + '\n')
+         self.wfile.flush()
+
+#---------------------------------------------------------------------------------------------------
+class CDLClient(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   A thin client for the CDL conversion server. Errors reported by the server are re-raised as
+   the corresponding CDLSyntaxError or CDLContentError exception, while requests rejected by a
+   busy server raise a CDLServerBusyError exception.
+   """
+   def __init__(self, address=DEFAULT_SERVER_ADDRESS, timeout=None) :
+      family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+      self.sock = socket.socket(family, socket.SOCK_STREAM)
+      self.sock.settimeout(timeout)
+      self.sock.connect(address)
+      self.rfile = self.sock.makefile('rb')
+
+   def request(self, request) :
+      """Send a request dictionary to the server and return the response dictionary."""
+      self.sock.sendall(json.dumps(request) + '\n')
+      line = self.rfile.readline()
+      if not line : raise IOError("Connection closed by CDL conversion server")
+      response = json.loads(line)
+      if response['status'] == 'busy' :
+         raise CDLServerBusyError(response['message'])
+      elif response['status'] != 'ok' :
+         exc_class = globals().get(response.get('error'))
+         if not (isinstance(exc_class, type) and issubclass(exc_class, Exception)) :
+            exc_class = CDLContentError
+         raise exc_class(response['message'])
+      return response
+
+   def convert_text(self, cdltext, ncfile=None, return_bytes=False) :
+      """
+      Convert the specified CDL text. Returns the pathname of the netCDF file or, if return_bytes is
+      true, the contents of the netCDF file as a string of bytes.
+      """
+      return self.convert(dict(cdltext=cdltext), ncfile, return_bytes)
+
+   def convert_file(self, cdlfile, ncfile=None, return_bytes=False) :
+      """
+      Convert the specified CDL file. Returns the pathname of the netCDF file or, if return_bytes is
+      true, the contents of the netCDF file as a string of bytes.
+      """
+      return self.convert(dict(cdlfile=os.path.abspath(cdlfile)), ncfile, return_bytes)
+
+   def convert(self, request, ncfile, return_bytes) :
+      if ncfile : request['ncfile'] = os.path.abspath(ncfile)
+      request['return_bytes'] = return_bytes
+      response = self.request(request)
+      return base64.b64decode(response['data']) if return_bytes else response['ncfile']
+
+   def get_metrics(self) :
+      """Return the server's cumulative request metrics."""
+      return self.request(dict(command='metrics'))
+
+   def close(self) :
+      self.rfile.close()
+      self.sock.close()
+
+#---------------------------------------------------------------------------------------------------
+class CDLWatcher(object) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Watches a directory tree of CDL files and converts new or modified files into a mirror tree of
+   netCDF files. The source tree is polled for changes to file modification times. A changed file
+   is only converted once it has been left unchanged for the debounce interval, so that a burst of
+   edits results in a single conversion. Conversions are carried out by a pool of worker processes
+   (or in the calling process if workers is 0). Each netCDF file is written under a temporary name
+   and renamed on success, and is deleted when its source file is deleted.
+
+   Files whose netCDF output is missing or older than the source are converted on the first poll.
+   """
+   def __init__(self, srcdir, outdir, workers=2, interval=1.0, debounce=0.5, suffix='.cdl',
+      **kwargs) :
+      """
+      :param srcdir: The directory tree containing the CDL files.
+      :param outdir: The directory tree to receive the netCDF files.
+      :param workers: The number of worker processes used for conversions. [default: 2]
+      :param interval: The polling interval, in seconds, used by the watch method. [default: 1.0]
+      :param debounce: The time, in seconds, for which a file must remain unchanged before it is
+         converted. [default: 0.5]
+      :param suffix: The filename suffix of the CDL files to convert. [default: '.cdl']
+      :param kwargs: Keyword arguments passed to the CDL3Parser constructor.
+      """
+      self.srcdir = os.path.abspath(srcdir)
+      self.outdir = os.path.abspath(outdir)
+      self.interval = interval
+      self.debounce = debounce
+      self.suffix = suffix
+      self.logger = logging.getLogger('cdlparser')
+      self.mtimes = None
+      self.pending = set()
+      self.results = {}
+      self.errors = {}
+      self.pool = self.parser = None
+      if workers :
+         self.pool = multiprocessing.Pool(workers, initializer=init_parser_worker,
+            initargs=(kwargs,))
+      else :
+         self.parser = CDL3Parser(**dict(kwargs, close_on_completion=True))
+
+   def scan(self) :
+      """Return a dictionary of modification times keyed by CDL file path relative to srcdir."""
+      mtimes = {}
+      for dirpath, dirnames, filenames in os.walk(self.srcdir) :
+         for filename in filenames :
+            if not filename.endswith(self.suffix) : continue
+            path = os.path.join(dirpath, filename)
+            try :
+               mtimes[os.path.relpath(path, self.srcdir)] = os.stat(path).st_mtime
+            except OSError :
+               pass   # file deleted since directory was listed
+      return mtimes
+
+   def output_path(self, relpath) :
+      """Return the netCDF pathname corresponding to a CDL file path relative to srcdir."""
+      return os.path.join(self.outdir, relpath[:-len(self.suffix)] + '.nc')
+
+   def poll(self) :
+      """
+      Scan the source tree once, starting conversions of files that have changed and are no
+      longer being edited, and removing outputs of deleted files. Also collects the results of
+      completed conversions. Returns the list of files, relative to srcdir, submitted for
+      conversion.
+      """
+      now = time.time()
+      mtimes = self.scan()
+      if self.mtimes is None :
+         # first poll: only convert files whose output is missing or out of date
+         self.mtimes = {}
+         for relpath, mtime in mtimes.items() :
+            ncfile = self.output_path(relpath)
+            if os.path.exists(ncfile) and os.stat(ncfile).st_mtime >= mtime :
+               self.mtimes[relpath] = mtime
+      for relpath in set(self.mtimes) - set(mtimes) :
+         del self.mtimes[relpath]
+         self.pending.discard(relpath)
+         self.errors.pop(relpath, None)
+         ncfile = self.output_path(relpath)
+         if os.path.exists(ncfile) :
+            os.remove(ncfile)
+            self.logger.info("Removed %s since its source file was deleted" % ncfile)
+      for relpath, mtime in mtimes.items() :
+         if self.mtimes.get(relpath) != mtime :
+            self.mtimes[relpath] = mtime
+            self.pending.add(relpath)
+      submitted = []
+      for relpath in sorted(self.pending) :
+         if now - self.mtimes[relpath] < self.debounce or relpath in self.results : continue
+         self.pending.remove(relpath)
+         self.submit(relpath)
+         submitted.append(relpath)
+      self.collect()
+      return submitted
+
+   def submit(self, relpath) :
+      """Start the conversion of the specified CDL file."""
+      ncfile = self.output_path(relpath)
+      if not os.path.isdir(os.path.dirname(ncfile)) : os.makedirs(os.path.dirname(ncfile))
+      request = dict(cdlfile=os.path.join(self.srcdir, relpath), ncfile=ncfile+'.tmp')
+      if self.pool :
+         self.results[relpath] = self.pool.apply_async(run_parser_request, (request,))
+      else :
+         self.results[relpath] = run_parser_request(request, parser=self.parser)
+      self.logger.info("Converting %s" % relpath)
+
+   def collect(self, wait=False) :
+      """
+      Collect the results of completed conversions, renaming each successfully generated netCDF
+      file to its final name. If wait is true then wait for all conversions to complete.
+      """
+      for relpath, result in self.results.items() :
+         if not isinstance(result, dict) :
+            if not (wait or result.ready()) : continue
+            result = result.get()
+         del self.results[relpath]
+         ncfile = self.output_path(relpath)
+         if result['status'] == 'ok' :
+            os.rename(ncfile+'.tmp', ncfile)
+            self.errors.pop(relpath, None)
+            self.logger.info("Converted %s to %s in %.3fs" \
+               % (relpath, ncfile, result['parse_time']))
+         else :
+            if os.path.exists(ncfile+'.tmp') : os.remove(ncfile+'.tmp')
+            self.errors[relpath] = result['message']
+            self.logger.error("Error converting %s: %s" % (relpath, result['message']))
+
+   def watch(self, iterations=None) :
+      """Poll the source tree every interval seconds, indefinitely or for the given iterations."""
+      count = 0
+      while iterations is None or count < iterations :
+         self.poll()
+         count += 1
+         time.sleep(self.interval)
+      self.collect(wait=True)
+
+   def close(self) :
+      """Wait for any outstanding conversions to complete and shut down the worker pool."""
+      self.collect(wait=True)
+      if self.pool :
+         self.pool.close()
+         self.pool.join()
+         self.pool = None
+
+# CDL3Parser object used by each CDLServer or CDLWatcher worker process
+worker_parser = None
+
+#---------------------------------------------------------------------------------------------------
+def init_parser_worker(kwargs) :
+#---------------------------------------------------------------------------------------------------
+   """Create and build the CDL3Parser object used by a CDLServer or CDLWatcher worker process."""
+   global worker_parser
+   kwargs = dict(kwargs, close_on_completion=True)
+   worker_parser = CDL3Parser(**kwargs)
+   worker_parser.build_parser()
+
+#---------------------------------------------------------------------------------------------------
+def run_parser_request(request, parser=None) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Carry out a conversion request, as described in the CDLServer docstring, and return the
+   response. The request is handled by the specified parser or, by default, by the parser of the
+   current worker process.
+   """
+   parser = parser or worker_parser
+   started = time.time()
+   # JSON strings are decoded as unicode, whereas the parser expects byte strings
+   request = dict((k, v.encode('utf-8') if isinstance(v, unicode) else v) \
+      for k, v in request.items())
+   ncfile = request.get('ncfile')
+   tmpdir = None
+   if request.get('return_bytes') :
+      tmpdir = tempfile.mkdtemp(prefix='cdlparser_')
+      ncfile = os.path.join(tmpdir, 'output.nc')
+   try :
+      if 'cdltext' in request :
+         parser.parse_text(request['cdltext'], ncfile=ncfile)
+      else :
+         parser.parse_file(request['cdlfile'], ncfile=ncfile)
+      response = dict(status='ok')
+      if tmpdir :
+         f = open(ncfile, 'rb')
+         try :
+            response['data'] = base64.b64encode(f.read())
+         finally :
+            f.close()
+      else :
+         response['ncfile'] = parser.ncfile
+   except Exception, exc :
+      response = dict(status='error', error=exc.__class__.__name__, message=str(exc))
+   finally :
+      if tmpdir : shutil.rmtree(tmpdir)
+   response.update(started=started, parse_time=time.time()-started)
+   return response
+
+#---------------------------------------------------------------------------------------------------
+def run_shard_writer(queue, errors) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Main function of a ShardDataset writer process. Creates and writes the shards described by the
+   messages received via queue, until a None message is received, and reports the first error, if
+   any, via the errors queue.
+   """
+   # netCDF datasets inherited from the parent process must never be finalised in this process
+   gc.disable()
+   datasets = OrderedDict()
+   failed = False
+   for message in iter(queue.get, None) :
+      if failed : continue
+      try :
+         apply_shard_message(datasets, message)
+      except Exception, exc :
+         errors.put(shard_error_message(message[1], exc))
+         failed = True
+   for ncdataset in datasets.values() : ncdataset.close()
+
+#---------------------------------------------------------------------------------------------------
+def apply_shard_message(datasets, message) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Apply a message sent by a ShardDataset to the netCDF datasets in dictionary datasets, keyed by
+   filename. The message either creates a netCDF file from a schema ('open'), sets a global or
+   variable attribute ('attribute') or writes data to one of its variables ('write').
+   """
+   if message[0] == 'open' :
+      filename, file_format, schema, options = message[1:]
+      datasets[filename] = nc4.Dataset(filename, 'w', format=file_format)
+      copy_schema(schema, datasets[filename], **options)
+   elif message[0] == 'attribute' :
+      filename, varname, name, value = message[1:]
+      if varname is None :
+         datasets[filename].setncattr(name, value)
+      else :
+         datasets[filename].variables[varname].setncattr(name, value)
+   else :
+      filename, varname, key, value = message[1:]
+      var = datasets[filename].variables[varname]
+      if key is None :
+         var.assignValue(value)
+      else :
+         var[key] = value
+
+#---------------------------------------------------------------------------------------------------
+def shard_error_message(filename, exc) :
+#---------------------------------------------------------------------------------------------------
+   """Returns the error message reported when writing the specified netCDF file fails."""
+   return "Error writing netCDF file %s\nException details are as follows:\n%s" \
+      % (filename, str(exc))
+
+#---------------------------------------------------------------------------------------------------
+def find_closing_quote(text, pos, quote) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns the position just after the unescaped quote character which closes the string or
+   character constant starting at position pos in text, or the length of text if there is none.
+   """
+   while True :
+      end = text.find(quote, pos)
+      if end < 0 : return len(text)
+      nslashes = (end - pos) - len(text[pos:end].rstrip('\\'))
+      pos = end + 1
+      if nslashes % 2 == 0 : return pos
+
+#---------------------------------------------------------------------------------------------------
+def schema_hashes(schema) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns a hash of the dimension and variable definitions recorded in schema, typically a
+   SchemaDataset object, together with a dictionary of hashes of the attributes of each variable,
+   keyed by variable name. The hash of the global attributes is keyed by an empty string.
+   """
+   def attrs_hash(obj) :
+      attrs = [(name, json_value(obj.getncattr(name)), np.asarray(obj.getncattr(name)).dtype.str)
+         for name in obj.ncattrs()]
+      return hashlib.sha1(repr(attrs)).hexdigest()
+   structure = [[(name, None if dim.isunlimited() else len(dim))
+      for name, dim in schema.dimensions.items()]]
+   for name, var in schema.variables.items() :
+      fill_value = json_value(var._attrs.get('_FillValue'))
+      structure.append((name, var.dtype.str, tuple(var.dimensions), fill_value))
+   declarations = dict([(name, attrs_hash(var)) for name, var in schema.variables.items()])
+   declarations[''] = attrs_hash(schema)
+   return hashlib.sha1(repr(structure)).hexdigest(), declarations
+
+#---------------------------------------------------------------------------------------------------
+def data_hash(var, arr) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns a hash of the data array arr, as defined in the CDL input for variable var, or None if
+   the values cannot be converted to the variable's data type.
+   """
+   sha = hashlib.sha1()
+   if var.dtype.kind == 'S' :
+      for value in arr : sha.update(struct.pack('<I', len(value)) + value)
+      return sha.hexdigest()
+   try :
+      nparr = arr.asarray() if isinstance(arr, ScratchArray) else np.asarray(arr, dtype=var.dtype)
+   except (ValueError, TypeError, OverflowError) :
+      return None
+   sha.update(np.ascontiguousarray(nparr))
+   return sha.hexdigest()
+
+#---------------------------------------------------------------------------------------------------
+def is_coordinate_variable(var) :
+#---------------------------------------------------------------------------------------------------
+   """Returns True if var is a coordinate variable, i.e. is named after its sole dimension."""
+   return var.dimensions == (var._name,)
+
+#---------------------------------------------------------------------------------------------------
+def put_numeric_data(var, arr, reclen=0, start=0, stats=None) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Write numeric data array to netcdf variable. If arr is a ScratchArray object then the data is
+   written from the memory-mapped scratch file in slabs along the variable's first dimension. For
+   record variables the start argument specifies the index of the first record to write. If stats
+   is a VariableStats object then it is updated with the data as it is written.
+   """
+   shape = list(var.shape)
+   if reclen : shape[0] = len(arr) / reclen
+   else : start = 0
+   if not isinstance(arr, ScratchArray) :
+      nparr = np.asarray(arr, dtype=var.dtype).reshape(shape)
+      if stats : stats.update(nparr)
+      if start :
+         var[start:start+shape[0]] = nparr
+      else :
+         var[:] = nparr
+      return
+   nparr = arr.asarray().reshape(shape)
+   if not shape :
+      if stats : stats.update(nparr)
+      var[:] = nparr
+      return
+   rowlen = nparr.size / shape[0] if shape[0] else 1
+   nrows = max(1, arr.slablen / max(1, rowlen))
+   for i in range(0, shape[0], nrows) :
+      # the slab must not extend past the last record, or netCDF would try to extend the variable
+      stop = min(i+nrows, shape[0])
+      if stats : stats.update(nparr[i:stop])
+      var[start+i:start+stop] = nparr[i:stop]
+
+#---------------------------------------------------------------------------------------------------
+def put_char_data(var, arr, reclen=0, start=0) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Write character data array to netcdf variable. For record variables the start argument
+   specifies the index of the first record to write.
+   """
+   maxlen = var.shape[-1] if var.ndim > 0 else 1
+   nparr = str_list_to_char_arr(arr, maxlen)
+   shape = list(var.shape)
+   if reclen : shape[0] = len(arr) / reclen
+   nparr.shape = shape
+   if reclen and start :
+      var[start:start+shape[0]] = nparr
+   else :
+      var[:] = nparr
+
+#---------------------------------------------------------------------------------------------------
+def row_size(var) :
+#---------------------------------------------------------------------------------------------------
+   """Returns the size in bytes of one index of the first dimension of variable var."""
+   return var.dtype.itemsize * int(np.prod(var.shape[1:]))
+
+#---------------------------------------------------------------------------------------------------
+def data_block(var, nparr, start, stop) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns rows start to stop of the numpy array nparr, which holds the data for variable var. If
+   nparr has fewer than stop rows, or is None, then the missing rows are set to the variable's fill
+   value.
+   """
+   if nparr is not None and len(nparr) >= stop : return nparr[start:stop]
+   block = np.empty([stop-start] + list(var.shape[1:]), dtype=var.dtype)
+   block.fill(get_fill_value(var))
+   if nparr is not None and len(nparr) > start : block[:len(nparr)-start] = nparr[start:]
+   return block
+
+#---------------------------------------------------------------------------------------------------
+def copy_schema(schema, ncdataset, **kwargs) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Create the dimensions, variables and attributes recorded in schema, typically a SchemaDataset
+   object, in the empty netCDF dataset ncdataset. Any _FillValue attributes are applied when the
+   corresponding variables are created, as required by the netCDF library. Any keyword arguments
+   are passed to the netCDF4.Dataset.createVariable method.
+   """
+   options = dict(shuffle=False)
+   options.update(kwargs)
+   for dimname, dim in schema.dimensions.items() :
+      ncdataset.createDimension(dimname, None if dim.isunlimited() else len(dim))
+   for varname, var in schema.variables.items() :
+      fill_value = var._attrs.get('_FillValue')
+      ncvar = ncdataset.createVariable(varname, var.dtype, var.dimensions, fill_value=fill_value,
+         **options)
+      for attname, attval in var._attrs.items() :
+         if attname != '_FillValue' : ncvar.setncattr(attname, attval)
+   for attname, attval in schema._attrs.items() :
+      ncdataset.setncattr(attname, attval)
+
+#---------------------------------------------------------------------------------------------------
+def format_can_hold(schema, file_format) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns true if the variables recorded in schema, typically a SchemaDataset object, can be stored
+   in a netCDF file of the specified format. Only the netCDF-3 formats impose limits: in the classic
+   format the fixed-size variables and the start of the record variables must lie within the first
+   2 GiB of the file, and no variable (or record thereof, for record variables) may exceed 2 GiB,
+   or 4 GiB in the 64-bit offset format. In either case the last variable in the file is exempt
+   from the latter limit. The size of the file header is neglected.
+   """
+   if file_format == 'NETCDF3_CLASSIC' :
+      offset_limit, size_limit = 2**31, 2**31 - 4
+   elif file_format.startswith('NETCDF3_64BIT') :
+      offset_limit, size_limit = None, 2**32 - 4
+   else :
+      return True
+   fixed_vars, rec_vars = [], []
+   for var in schema.variables.values() :
+      dims = [schema.dimensions[d] for d in var.dimensions]
+      if dims and dims[0].isunlimited() :
+         rec_vars.append(var.dtype.itemsize * int(np.prod([len(d) for d in dims[1:]])))
+      else :
+         fixed_vars.append(var.dtype.itemsize * int(np.prod([len(d) for d in dims])))
+   # variables are laid out in the file with all fixed-size variables preceding the record variables
+   sizes = fixed_vars + rec_vars
+   if any([size > size_limit for size in sizes[:-1]]) : return False
+   if offset_limit and sum(fixed_vars[:-1] if not rec_vars else fixed_vars) >= offset_limit :
+      return False
+   return True
+
+#---------------------------------------------------------------------------------------------------
+def update_schema(schema, ncdataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Apply the dimensions, variables and attributes recorded in schema, typically a SchemaDataset
+   object, to the existing netCDF dataset ncdataset. Items not defined in ncdataset are created,
+   while the definitions of existing dimensions and variables must match those in schema. Existing
+   attributes are overwritten if their values differ, with the exception of _FillValue attributes,
+   which cannot be changed. All items are checked before any changes are made, a CDLContentError
+   exception being raised at the first incompatibility. Returns the number of changes made.
+   """
+   # check compatibility
+   unlimited = [d for d in ncdataset.dimensions if ncdataset.dimensions[d].isunlimited()]
+   for dimname, dim in schema.dimensions.items() :
+      if dimname not in ncdataset.dimensions :
+         if dim.isunlimited() and unlimited :
+            raise CDLContentError("Unlimited dimension '%s' cannot be added since netCDF dataset "
+               "already has unlimited dimension '%s'." % (dimname, unlimited[0]))
+         continue
+      ncdim = ncdataset.dimensions[dimname]
+      if dim.isunlimited() != ncdim.isunlimited() or \
+         (not dim.isunlimited() and len(dim) != len(ncdim)) :
+         raise CDLContentError("Definition of dimension '%s' does not match netCDF dataset." \
+            % dimname)
+   for varname, var in schema.variables.items() :
+      if varname not in ncdataset.variables : continue
+      ncvar = ncdataset.variables[varname]
+      if var.dtype != ncvar.dtype or tuple(var.dimensions) != tuple(ncvar.dimensions) :
+         raise CDLContentError("Definition of variable '%s' does not match netCDF dataset." \
+            % varname)
+      if '_FillValue' in var.ncattrs() and ('_FillValue' not in ncvar.ncattrs() or \
+         not attribute_values_equal(var._FillValue, ncvar._FillValue)) :
+         raise CDLContentError("Attribute %s:_FillValue cannot be changed in netCDF dataset." \
+            % varname)
+
+   # apply changes
+   nchanges = 0
+   for dimname, dim in schema.dimensions.items() :
+      if dimname in ncdataset.dimensions : continue
+      ncdataset.createDimension(dimname, None if dim.isunlimited() else len(dim))
+      nchanges += 1
+   for varname, var in schema.variables.items() :
+      if varname in ncdataset.variables :
+         ncvar = ncdataset.variables[varname]
+      else :
+         ncvar = ncdataset.createVariable(varname, var.dtype, var.dimensions,
+            fill_value=var._attrs.get('_FillValue'), shuffle=False)
+         nchanges += 1
+      nchanges += update_attributes(var, ncvar)
+   nchanges += update_attributes(schema, ncdataset)
+   return nchanges
+
+#---------------------------------------------------------------------------------------------------
+def update_attributes(obj, ncobj) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Copy those attributes attached to obj which are missing from, or have a different value in,
+   ncobj. The _FillValue attribute is skipped. Returns the number of attributes copied.
+   """
+   nchanges = 0
+   for attname in obj.ncattrs() :
+      if attname == '_FillValue' : continue
+      attval = obj.getncattr(attname)
+      if attname in ncobj.ncattrs() and attribute_values_equal(attval, ncobj.getncattr(attname)) :
+         continue
+      ncobj.setncattr(attname, attval)
+      nchanges += 1
+   return nchanges
+
+#---------------------------------------------------------------------------------------------------
+def check_schema(schema, ncdataset) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Check that the dimensions, variables and attributes recorded in schema, typically a SchemaDataset
+   object, exactly match those defined in ncdataset. The current length of the unlimited dimension,
+   if any, is ignored. A CDLContentError exception is raised at the first mismatch.
+   """
+   if sorted(schema.dimensions) != sorted(ncdataset.dimensions) :
+      raise CDLContentError("Dimension names %s do not match those in netCDF dataset (%s)" \
+         % (sorted(schema.dimensions), sorted(ncdataset.dimensions)))
+   for dimname, dim in schema.dimensions.items() :
+      ncdim = ncdataset.dimensions[dimname]
+      if dim.isunlimited() != ncdim.isunlimited() or \
+         (not dim.isunlimited() and len(dim) != len(ncdim)) :
+         raise CDLContentError("Definition of dimension '%s' does not match netCDF dataset." \
+            % dimname)
+   if sorted(schema.variables) != sorted(ncdataset.variables) :
+      raise CDLContentError("Variable names %s do not match those in netCDF dataset (%s)" \
+         % (sorted(schema.variables), sorted(ncdataset.variables)))
+   for varname, var in schema.variables.items() :
+      ncvar = ncdataset.variables[varname]
+      if var.dtype != ncvar.dtype or tuple(var.dimensions) != tuple(ncvar.dimensions) :
+         raise CDLContentError("Definition of variable '%s' does not match netCDF dataset." \
+            % varname)
+      check_attributes(var, ncvar, varname+':')
+   check_attributes(schema, ncdataset, ':')
+
+#---------------------------------------------------------------------------------------------------
+def check_attributes(obj, ncobj, prefix='') :
+#---------------------------------------------------------------------------------------------------
+   """
+   Check that the attributes attached to obj exactly match those attached to ncobj, raising a
+   CDLContentError exception if they do not. The prefix argument is used in error messages.
+   """
+   if sorted(obj.ncattrs()) != sorted(ncobj.ncattrs()) :
+      raise CDLContentError("Attribute names for '%s' do not match those in netCDF dataset." \
+         % prefix)
+   for attname in obj.ncattrs() :
+      if not attribute_values_equal(obj.getncattr(attname), ncobj.getncattr(attname)) :
+         raise CDLContentError("Value of attribute %s%s does not match netCDF dataset." \
+            % (prefix, attname))
+
+#---------------------------------------------------------------------------------------------------
+def attribute_values_equal(val1, val2) :
+#---------------------------------------------------------------------------------------------------
+   """Returns true if the two attribute values, which may be strings, scalars or arrays, are equal."""
+   if isinstance(val1, basestring) or isinstance(val2, basestring) :
+      return val1 == val2
+   return np.array_equal(np.atleast_1d(val1), np.atleast_1d(val2))
+
+#---------------------------------------------------------------------------------------------------
+def merge_names(names1, names2) :
+#---------------------------------------------------------------------------------------------------
+   """Returns the names in sequence names1 followed by those in names2 not present in names1."""
+   return list(names1) + [name for name in names2 if name not in names1]
+
+#---------------------------------------------------------------------------------------------------
+def first_axis_range(key, value) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns the (start, stop) range of indices along the first dimension of a variable that is
+   covered by assigning the numpy array value to the region of the variable defined by key.
+   """
+   if isinstance(key, tuple) : key = key[0] if key else Ellipsis
+   nrows = value.shape[0] if value.ndim else 1
+   if isinstance(key, slice) :
+      start = key.start or 0
+      stop = key.stop if key.stop is not None else start + nrows
+   elif isinstance(key, (int, long, np.integer)) :
+      start, stop = key, key+1
+   else :
+      start, stop = 0, nrows
+   return start, stop
+
+#---------------------------------------------------------------------------------------------------
+def npy_header(dtype, shape, hdrlen=0) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns a version 1.0 NumPy .npy file header for an array of the specified dtype and shape.
+   The header is padded with spaces to a multiple of 64 bytes or, if greater, to hdrlen bytes.
+   """
+   magic = '\x93NUMPY\x01\x00'
+   header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" \
+      % (np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple([int(x) for x in shape]))
+   total = len(magic) + 2 + len(header) + 1
+   total = max(hdrlen, total + (64 - total % 64) % 64)
+   header += ' ' * (total - len(magic) - 2 - len(header) - 1) + '\n'
+   return magic + struct.pack('<H', len(header)) + header
+
+#---------------------------------------------------------------------------------------------------
+def json_value(value) :
+#---------------------------------------------------------------------------------------------------
+   """Returns the JSON-serialisable equivalent of an attribute value."""
+   if isinstance(value, np.ndarray) :
+      return value.tolist()
+   elif isinstance(value, (list, tuple)) :
+      # multi-valued attributes are held as lists of numpy scalars
+      return np.asarray(value).tolist()
+   elif isinstance(value, np.generic) :
+      return value.item()
+   return value
+
+#---------------------------------------------------------------------------------------------------
+def token_entry(tok) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns a JSON-serialisable list describing a lexer token: its type, value, line number, lexical
+   position and, for numeric values, numpy data type. String values are decoded as latin-1 so that
+   arbitrary byte strings survive the round trip.
+   """
+   if isinstance(tok.value, np.generic) :
+      return [tok.type, tok.value.item(), tok.lineno, tok.lexpos, tok.value.dtype.str]
+   return [tok.type, tok.value.decode('latin-1'), tok.lineno, tok.lexpos, None]
+
+#---------------------------------------------------------------------------------------------------
+def make_token(toktype, value, lineno, lexpos=0, dtype=None) :
+#---------------------------------------------------------------------------------------------------
+   """Returns a lexer token with the specified attributes, as stored by the token_entry function."""
+   tok = lex.LexToken()
+   tok.type = toktype
+   if dtype :
+      tok.value = np.dtype(dtype).type(value)
+   elif isinstance(value, unicode) :
+      tok.value = value.encode('latin-1')
+   else :
+      tok.value = value
+   tok.lineno = lineno
+   tok.lexpos = lexpos
+   return tok
+
+#---------------------------------------------------------------------------------------------------
+def read_compiled_trailer(filename) :
+#---------------------------------------------------------------------------------------------------
+   """Returns the trailer of a compiled CDL file, raising an IOError if the file is invalid."""
+   f = open(filename, 'rb')
+   try :
+      if f.read(len(COMPILED_MAGIC)) != COMPILED_MAGIC :
+         raise IOError("%s is not a compiled CDL file" % filename)
+      offset = struct.unpack('<Q', f.read(8))[0]
+      f.seek(offset)
+      return json.load(f)
+   finally :
+      f.close()
+
+#---------------------------------------------------------------------------------------------------
+def is_compiled_current(cachefile, cdlfile) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns true if the compiled CDL file cachefile exists and was created from the current version
+   of cdlfile, as judged by its size and modification time.
+   """
+   if not os.path.exists(cachefile) : return False
+   try :
+      trailer = read_compiled_trailer(cachefile)
+   except (IOError, ValueError, struct.error) :
+      return False
+   stat = os.stat(cdlfile)
+   return trailer.get('size') == stat.st_size and trailer.get('mtime') == stat.st_mtime
 
 #---------------------------------------------------------------------------------------------------
 def str_list_to_char_arr(slist, maxlen) :
@@ -859,16 +4436,19 @@ def pad_array(var, varlen, arr) :
 #---------------------------------------------------------------------------------------------------
    """
    Pad out array arr with fill values if it contains fewer elements than are required by the host
-   variable.
+   variable. Lists, ScratchArray and StreamedArray objects are padded in place, whereas numpy
+   arrays are copied.
+   The padded array is returned.
    """
-   if '_FillValue' in var.ncattrs() :
-      fv = var._FillValue
-   elif 'missing_value' in var.ncattrs() :
-      fv = var.missing_value
-   else :
-      fv = get_default_fill_value(var.dtype.char)
+   fv = get_fill_value(var)
    arrlen = len(arr)
-   arr.extend([fv]*(varlen-arrlen))
+   if isinstance(arr, (ScratchArray, StreamedArray)) :
+      arr.pad(fv, varlen-arrlen)
+   elif isinstance(arr, np.ndarray) :
+      arr = np.concatenate([arr, np.array([fv]*(varlen-arrlen), dtype=arr.dtype)])
+   else :
+      arr.extend([fv]*(varlen-arrlen))
+   return arr
 
 #---------------------------------------------------------------------------------------------------
 def deescapify(name) :
@@ -901,13 +4481,28 @@ def expand_escapes(tstring) :
    """
    return tstring.decode('string_escape')
 
+#---------------------------------------------------------------------------------------------------
+def get_fill_value(var) :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns the fill value for the specified variable, i.e. the value of its _FillValue attribute or,
+   failing that, its missing_value attribute or, failing that, the default netCDF fill value for
+   the variable's data type.
+   """
+   if '_FillValue' in var.ncattrs() :
+      return var._FillValue
+   elif 'missing_value' in var.ncattrs() :
+      return var.missing_value
+   else :
+      return get_default_fill_value(var.dtype.char)
+
 #---------------------------------------------------------------------------------------------------
 def get_default_fill_value(datatype) :
 #---------------------------------------------------------------------------------------------------
    """Returns the default netCDF fill value for the specified numpy dtype.char code."""
    if datatype == 'b' :
       return NC_FILL_BYTE
-   elif datatype in ('S','U') :
+   elif datatype in ('S','U','c') :
       return NC_FILL_CHAR
    elif datatype in ('h','s') :
       return NC_FILL_SHORT
@@ -925,17 +4520,60 @@ def main() :
 #---------------------------------------------------------------------------------------------------
    """Rudimentary main function - primarily for testing purposes at this point in time."""
    debug = 0
-   if len(sys.argv) < 2 :
+   args = [x for x in sys.argv[1:] if '=' not in x]
+   min_args = {'aggregate': 3, 'index': 2, 'validate': 2, 'verify': 3, 'client': 2, 'watch': 3}
+   if not args or len(args) < min_args.get(args[0], 1) :
       print "usage: python cdlparser.py cdlfile [keyword=value, ...]"
+      print "       python cdlparser.py aggregate ncfile cdlfile [cdlfile ...] [keyword=value, ...]"
+      print "       python cdlparser.py index cdlfile [keyword=value, ...]"
+      print "       python cdlparser.py validate cdlfile [header_only=True] [keyword=value, ...]"
+      print "       python cdlparser.py verify cdlfile ncfile [keyword=value, ...]"
+      print "       python cdlparser.py serve [address=...] [workers=N] [keyword=value, ...]"
+      print "       python cdlparser.py client cdlfile [ncfile] [address=...]"
+      print "       python cdlparser.py watch cdldir ncdir [once=True] [workers=N] [key=value ...]"
       sys.exit(1)
-   cdlfile = sys.argv[1]
-   kwargs = {}
-   if len(sys.argv) > 2 :
-      keys = [x.split('=')[0] for x in sys.argv[2:]]
-      vals = [eval(x.split('=')[1]) for x in sys.argv[2:]]
-      kwargs = dict(zip(keys,vals))
+   keys = [x.split('=')[0] for x in sys.argv[1:] if '=' in x]
+   vals = [eval(x.split('=',1)[1]) for x in sys.argv[1:] if '=' in x]
+   kwargs = dict(zip(keys,vals))
+   if args[0] == 'serve' :
+      try :
+         CDLServer(**kwargs).serve_forever()
+      except KeyboardInterrupt :
+         pass
+      return
+   elif args[0] == 'watch' :
+      once = kwargs.pop('once', False)
+      watcher = CDLWatcher(args[1], args[2], **kwargs)
+      try :
+         watcher.watch(iterations=1 if once else None)
+      except KeyboardInterrupt :
+         pass
+      finally :
+         watcher.close()
+      return
+   elif args[0] == 'client' :
+      client = CDLClient(**kwargs)
+      try :
+         print client.convert_file(args[1], ncfile=args[2] if len(args) > 2 else None)
+      finally :
+         client.close()
+      return
+   header_only = kwargs.pop('header_only', False)
    cdlparser = CDL3Parser(**kwargs)
-   ncdataset = cdlparser.parse_file(cdlfile)
+   if args[0] == 'validate' :
+      cdlparser.validate_file(args[1], header_only=header_only)
+      return
+   elif args[0] == 'verify' :
+      differences = cdlparser.verify(args[1], args[2])
+      for msg in differences : print msg
+      sys.exit(1 if differences else 0)
+   elif args[0] == 'index' :
+      cdlparser.index_file(args[1])
+      return
+   elif args[0] == 'aggregate' :
+      ncdataset = cdlparser.aggregate_files(args[2:], ncfile=args[1])
+   else :
+      ncdataset = cdlparser.parse_file(args[0])
    try :
       ncdataset.close()   # wrap in try block since dataset may get closed by parser
    except :
@@ -0,0 +1,64 @@
+"""
+Benchmark of the startup cost of lightweight operations, i.e. the time taken, in a fresh interpreter,
+to import the cdlparser module and then to validate the header of a CDL file. The time taken to
+import numpy alone is shown for comparison. Each measurement is the median of several runs.
+
+This is not part of the unit test suite. Run it from the test directory as follows:
+
+    python benchmark_startup.py [cdlfile] [nruns]
+"""
+import os
+import sys
+import subprocess
+
+TESTFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testfiles')
+
+# scripts timed in a fresh interpreter; each prints the elapsed time in seconds
+SCRIPTS = [
+   ("import numpy", r"""
+import time
+t0 = time.time()
+import numpy
+print time.time() - t0
+"""),
+   ("import cdlparser", r"""
+import time
+t0 = time.time()
+import cdlparser
+print time.time() - t0
+"""),
+   ("import + header-only validation", r"""
+import sys, time
+t0 = time.time()
+import cdlparser
+cdlparser.CDL3Parser(log_level=100).validate_file(sys.argv[1], header_only=True)
+print time.time() - t0
+"""),
+]
+
+#---------------------------------------------------------------------------------------------------
+def run_script(script, cdlfile) :
+#---------------------------------------------------------------------------------------------------
+   """Run script in a fresh interpreter and return the elapsed time that it reports."""
+   env = dict(os.environ)
+   modpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+   env['PYTHONPATH'] = os.pathsep.join([modpath, env.get('PYTHONPATH', '')])
+   proc = subprocess.Popen([sys.executable, '-c', script, cdlfile], env=env,
+      stdout=subprocess.PIPE)
+   output = proc.communicate()[0]
+   if proc.returncode : raise RuntimeError("Benchmark script failed:\n" + script)
+   return float(output.split()[-1])
+
+#---------------------------------------------------------------------------------------------------
+def main() :
+#---------------------------------------------------------------------------------------------------
+   cdlfile = sys.argv[1] if len(sys.argv) > 1 else os.path.join(TESTFILES_DIR, 'basics.cdl')
+   nruns = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+   for label, script in SCRIPTS :
+      times = sorted([run_script(script, cdlfile) for i in range(nruns)])
+      print "%-35s %.3fs" % (label, times[nruns//2])
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   main()
@@ -0,0 +1,104 @@
+"""
+Unit tests for aggregation of multiple CDL files along the unlimited dimension.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEMPLATE = r"""netcdf hourly {
+   dimensions:
+      lat = 2 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float lat(lat) ;
+      float tas(time, lat) ;
+         tas:units = "%s" ;
+   // global attributes
+      :comment = "hourly fragment" ;
+   data:
+      time = %s ;
+      lat = %s ;
+      tas = %s ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestAggregate(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'daily.nc')
+      self.cdlfiles = []
+      for hour in range(3) :
+         time = "%d, %d" % (2*hour, 2*hour+1)
+         tas = ", ".join(["%d.0f" % (4*hour+i) for i in range(4)])
+         cdltext = CDL_TEMPLATE % ("K", time, "0.0f, 10.0f", tas)
+         self.cdlfiles.append(self.write_cdl("hour%d.cdl" % hour, cdltext))
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def write_cdl(self, filename, cdltext) :
+      cdlfile = os.path.join(self.tmpdir, filename)
+      f = open(cdlfile, 'w')
+      f.write(cdltext)
+      f.close()
+      return cdlfile
+
+   def test_aggregated_records(self) :
+      parser = cdlparser.CDL3Parser()
+      dataset = parser.aggregate_files(self.cdlfiles, ncfile=self.ncfile)
+      try :
+         self.assertTrue(len(dataset.dimensions['time']) == 6)
+         self.assertTrue(np.array_equal(dataset.variables['time'][:], np.arange(6)))
+         tas = dataset.variables['tas'][:]
+         self.assertTrue(tas.shape == (6,2))
+         self.assertTrue(np.array_equal(tas.flatten(), np.arange(12, dtype=np.float32)))
+         self.assertTrue(np.array_equal(dataset.variables['lat'][:], [0.0, 10.0]))
+      finally :
+         dataset.close()
+
+   def test_mismatched_header(self) :
+      cdltext = CDL_TEMPLATE % ("degC", "6", "0.0f, 10.0f", "1.0f, 2.0f")
+      self.cdlfiles.append(self.write_cdl("badhour.cdl", cdltext))
+      parser = cdlparser.CDL3Parser(close_on_completion=True)
+      self.assertRaises(cdlparser.CDLContentError, parser.aggregate_files, self.cdlfiles,
+         ncfile=self.ncfile)
+
+   def test_mismatched_second_header(self) :
+      # the partially aggregated dataset must be closed and the output file deleted
+      cdltext = CDL_TEMPLATE % ("degC", "2, 3", "0.0f, 10.0f", "1.0f, 2.0f")
+      self.cdlfiles[1] = self.write_cdl("badhour.cdl", cdltext)
+      parser = cdlparser.CDL3Parser()
+      self.assertRaises(cdlparser.CDLContentError, parser.aggregate_files, self.cdlfiles,
+         ncfile=self.ncfile)
+      self.assertFalse(parser.ncdataset.isopen())
+      self.assertFalse(os.path.exists(self.ncfile))
+
+   def test_syntax_error_in_second_file(self) :
+      cdltext = CDL_TEMPLATE % ("K", "2, 3", "0.0f 10.0f", "1.0f, 2.0f")
+      self.cdlfiles[1] = self.write_cdl("badhour.cdl", cdltext)
+      parser = cdlparser.CDL3Parser()
+      self.assertRaises(cdlparser.CDLSyntaxError, parser.aggregate_files, self.cdlfiles,
+         ncfile=self.ncfile)
+      self.assertFalse(parser.ncdataset.isopen())
+      self.assertFalse(os.path.exists(self.ncfile))
+
+   def test_existing_output_kept(self) :
+      # an output file that was not created by aggregate_files is not deleted
+      cdltext = CDL_TEMPLATE % ("degC", "2, 3", "0.0f, 10.0f", "1.0f, 2.0f")
+      self.cdlfiles[1] = self.write_cdl("badhour.cdl", cdltext)
+      parser = cdlparser.CDL3Parser(update=True)
+      cdlparser.CDL3Parser(close_on_completion=True).parse_file(self.cdlfiles[0], self.ncfile)
+      self.assertRaises(cdlparser.CDLContentError, parser.aggregate_files, self.cdlfiles,
+         ncfile=self.ncfile)
+      self.assertTrue(os.path.exists(self.ncfile))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,122 @@
+"""
+Unit tests for the compiled CDL cache used to re-parse CDL files without lexing them.
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf compiled {
+   dimensions:
+      lat = 2 ;
+      lon = 3 ;
+      namelen = 4 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "days since 1970-01-01" ;
+      float tas(time, lat, lon) ;
+         tas:valid_range = 0.0f, 100.0f ;
+      double height ;
+      short flag(lon) ;
+         flag:_FillValue = -1s ;
+      char name(lat, namelen) ;
+   // global attributes
+      :comment = "compiled; cached" ;
+   data:
+      time = 0, 1 ;
+      tas = 1, 2.5f, 3.0, 4, 5, 6, 7, 8, 9, 10, 11 ;
+      height = 1.5 ;
+      flag = 1s, _ ;
+      name = "abcd", "ef" ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestCompiled(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.cdlfile = os.path.join(self.tmpdir, 'compiled.cdl')
+      self.write_cdl(CDL_TEXT)
+      self.cachefile = self.cdlfile + '.cdlc'
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def write_cdl(self, cdltext) :
+      f = open(self.cdlfile, 'w')
+      f.write(cdltext)
+      f.close()
+
+   def convert(self, ncname, **kwargs) :
+      parser = cdlparser.CDL3Parser(compiled_cache=True, **kwargs)
+      return parser, parser.parse_file(self.cdlfile, ncfile=os.path.join(self.tmpdir, ncname))
+
+   def check_dataset(self, ncdataset) :
+      self.assertTrue(ncdataset.comment == "compiled; cached")
+      self.assertTrue(ncdataset.variables['time'].units == "days since 1970-01-01")
+      self.assertTrue(np.array_equal(ncdataset.variables['tas'].valid_range, [0.0, 100.0]))
+      tas = ncdataset.variables['tas'][:]
+      self.assertTrue(tas.shape == (2,2,3))
+      self.assertTrue(np.array_equal(tas.flatten()[:11], [1, 2.5, 3, 4, 5, 6, 7, 8, 9, 10, 11]))
+      self.assertTrue(tas.mask.flatten()[11])
+      self.assertTrue(ncdataset.variables['height'].getValue() == 1.5)
+      flag = ncdataset.variables['flag'][:]
+      self.assertTrue(flag[0] == 1 and np.all(flag.mask[1:]))
+      self.assertTrue(ncdataset.variables['name'][1].tostring() == "ef\0\0")
+
+   def test_replay(self) :
+      parser, ncdataset = self.convert('first.nc')
+      ncdataset.close()
+      self.assertTrue(os.path.exists(self.cachefile))
+      lexed_tokens = parser.ntokens
+      parser, ncdataset = self.convert('second.nc', file_format='NETCDF4_CLASSIC')
+      try :
+         self.assertTrue(ncdataset.file_format == 'NETCDF4_CLASSIC')
+         self.assertTrue(parser.ntokens < lexed_tokens)
+         self.check_dataset(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_compiled_layout(self) :
+      self.convert('first.nc')[1].close()
+      trailer = cdlparser.read_compiled_trailer(self.cachefile)
+      blocks = dict([(b['name'], b) for b in trailer['blocks']])
+      self.assertTrue(blocks['tas']['dtype'] == '<f4' and blocks['tas']['count'] == 11)
+      self.assertTrue(blocks['tas']['offset'] % 64 == 0)
+      f = open(self.cachefile, 'rb')
+      f.seek(blocks['tas']['offset'])
+      tas = np.frombuffer(f.read(4*11), dtype='<f4')
+      f.close()
+      self.assertTrue(np.array_equal(tas, [1, 2.5, 3, 4, 5, 6, 7, 8, 9, 10, 11]))
+      self.assertTrue(trailer['tokens'][-1][0] == 'DATA')
+      self.assertTrue([t[0] for t in trailer['trailer']] == ['RBRACE'])
+
+   def test_invalidation(self) :
+      self.convert('first.nc')[1].close()
+      self.write_cdl(CDL_TEXT.replace("height = 1.5", "height = 2.5"))
+      os.utime(self.cdlfile, (time.time()+10, time.time()+10))
+      parser, ncdataset = self.convert('second.nc')
+      try :
+         self.assertTrue(ncdataset.variables['height'].getValue() == 2.5)
+      finally :
+         ncdataset.close()
+      parser, ncdataset = self.convert('third.nc')
+      try :
+         self.assertTrue(ncdataset.variables['height'].getValue() == 2.5)
+      finally :
+         ncdataset.close()
+
+   def test_failed_parse(self) :
+      self.write_cdl(CDL_TEXT.replace("height = 1.5 ;", "height = 1.5"))
+      self.assertRaises(cdlparser.CDLSyntaxError, self.convert, 'bad.nc')
+      self.assertFalse(os.path.exists(self.cachefile))
+      self.assertFalse(os.path.exists(self.cachefile + '.tmp'))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,114 @@
+"""
+Unit tests for delta conversion, i.e. in-place update of a netCDF file with only those attributes
+and variables which have changed since it was generated.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEMPLATE = r"""netcdf delta {
+   dimensions:
+      lat = 2 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float lat(lat) ;
+         lat:units = "%s" ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+   // global attributes
+      :comment = "delta test" ;
+   data:
+      time = %s ;
+      lat = -45.0f, 45.0f ;
+      tas = %s ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestDelta(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'delta.nc')
+      self.convert("degrees_north", "0, 1", "1.0f, 2.0f, 3.0f, 4.0f")
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def convert(self, lat_units, time, tas) :
+      self.parser = cdlparser.CDL3Parser(delta=True, close_on_completion=True)
+      self.parser.parse_text(CDL_TEMPLATE % (lat_units, time, tas), ncfile=self.ncfile)
+      return cdlparser.nc4.Dataset(self.ncfile)
+
+   def test_hashes_saved(self) :
+      self.assertTrue(os.path.exists(self.ncfile + cdlparser.DELTA_SUFFIX))
+      self.assertTrue(self.parser.delta_records == {'time': 2, 'tas': 2})
+
+   def test_unchanged_input(self) :
+      ds = self.convert("degrees_north", "0, 1", "1.0f, 2.0f, 3.0f, 4.0f")
+      try :
+         self.assertTrue(self.parser.delta_inplace)
+         self.assertTrue(self.parser.nvalues == 0)
+         self.assertTrue(np.array_equal(ds.variables['tas'][:].flatten(), [1.0, 2.0, 3.0, 4.0]))
+      finally :
+         ds.close()
+
+   def test_changed_data(self) :
+      ds = self.convert("degrees_north", "0, 1", "1.0f, 2.0f, 3.0f, 5.0f")
+      try :
+         self.assertTrue(self.parser.delta_inplace)
+         self.assertTrue(self.parser.nvalues == 4)
+         self.assertTrue(np.array_equal(ds.variables['tas'][:].flatten(), [1.0, 2.0, 3.0, 5.0]))
+         self.assertTrue(np.array_equal(ds.variables['lat'][:], [-45.0, 45.0]))
+      finally :
+         ds.close()
+
+   def test_changed_attribute(self) :
+      ds = self.convert("degrees", "0, 1", "1.0f, 2.0f, 3.0f, 4.0f")
+      try :
+         self.assertTrue(self.parser.delta_inplace)
+         self.assertTrue(self.parser.nvalues == 0)
+         self.assertTrue(ds.variables['lat'].units == "degrees")
+         self.assertTrue(ds.comment == "delta test")
+      finally :
+         ds.close()
+
+   def test_added_records(self) :
+      ds = self.convert("degrees_north", "0, 1, 2", "1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f")
+      try :
+         self.assertTrue(self.parser.delta_inplace)
+         self.assertTrue(len(ds.dimensions['time']) == 3)
+         self.assertTrue(np.array_equal(ds.variables['time'][:], [0, 1, 2]))
+      finally :
+         ds.close()
+
+   def test_removed_records(self) :
+      ds = self.convert("degrees_north", "0", "1.0f, 2.0f")
+      try :
+         self.assertTrue(not self.parser.delta_inplace)
+         self.assertTrue(len(ds.dimensions['time']) == 1)
+         self.assertTrue(np.array_equal(ds.variables['tas'][:].flatten(), [1.0, 2.0]))
+      finally :
+         ds.close()
+      self.assertTrue(os.path.exists(self.ncfile + cdlparser.DELTA_SUFFIX))
+
+   def test_changed_schema(self) :
+      cdltext = CDL_TEMPLATE.replace("float tas", "double tas")
+      parser = cdlparser.CDL3Parser(delta=True, close_on_completion=True)
+      parser.parse_text(cdltext % ("degrees_north", "0, 1", "1.0, 2.0, 3.0, 4.0"),
+         ncfile=self.ncfile)
+      self.assertTrue(not parser.delta_inplace)
+      ds = cdlparser.nc4.Dataset(self.ncfile)
+      try :
+         self.assertTrue(ds.variables['tas'].dtype == np.float64)
+      finally :
+         ds.close()
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
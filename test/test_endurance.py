@@ -0,0 +1,171 @@
+"""
+Endurance tests which check that memory, file descriptors, threads and logger handlers do not
+accumulate over many repeated parse/close cycles. The number of cycles measured in each test is
+set by the CDLPARSER_SOAK_CYCLES environment variable. The default is kept small so that the
+tests run quickly as part of the regular test suite; for a proper soak test set it to, say, 20000:
+
+   CDLPARSER_SOAK_CYCLES=20000 python test_endurance.py
+
+The growth per cycle in each resource is reported on stderr. These tests rely on the /proc
+filesystem and are skipped on platforms which do not provide it.
+"""
+import os
+import gc
+import sys
+import glob
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+import cdlparser
+
+SOAK_CYCLES = int(os.environ.get('CDLPARSER_SOAK_CYCLES', 150))
+WARMUP_CYCLES = 50
+
+# permitted growth in resident memory: a fixed allowance for the memory retained by the allocator
+# and the regular expression cache, which levels off after a few hundred parsers have been built,
+# plus a rate per cycle
+RSS_ALLOWANCE = 4 * 1024 * 1024
+RSS_GROWTH_PER_CYCLE = 256
+
+TESTFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testfiles')
+
+SYNTHETIC_CDL = r"""netcdf synthetic {
+   dimensions:
+      lat = 4 ;
+      name_len = 8 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+      char name(time, name_len) ;
+      double scale ;
+   // global attributes
+      :comment = "synthetic input %d" ;
+   data:
+      time = %s ;
+      tas = %s ;
+      name = %s ;
+      scale = 0.5 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+def synthetic_cdl(index) :
+#---------------------------------------------------------------------------------------------------
+   """Returns synthetic CDL text whose number of records varies with index."""
+   nrecs = 1 + index % 50
+   time = ", ".join([str(i) for i in range(nrecs)])
+   tas = ", ".join(["%d.0f" % i for i in range(nrecs*4)])
+   names = ", ".join(['"rec%d"' % i for i in range(nrecs)])
+   return SYNTHETIC_CDL % (index, time, tas, names)
+
+#---------------------------------------------------------------------------------------------------
+def resident_memory() :
+#---------------------------------------------------------------------------------------------------
+   """Returns the resident memory size, in bytes, of the current process."""
+   f = open('/proc/self/statm')
+   try :
+      return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+   finally :
+      f.close()
+
+#---------------------------------------------------------------------------------------------------
+def open_descriptors() :
+#---------------------------------------------------------------------------------------------------
+   """Returns the number of open file descriptors in the current process."""
+   return len(os.listdir('/proc/self/fd'))
+
+#---------------------------------------------------------------------------------------------------
+def resource_usage() :
+#---------------------------------------------------------------------------------------------------
+   """
+   Returns the resident memory size, and the numbers of open file descriptors, threads and
+   'cdlparser' logger handlers, after collecting any cyclic garbage, e.g. discarded parsers.
+   """
+   gc.collect()
+   return dict(rss=resident_memory(), fds=open_descriptors(), threads=threading.active_count(),
+      handlers=len(logging.getLogger('cdlparser').handlers))
+
+#---------------------------------------------------------------------------------------------------
+class TestEndurance(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      if not os.path.exists('/proc/self/statm') :
+         self.skipTest("resource usage cannot be measured without the /proc filesystem")
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'soak.nc')
+      self.corpus = []
+      for cdlfile in sorted(glob.glob(os.path.join(TESTFILES_DIR, '*.cdl'))) :
+         if os.path.basename(cdlfile) == 'bigdata.cdl' : continue   # too slow to parse repeatedly
+         f = open(cdlfile)
+         self.corpus.append(f.read())
+         f.close()
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def parse(self, parser, cdltext) :
+      """Parse cdltext, ignoring the errors expected from the invalid files in the corpus."""
+      try :
+         return parser.parse_text(cdltext, ncfile=self.ncfile)
+      except (cdlparser.CDLSyntaxError, cdlparser.CDLContentError) :
+         return None
+
+   def soak(self, name, cycle) :
+      """
+      Call cycle(i) for WARMUP_CYCLES cycles and then for SOAK_CYCLES cycles, during which the
+      growth in each resource is measured, reported and checked.
+      """
+      for i in range(WARMUP_CYCLES) : cycle(i)
+      before = resource_usage()
+      for i in range(WARMUP_CYCLES, WARMUP_CYCLES+SOAK_CYCLES) : cycle(i)
+      after = resource_usage()
+      growth = dict([(key, after[key] - before[key]) for key in before])
+      sys.stderr.write("\n%s: %d cycles; growth per cycle: rss %.1f bytes, fds %.4f, threads %.4f, "
+         "handlers %.4f\n" % (name, SOAK_CYCLES, growth['rss'] / float(SOAK_CYCLES),
+         growth['fds'] / float(SOAK_CYCLES), growth['threads'] / float(SOAK_CYCLES),
+         growth['handlers'] / float(SOAK_CYCLES)))
+      self.assertTrue(growth['fds'] <= 0, "%d file descriptor(s) leaked" % growth['fds'])
+      self.assertTrue(growth['threads'] <= 0, "%d thread(s) leaked" % growth['threads'])
+      self.assertTrue(growth['handlers'] <= 0, "%d handler(s) leaked" % growth['handlers'])
+      self.assertTrue(growth['rss'] <= RSS_ALLOWANCE + RSS_GROWTH_PER_CYCLE * SOAK_CYCLES,
+         "resident memory grew by %d bytes" % growth['rss'])
+
+   def test_reused_parser(self) :
+      parser = cdlparser.CDL3Parser(close_on_completion=True, log_level=logging.CRITICAL)
+      def cycle(i) :
+         if i % 2 :
+            self.parse(parser, synthetic_cdl(i))
+         else :
+            self.parse(parser, self.corpus[(i/2) % len(self.corpus)])
+      self.soak("reused parser", cycle)
+
+   def test_fresh_parsers(self) :
+      def cycle(i) :
+         parser = cdlparser.CDL3Parser(close_on_completion=True, log_level=logging.CRITICAL)
+         self.parse(parser, self.corpus[i % len(self.corpus)])
+      self.soak("fresh parsers", cycle)
+
+   def test_returned_datasets(self) :
+      parser = cdlparser.CDL3Parser(log_level=logging.CRITICAL)
+      def cycle(i) :
+         ncdataset = self.parse(parser, synthetic_cdl(i))
+         if ncdataset is not None : ncdataset.close()
+      self.soak("returned datasets", cycle)
+
+   def test_parser_options(self) :
+      options = [dict(pipeline=True), dict(record_major=True), dict(compute_stats=True),
+         dict(memory_limit=1000, scratch_dir=self.tmpdir), dict(max_records=2)]
+      parsers = [cdlparser.CDL3Parser(close_on_completion=True, log_level=logging.CRITICAL,
+         **kwargs) for kwargs in options]
+      def cycle(i) :
+         self.parse(parsers[i % len(parsers)], synthetic_cdl(i))
+      self.soak("parser options", cycle)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
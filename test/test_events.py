@@ -0,0 +1,112 @@
+"""
+Unit tests for the event-driven (SAX-style) parsing mode.
+"""
+import os
+import unittest
+import cdlparser
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+class EventRecorder(cdlparser.CDLEventHandler) :
+#---------------------------------------------------------------------------------------------------
+   def __init__(self) :
+      self.events = []
+      self.chunks = {}
+      self.parser = None
+      self.ntokens = []   # number of tokens read by the parser when each chunk is received
+
+   def on_dimension(self, name, size) :
+      self.events.append(('dimension', name, size))
+
+   def on_variable(self, name, dtype, dimensions) :
+      self.events.append(('variable', name, dtype.char, dimensions))
+
+   def on_attribute(self, varname, attname, value) :
+      self.events.append(('attribute', varname, attname, value))
+
+   def on_data_chunk(self, varname, data, start) :
+      self.chunks.setdefault(varname, []).append((start, data))
+      if self.parser : self.ntokens.append(self.parser.ntokens)
+
+   def on_end(self) :
+      self.events.append(('end',))
+
+#---------------------------------------------------------------------------------------------------
+class TestEvents(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      tas = ", ".join(["%d.0f" % i for i in range(60)])
+      cdltext = r"""netcdf events {
+         dimensions:
+            lat = 3 ;
+            lon = 4 ;
+            time = unlimited ;
+         variables:
+            float tas(time, lat, lon) ;
+               tas:units = "K" ;
+            int count ;
+         // global attributes
+            :comment = "events" ;
+         data:
+            tas = %s ;
+            count = 42 ;
+      }""" % tas
+      self.handler = EventRecorder()
+      parser = cdlparser.CDL3Parser(handler=self.handler, chunk_size=25)
+      self.result = parser.parse_text(cdltext)
+
+   def test_no_dataset(self) :
+      self.assertTrue(self.result is None)
+      self.assertFalse(os.path.exists('events.nc'))
+
+   def test_header_events(self) :
+      expected = [
+         ('dimension', 'lat', 3),
+         ('dimension', 'lon', 4),
+         ('dimension', 'time', None),
+         ('variable', 'tas', 'f', ('time', 'lat', 'lon')),
+         ('attribute', 'tas', 'units', 'K'),
+         ('variable', 'count', 'i', ()),
+         ('attribute', None, 'comment', 'events'),
+         ('end',),
+      ]
+      self.assertTrue(self.handler.events == expected)
+
+   def test_data_chunks(self) :
+      chunks = self.handler.chunks['tas']
+      self.assertTrue([start for start,data in chunks] == [0, 2, 4])
+      self.assertTrue(all([data.size <= 25 for start,data in chunks]))
+      data = np.concatenate([data for start,data in chunks])
+      self.assertTrue(data.shape == (5,3,4))
+      self.assertTrue(np.array_equal(data.flatten(), np.arange(60, dtype=np.float32)))
+      self.assertTrue(self.handler.chunks['count'][0][1] == 42)
+
+   def test_chunks_emitted_while_parsing(self) :
+      # each chunk should be passed on as soon as it has been parsed, not once the block is complete
+      cdltext = r"""netcdf events {
+         dimensions: n = 100 ; time = unlimited ;
+         variables: int seq(time) ; short pad(n) ;
+         data:
+            seq = %s ;
+            pad = %s ;
+      }""" % (", ".join([str(i) for i in range(1000)]), ", ".join(["1s"] * 30))
+      handler = EventRecorder()
+      handler.parser = cdlparser.CDL3Parser(handler=handler, chunk_size=8)
+      handler.parser.parse_text(cdltext)
+      chunks = handler.chunks['seq']
+      self.assertTrue(len(chunks) == 125)
+      self.assertTrue(all([data.size == 8 for start,data in chunks]))
+      data = np.concatenate([data for start,data in chunks])
+      self.assertTrue(np.array_equal(data, np.arange(1000)))
+      self.assertTrue(len(set(handler.ntokens[:125])) == 125)
+      self.assertTrue(handler.ntokens[0] < 50)
+      # fixed-size variables are padded with fill values
+      pad = np.concatenate([data for start,data in handler.chunks['pad']])
+      self.assertTrue(pad.shape == (100,))
+      self.assertTrue(np.all(pad[:30] == 1))
+      self.assertTrue(np.all(pad[30:] == cdlparser.get_default_fill_value('h')))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
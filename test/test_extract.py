@@ -0,0 +1,125 @@
+"""
+Unit tests for indexing the data section of CDL files and extracting individual variables.
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf archive {
+   dimensions:
+      lat = 2 ;
+      lon = 3 ;
+      namelen = 6 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "days since 1970-01-01; noon" ;
+      float tas(time, lat, lon) ;
+         tas:missing_value = -1.0f ;
+      double lat(lat) ;
+      char name(lat, namelen) ;
+      short flag(lat, lon) ;
+      byte code(lon) ;
+   // global attributes
+      :comment = "data: values, with; separators" ;
+   data:
+      // comment = 1, 2 ;
+      time = 0, 1,
+         2 ;
+      tas = 1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f ;
+      lat = -45.0, 45.0 ;
+      name = "a;b,c", "de
+f" ;
+      code = 'a', ';', 'c' ;
+}
+"""
+
+#---------------------------------------------------------------------------------------------------
+class TestExtract(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.cdlfile = os.path.join(self.tmpdir, 'archive.cdl')
+      f = open(self.cdlfile, 'w')
+      f.write(CDL_TEXT)
+      f.close()
+      self.parser = cdlparser.CDL3Parser()
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def test_index(self) :
+      index = self.parser.index_file(self.cdlfile)
+      self.assertTrue(os.path.exists(self.cdlfile + '.idx'))
+      self.assertTrue(index == json.load(open(self.cdlfile + '.idx')))
+      blocks = dict([(b['name'], b) for b in index['blocks']])
+      names = [b['name'] for b in index['blocks']]
+      self.assertTrue(names == ['time', 'tas', 'lat', 'name', 'code'])
+      self.assertTrue(blocks['time']['line'] == 20)
+      self.assertTrue(blocks['time']['count'] == 3)
+      self.assertTrue(blocks['tas']['count'] == 7)
+      self.assertTrue(blocks['name']['count'] == 2)
+      self.assertTrue(blocks['code']['count'] == 3)
+      self.assertTrue(CDL_TEXT[index['data_offset']:].startswith('data:'))
+      for b in index['blocks'] :
+         block = CDL_TEXT[b['offset']:b['offset']+b['length']]
+         self.assertTrue(block.startswith(b['name'] + ' =') and block.endswith(';'))
+         self.assertTrue(CDL_TEXT.count('\n', 0, b['offset']) + 1 == b['line'])
+
+   def test_extract(self) :
+      time = self.parser.extract(self.cdlfile, 'time')
+      self.assertTrue(np.array_equal(time, [0, 1, 2]))
+      tas = self.parser.extract(self.cdlfile, 'tas')
+      self.assertTrue(tas.shape == (3,2,3) and tas.dtype == np.float32)
+      self.assertTrue(np.array_equal(tas.flatten()[:7], np.arange(1,8)))
+      self.assertTrue(np.all(tas.flatten()[7:] == -1.0))
+      name = self.parser.extract(self.cdlfile, 'name')
+      self.assertTrue(name.shape == (2,6))
+      self.assertTrue(name.tostring() == "a;b,c\0de\nf\0\0")
+      code = self.parser.extract(self.cdlfile, 'code')
+      self.assertTrue(np.array_equal(code, [ord('a'), ord(';'), ord('c')]))
+
+   def test_extract_matches_full_parse(self) :
+      ncfile = os.path.join(self.tmpdir, 'archive.nc')
+      ncdataset = self.parser.parse_file(self.cdlfile, ncfile=ncfile)
+      full_tokens = self.parser.ntokens
+      expected = {}
+      for varname in ['time', 'tas', 'lat', 'flag'] :
+         var = ncdataset.variables[varname]
+         expected[varname] = np.ma.filled(var[:], cdlparser.get_fill_value(var))
+      ncdataset.close()
+      for varname in expected :
+         actual = self.parser.extract(self.cdlfile, varname)
+         self.assertTrue(np.array_equal(actual, expected[varname]))
+         self.assertTrue(self.parser.ntokens < full_tokens)
+
+   def test_earlier_dataset_left_open(self) :
+      ncfile = os.path.join(self.tmpdir, 'archive.nc')
+      ncdataset = self.parser.parse_file(self.cdlfile, ncfile=ncfile)
+      try :
+         self.parser.extract(self.cdlfile, 'lat')
+         self.assertTrue(ncdataset.isopen())
+         self.assertTrue(np.array_equal(ncdataset.variables['lat'][:], [-45.0, 45.0]))
+      finally :
+         ncdataset.close()
+
+   def test_unknown_variable(self) :
+      self.assertRaises(cdlparser.CDLContentError, self.parser.extract, self.cdlfile, 'pr')
+
+   def test_stale_index(self) :
+      self.parser.index_file(self.cdlfile)
+      f = open(self.cdlfile, 'w')
+      f.write(CDL_TEXT.replace("lat = -45.0, 45.0", "lat = -30.0, 30.0"))
+      f.close()
+      os.utime(self.cdlfile, (time.time()+10, time.time()+10))
+      self.assertTrue(np.array_equal(self.parser.extract(self.cdlfile, 'lat'), [-30.0, 30.0]))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
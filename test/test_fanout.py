@@ -0,0 +1,91 @@
+"""
+Unit tests for writing the output of a single parse to multiple netCDF files.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf fanout {
+   dimensions:
+      lat = 2 ;
+      name_len = 4 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+         tas:_FillValue = -1.0f ;
+      char name(lat, name_len) ;
+      double scale ;
+   // global attributes
+      :comment = "fan-out test" ;
+   data:
+      time = 0, 1, 2 ;
+      tas = 1.0f, 2.0f, 3.0f, 4.0f, 5.0f ;
+      name = "abc", "defg" ;
+      scale = 0.5 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestFanout(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.classic = os.path.join(self.tmpdir, 'classic.nc')
+      self.nc4file = os.path.join(self.tmpdir, 'nc4.nc')
+      self.targets = [self.classic, dict(ncfile=self.nc4file, file_format='NETCDF4', zlib=True)]
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def check_output(self) :
+      for filename, file_format in [(self.classic, 'NETCDF3_CLASSIC'), (self.nc4file, 'NETCDF4')] :
+         ds = cdlparser.nc4.Dataset(filename)
+         try :
+            self.assertTrue(ds.file_format == file_format)
+            self.assertTrue(ds.comment == "fan-out test")
+            self.assertTrue(len(ds.dimensions['time']) == 3)
+            tas = ds.variables['tas']
+            self.assertTrue(tas.units == "K")
+            self.assertTrue(np.array_equal(tas[:].filled().flatten(), [1, 2, 3, 4, 5, -1]))
+            self.assertTrue(ds.variables['name'][1].tostring() == "defg")
+            self.assertTrue(ds.variables['scale'].getValue() == 0.5)
+            if file_format == 'NETCDF4' : self.assertTrue(tas.filters()['zlib'])
+         finally :
+            ds.close()
+
+   def test_single_process(self) :
+      parser = cdlparser.CDL3Parser(targets=self.targets)
+      parser.parse_text(CDL_TEXT)
+      self.assertTrue(parser.dataset.filenames == [self.classic, self.nc4file])
+      self.assertTrue(parser.dataset.writers == [])
+      self.check_output()
+
+   def test_writer_processes(self) :
+      parser = cdlparser.CDL3Parser(targets=self.targets, target_workers=2)
+      parser.parse_text(CDL_TEXT)
+      self.assertTrue(len(parser.dataset.writers) == 2)
+      self.check_output()
+
+   def test_write_error(self) :
+      targets = [self.classic, os.path.join(self.tmpdir, 'missing', 'bad.nc')]
+      parser = cdlparser.CDL3Parser(targets=targets)
+      self.assertRaises(cdlparser.CDLWriteError, parser.parse_text, CDL_TEXT)
+
+   def test_conflicting_options(self) :
+      # options selecting another kind of output are rejected rather than silently ignored
+      for kwargs in (dict(handler=cdlparser.CDLEventHandler()), dict(backend='npy'),
+         dict(shard_variables=[['tas']]), dict(shard_records=2), dict(update=True),
+         dict(delta=True)) :
+         self.assertRaises(ValueError, cdlparser.CDL3Parser, targets=self.targets, **kwargs)
+      parser = cdlparser.CDL3Parser(targets=self.targets)
+      self.assertRaises(ValueError, parser.aggregate_files, ['first.cdl', 'second.cdl'])
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
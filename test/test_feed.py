@@ -0,0 +1,94 @@
+"""
+Unit tests for incremental parsing of CDL text via the feed() and close() methods.
+"""
+import os
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf feed {
+   dimensions:
+      lat = 3 ;
+      namelen = 8 ;
+      time = unlimited ;
+   variables:
+      float lat(lat) ;
+         lat:comment = "semicolons; commas, braces {} and \"quotes\" // not a comment" ;
+      char name(namelen) ;
+      byte code(lat) ;
+      int time(time) ;
+   // a comment containing "quotes", 'apostrophes' and ; separators
+      :title = "feed test" ;
+   data:
+      lat = -10.0f, 0.0f, 10.0f ;
+      name = "a;b,c{d}" ;
+      code = 'a', '\'', ';' ;
+      time = 1, 2, 3, 4, 5, 6, 7, 8, 9, 10 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestFeed(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpfile = tempfile.mkstemp(suffix='.nc')[1]
+
+   def tearDown(self) :
+      if os.path.exists(self.tmpfile) : os.remove(self.tmpfile)
+
+   def check_dataset(self, dataset) :
+      self.assertTrue(dataset.title == "feed test")
+      self.assertTrue(dataset.variables['lat'].comment == \
+         'semicolons; commas, braces {} and "quotes" // not a comment')
+      self.assertTrue(np.array_equal(dataset.variables['lat'][:], [-10.0, 0.0, 10.0]))
+      self.assertTrue(dataset.variables['name'][:].tostring() == "a;b,c{d}")
+      self.assertTrue(np.array_equal(dataset.variables['code'][:], [97, 39, 59]))
+      self.assertTrue(np.array_equal(dataset.variables['time'][:], np.arange(1,11)))
+
+   def test_chunk_sizes(self) :
+      parser = cdlparser.CDL3Parser()
+      for chunksize in (1, 2, 3, 7, 64, len(CDL_TEXT)) :
+         for i in range(0, len(CDL_TEXT), chunksize) :
+            parser.feed(CDL_TEXT[i:i+chunksize], ncfile=self.tmpfile)
+         dataset = parser.close()
+         try :
+            self.check_dataset(dataset)
+         finally :
+            dataset.close()
+
+   def test_syntax_error(self) :
+      parser = cdlparser.CDL3Parser(log_level=100)
+      badtext = CDL_TEXT.replace("lat = -10.0f, 0.0f", "lat = -10.0f 0.0f")
+      for i in range(0, len(badtext), 16) :
+         try :
+            parser.feed(badtext[i:i+16], ncfile=self.tmpfile)
+         except cdlparser.CDLSyntaxError :
+            break
+      else :
+         self.assertRaises(cdlparser.CDLSyntaxError, parser.close)
+      # the parser should be reusable after an error
+      for i in range(0, len(CDL_TEXT), 16) :
+         parser.feed(CDL_TEXT[i:i+16], ncfile=self.tmpfile)
+      dataset = parser.close()
+      try :
+         self.check_dataset(dataset)
+      finally :
+         dataset.close()
+
+   def test_error_position(self) :
+      # lexical positions in error messages are measured from the start of the document
+      badtext = CDL_TEXT.replace("lat = -10.0f, 0.0f", "lat = -10.0f 0.0f")
+      lexpos = badtext.index("0.0f, 10.0f")
+      parser = cdlparser.CDL3Parser(log_level=100)
+      try :
+         for i in range(0, len(badtext), 16) :
+            parser.feed(badtext[i:i+16], ncfile=self.tmpfile)
+         parser.close()
+         self.fail("CDLSyntaxError not raised")
+      except cdlparser.CDLSyntaxError, exc :
+         self.assertTrue("lexical position %d" % lexpos in str(exc))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
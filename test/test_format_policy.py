@@ -0,0 +1,94 @@
+"""
+Unit tests for promotion of the netCDF file format for CDL headers declaring large variables.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEMPLATE = r"""netcdf large {
+   dimensions:
+      x = %d ;
+      y = 20000 ;
+      z = 3 ;
+      time = unlimited ;
+   variables:
+      %s
+      int small(z) ;
+         small:_FillValue = -1 ;
+   data:
+      small = 1, 2 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestFormatPolicy(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'large.nc')
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def parse(self, nx, vardecl, **kwargs) :
+      parser = cdlparser.CDL3Parser(**kwargs)
+      return parser.parse_text(CDL_TEMPLATE % (nx, vardecl), ncfile=self.ncfile)
+
+   def check_small(self, ncdataset) :
+      small = ncdataset.variables['small'][:]
+      self.assertTrue(np.array_equal(small[:2], [1, 2]))
+      self.assertTrue(small.mask[2])
+      self.assertTrue(ncdataset.variables['small']._FillValue == -1)
+
+   def test_no_promotion(self) :
+      ncdataset = self.parse(100, "float big(x, y) ;")
+      try :
+         self.assertTrue(ncdataset.file_format == 'NETCDF3_CLASSIC')
+         self.check_small(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_promote_to_64bit(self) :
+      # each record of the first record variable exceeds 2 GiB
+      ncdataset = self.parse(40000, "float big(time, x, y) ; int time(time) ;")
+      try :
+         self.assertTrue(ncdataset.file_format.startswith('NETCDF3_64BIT'))
+         self.check_small(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_promote_beyond_4gib(self) :
+      # the fill-only variable occupies 6.4 GB but no storage is allocated for it
+      ncdataset = self.parse(40000, "double big(x, y) ;")
+      try :
+         self.assertTrue(ncdataset.file_format == 'NETCDF4_CLASSIC')
+         big = ncdataset.variables['big']
+         self.assertTrue(big.size * big.dtype.itemsize > 4 * 2**30)
+         self.assertTrue(big[39999, 19999] is np.ma.masked)
+         self.check_small(ncdataset)
+      finally :
+         ncdataset.close()
+      self.assertTrue(os.path.getsize(self.ncfile) < 2**20)
+
+   def test_error_policy(self) :
+      self.assertRaises(cdlparser.CDLFormatError, self.parse, 40000, "double big(x, y) ;",
+         format_policy='error', close_on_completion=True)
+      self.assertFalse(os.path.exists(self.ncfile))
+
+   def test_format_can_hold(self) :
+      schema = cdlparser.SchemaDataset()
+      schema.createDimension('x', 2**20)
+      schema.createDimension('y', 2**10)
+      schema.createVariable('a', 'f', ('x', 'y'))   # 4 GiB
+      self.assertTrue(cdlparser.format_can_hold(schema, 'NETCDF3_CLASSIC'))   # last variable
+      schema.createVariable('b', 'b', ('x',))
+      self.assertFalse(cdlparser.format_can_hold(schema, 'NETCDF3_CLASSIC'))
+      self.assertFalse(cdlparser.format_can_hold(schema, 'NETCDF3_64BIT'))
+      self.assertTrue(cdlparser.format_can_hold(schema, 'NETCDF4'))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,82 @@
+"""
+Unit tests for reuse of netCDF templates for CDL documents that share a header.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_HEADER = r"""netcdf shared {
+   dimensions:
+      lat = 2 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+   // global attributes
+      :comment = "shared header" ;
+"""
+
+#---------------------------------------------------------------------------------------------------
+class TestHeaderCache(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.parser = cdlparser.CDL3Parser(cache_headers=True, template_dir=self.tmpdir,
+         close_on_completion=True)
+
+   def tearDown(self) :
+      self.parser.clear_header_cache()
+      shutil.rmtree(self.tmpdir)
+
+   def convert(self, cdltext, ncname) :
+      ncfile = os.path.join(self.tmpdir, ncname)
+      self.parser.parse_text(cdltext, ncfile=ncfile)
+      return cdlparser.nc4.Dataset(ncfile)
+
+   def test_template_reuse(self) :
+      data1 = "data:\n time = 0 ;\n tas = 1.0f, 2.0f ;\n}"
+      data2 = "data:\n time = 5, 6 ;\n tas = 3.0f, 4.0f, 5.0f, 6.0f ;\n}"
+      ds1 = self.convert(CDL_HEADER + data1, "first.nc")
+      ds2 = self.convert(CDL_HEADER + data2, "second.nc")
+      try :
+         self.assertTrue(len(self.parser.header_cache) == 1)
+         self.assertTrue(self.parser.header_entry is not None)
+         self.assertTrue(ds2.comment == "shared header")
+         self.assertTrue(ds2.variables['tas'].units == "K")
+         self.assertTrue(len(ds2.dimensions['time']) == 2)
+         self.assertTrue(ds2.dimensions['time'].isunlimited())
+         self.assertTrue(np.array_equal(ds1.variables['tas'][:].flatten(), [1.0, 2.0]))
+         self.assertTrue(np.array_equal(ds2.variables['tas'][:].flatten(), [3.0, 4.0, 5.0, 6.0]))
+      finally :
+         ds1.close()
+         ds2.close()
+
+   def test_different_header(self) :
+      data = "data:\n time = 0 ;\n tas = 1.0f, 2.0f ;\n}"
+      self.convert(CDL_HEADER + data, "first.nc").close()
+      ds = self.convert(CDL_HEADER.replace("shared header", "other header") + data, "other.nc")
+      try :
+         self.assertTrue(self.parser.header_entry is None)
+         self.assertTrue(ds.comment == "other header")
+      finally :
+         ds.close()
+
+   def test_syntax_error_line_number(self) :
+      data = "data:\n time = 0 ;\n tas = 1.0f, 2.0f ;\n}"
+      self.convert(CDL_HEADER + data, "first.nc").close()
+      try :
+         self.parser.parse_text(CDL_HEADER + "data:\n time = 0 ;\n tas = 1.0f 2.0f ;\n}",
+            ncfile=os.path.join(self.tmpdir, "bad.nc"))
+         self.fail("CDLSyntaxError not raised")
+      except cdlparser.CDLSyntaxError, exc :
+         self.assertTrue("line number 14" in str(exc))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,83 @@
+"""
+Unit tests for the resource limits that can be set on the parser.
+"""
+import os
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+class TestLimits(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpfile = tempfile.mkstemp(suffix='.nc')[1]
+
+   def tearDown(self) :
+      if os.path.exists(self.tmpfile) : os.remove(self.tmpfile)
+
+   def parse(self, cdltext, **kwargs) :
+      parser = cdlparser.CDL3Parser(close_on_completion=True, log_level=100, **kwargs)
+      return parser.parse_text(cdltext, ncfile=self.tmpfile)
+
+   def test_var_size(self) :
+      cdltext = r"""netcdf limits {
+         dimensions: d = 2000000000 ;
+         variables: int var(d) ;
+         data: var = 1, 2 ;
+      }"""
+      self.assertRaises(cdlparser.CDLVariableSizeError, self.parse, cdltext, max_var_size=1000)
+
+   def test_record_var_size(self) :
+      cdltext = r"""netcdf limits {
+         dimensions: t = unlimited ;
+         variables: int var(t) ;
+         data: var = 1, 2, 3, 4, 5 ;
+      }"""
+      self.assertRaises(cdlparser.CDLVariableSizeError, self.parse, cdltext, max_var_size=4)
+      self.parse(cdltext, max_var_size=5)
+
+   def test_record_var_size_checked_early(self) :
+      # the limit must fire while the values are being read, not once they have all accumulated
+      cdltext = r"""netcdf limits {
+         dimensions: t = unlimited ;
+         variables: int var(t) ;
+         data: var = %s ;
+      }""" % ", ".join(["1"] * 10000)
+      parser = cdlparser.CDL3Parser(close_on_completion=True, log_level=100, max_var_size=100)
+      self.assertRaises(cdlparser.CDLVariableSizeError, parser.parse_text, cdltext,
+         ncfile=self.tmpfile)
+      self.assertTrue(parser.ntokens < 1000)
+
+   def test_token_count(self) :
+      cdltext = r"""netcdf limits {
+         dimensions: d = 5 ;
+         variables: int var(d) ;
+         data: var = 1, 2, 3, 4, 5 ;
+      }"""
+      self.assertRaises(cdlparser.CDLTokenLimitError, self.parse, cdltext, max_tokens=20)
+      self.parse(cdltext, max_tokens=30)
+
+   def test_string_length(self) :
+      cdltext = r"""netcdf limits {
+         variables: int var ;
+            var:comment = "a rather long comment" ;
+      }"""
+      self.assertRaises(cdlparser.CDLStringLengthError, self.parse, cdltext, max_string_length=10)
+      self.parse(cdltext, max_string_length=21)
+
+   def test_illegal_chars(self) :
+      garbage = "\x01\x02\x80\x90\xff" * 20
+      cdltext = r"""netcdf limits {
+         variables: int var ; %s
+         data: var = 42 ;
+      }""" % garbage
+      self.assertRaises(cdlparser.CDLIllegalCharError, self.parse, cdltext, max_illegal_chars=50)
+      parser = cdlparser.CDL3Parser(close_on_completion=True, log_level=100)
+      parser.parse_text(cdltext, ncfile=self.tmpfile)
+      self.assertTrue(parser.nillegal == 100)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
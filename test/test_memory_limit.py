@@ -0,0 +1,84 @@
+"""
+Unit tests for spilling of large data arrays to scratch files via the memory_limit option.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+class TestMemoryLimit(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      tas = ", ".join(["%d.0f" % i for i in range(1000)])
+      pr = ", ".join(["%d" % i for i in range(150)])
+      cdltext = r"""netcdf memlimit {
+         dimensions:
+            lat = 10 ;
+            lon = 20 ;
+            time = unlimited ;
+         variables:
+            float tas(time, lat, lon) ;
+            int pr(lat, lon) ;
+            short pad(lat, lon) ;
+         data:
+            tas = %s ;
+            pr = %s ;
+            pad = 1s, 2s ;
+      }""" % (tas, pr)
+      self.scratch_dir = tempfile.mkdtemp()
+      parser = cdlparser.CDL3Parser(memory_limit=1000, scratch_dir=self.scratch_dir)
+      self.tmpfile = tempfile.mkstemp(suffix='.nc')[1]
+      self.dataset = parser.parse_text(cdltext, ncfile=self.tmpfile)
+
+   def tearDown(self) :
+      self.dataset.close()
+      if os.path.exists(self.tmpfile) : os.remove(self.tmpfile)
+      shutil.rmtree(self.scratch_dir)
+
+   def test_spilled_data(self) :
+      self.assertTrue(len(self.dataset.dimensions['time']) == 5)
+      data = self.dataset.variables['tas'][:]
+      self.assertTrue(data.shape == (5,10,20))
+      expected = np.arange(1000, dtype=np.float32)
+      expected.shape = (5,10,20)
+      self.assertTrue(np.array_equal(data, expected))
+
+   def test_padded_spilled_data(self) :
+      data = self.dataset.variables['pr'][:].flatten()
+      self.assertTrue(np.array_equal(data[:150], np.arange(150, dtype=np.int32)))
+      self.assertTrue(np.all(data.mask[150:]))
+
+   def test_scratch_files_removed(self) :
+      self.assertTrue(os.listdir(self.scratch_dir) == [])
+
+   def test_spilled_records_after_record_count_set(self) :
+      # the slab of records written from a scratch file must stop at the last record
+      tas = ", ".join(["%d.0f" % i for i in range(24)])
+      cdltext = r"""netcdf records {
+         dimensions:
+            lat = 4 ;
+            time = unlimited ;
+         variables:
+            int time(time) ;
+            float tas(time, lat) ;
+         data:
+            time = 0, 1, 2, 3, 4, 5 ;
+            tas = %s ;
+      }""" % tas
+      parser = cdlparser.CDL3Parser(memory_limit=1000, scratch_dir=self.scratch_dir)
+      tmpfile = tempfile.mkstemp(suffix='.nc')[1]
+      try :
+         dataset = parser.parse_text(cdltext, ncfile=tmpfile)
+         data = dataset.variables['tas'][:]
+         dataset.close()
+         self.assertTrue(np.array_equal(data.flatten(), np.arange(24, dtype=np.float32)))
+      finally :
+         os.remove(tmpfile)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,116 @@
+"""
+Unit tests for the NumPy .npy output backend.
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+TESTFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testfiles')
+
+#---------------------------------------------------------------------------------------------------
+class TestNpyBackend(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      cdltext = r"""netcdf npyout {
+         dimensions:
+            lat = 2 ;
+            lon = 3 ;
+            namelen = 4 ;
+            time = unlimited ;
+         variables:
+            int time(time) ;
+               time:units = "days since 1970-01-01" ;
+            float tas(time, lat, lon) ;
+               tas:missing_value = -1.0f ;
+               tas:valid_range = 0.0f, 400.0f ;
+            double height ;
+            short mask(lat, lon) ;
+            char name(lat, namelen) ;
+            float unused(lon) ;
+         // global attributes
+            :comment = "npy backend" ;
+            :levels = 1, 2, 3 ;
+         data:
+            time = 0, 1, 2 ;
+            tas = 1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f ;
+            height = 1.5 ;
+            mask = 1s, 2s ;
+            name = "abcd", "ef" ;
+      }"""
+      self.tmpdir = tempfile.mkdtemp()
+      self.outdir = os.path.join(self.tmpdir, 'npyout')
+      parser = cdlparser.CDL3Parser(backend='npy')
+      self.result = parser.parse_text(cdltext, ncfile=self.outdir)
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def load(self, varname) :
+      return np.load(os.path.join(self.outdir, varname+'.npy'), mmap_mode='r')
+
+   def test_arrays(self) :
+      self.assertTrue(self.result is None)
+      self.assertTrue(np.array_equal(self.load('time'), [0, 1, 2]))
+      self.assertTrue(self.load('time').dtype == np.int32)
+      self.assertTrue(float(self.load('height')) == 1.5)
+      self.assertTrue(self.load('height').shape == ())
+      name = self.load('name')
+      self.assertTrue(name.shape == (2,4))
+      self.assertTrue(name.tostring() == "abcdef\0\0")
+
+   def test_fill_values(self) :
+      tas = self.load('tas')
+      self.assertTrue(isinstance(tas, np.memmap))
+      self.assertTrue(tas.shape == (3,2,3))
+      self.assertTrue(np.array_equal(tas.flatten()[:7], np.arange(1,8)))
+      self.assertTrue(np.all(tas.flatten()[7:] == -1.0))
+      mask = self.load('mask').flatten()
+      self.assertTrue(np.array_equal(mask[:2], [1, 2]))
+      self.assertTrue(np.all(mask[2:] == cdlparser.NC_FILL_SHORT))
+      unused = self.load('unused')
+      self.assertTrue(unused.shape == (3,))
+      self.assertTrue(np.all(unused == cdlparser.NC_FILL_FLOAT))
+
+   def test_metadata(self) :
+      meta = json.load(open(os.path.join(self.outdir, 'npyout.json')))
+      self.assertTrue(meta['dimensions']['time'] == {'size': 3, 'unlimited': True})
+      self.assertTrue(meta['dimensions']['lat'] == {'size': 2, 'unlimited': False})
+      tas = meta['variables']['tas']
+      self.assertTrue(tas['dimensions'] == ['time', 'lat', 'lon'])
+      self.assertTrue(tas['shape'] == [3, 2, 3])
+      self.assertTrue(tas['dtype'] == '<f4')
+      self.assertTrue(tas['attributes']['missing_value'] == -1.0)
+      self.assertTrue(meta['attributes']['comment'] == "npy backend")
+      # multi-valued attributes are saved as lists
+      self.assertTrue(tas['attributes']['valid_range'] == [0.0, 400.0])
+      self.assertTrue(meta['attributes']['levels'] == [1, 2, 3])
+
+   def test_testfiles(self) :
+      for filename in ('basics.cdl', 'constants.cdl') :
+         outdir = os.path.join(self.tmpdir, filename[:-4])
+         cdlparser.CDL3Parser(backend='npy').parse_file(os.path.join(TESTFILES_DIR, filename),
+            ncfile=outdir)
+         self.assertTrue(os.path.exists(os.path.join(outdir, filename[:-4]+'.json')))
+
+   def test_metadata_error(self) :
+      # the output directory is removed if the metadata cannot be written
+      outdir = os.path.join(self.tmpdir, 'failed')
+      json_value = cdlparser.json_value
+      def bad_value(value) :
+         raise TypeError("not JSON serializable")
+      cdlparser.json_value = bad_value
+      try :
+         self.assertRaises(TypeError, cdlparser.CDL3Parser(backend='npy').parse_file,
+            os.path.join(TESTFILES_DIR, 'basics.cdl'), ncfile=outdir)
+      finally :
+         cdlparser.json_value = json_value
+      self.assertFalse(os.path.exists(outdir))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
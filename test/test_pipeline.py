@@ -0,0 +1,104 @@
+"""
+Unit tests for pipelined parsing with a background netCDF writer thread.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+class TestPipeline(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      tas = ", ".join(["%d.0f" % i for i in range(600)])
+      self.cdltext = r"""netcdf pipeline {
+         dimensions:
+            lat = 10 ;
+            lon = 20 ;
+            namelen = 4 ;
+            time = unlimited ;
+         variables:
+            int time(time) ;
+               time:units = "days since 1970-01-01" ;
+            float tas(time, lat, lon) ;
+               tas:units = "K" ;
+            double height ;
+            char name(lat, namelen) ;
+            short pad(lat, lon) ;
+         // global attributes
+            :comment = "pipelined writes" ;
+         data:
+            time = 0, 1, 2 ;
+            tas = %s ;
+            height = 1.5 ;
+            name = "abcd", "ef" ;
+            pad = 1s, 2s ;
+      }""" % tas
+      self.tmpdir = tempfile.mkdtemp()
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def check_dataset(self, ncdataset) :
+      self.assertTrue(ncdataset.comment == "pipelined writes")
+      self.assertTrue(len(ncdataset.dimensions['time']) == 3)
+      self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [0, 1, 2]))
+      tas = ncdataset.variables['tas'][:]
+      self.assertTrue(tas.shape == (3,10,20))
+      self.assertTrue(np.array_equal(tas.flatten(), np.arange(600, dtype=np.float32)))
+      self.assertTrue(ncdataset.variables['tas'].units == "K")
+      self.assertTrue(ncdataset.variables['height'].getValue() == 1.5)
+      self.assertTrue(ncdataset.variables['name'][0].tostring() == "abcd")
+      pad = ncdataset.variables['pad'][:].flatten()
+      self.assertTrue(np.array_equal(pad[:2], [1, 2]) and np.all(pad.mask[2:]))
+
+   def test_pipelined_parse(self) :
+      parser = cdlparser.CDL3Parser(pipeline=True)
+      ncdataset = parser.parse_text(self.cdltext, ncfile=os.path.join(self.tmpdir, 'p.nc'))
+      try :
+         self.assertTrue(parser.writer is None)
+         self.check_dataset(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_pipelined_spilled_data(self) :
+      parser = cdlparser.CDL3Parser(pipeline=True, memory_limit=1000, scratch_dir=self.tmpdir)
+      ncdataset = parser.parse_text(self.cdltext, ncfile=os.path.join(self.tmpdir, 'p.nc'))
+      try :
+         self.check_dataset(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_pipelined_feed(self) :
+      parser = cdlparser.CDL3Parser(pipeline=True)
+      for i in range(0, len(self.cdltext), 100) :
+         parser.feed(self.cdltext[i:i+100], ncfile=os.path.join(self.tmpdir, 'p.nc'))
+      ncdataset = parser.close()
+      try :
+         self.check_dataset(ncdataset)
+      finally :
+         ncdataset.close()
+
+   def test_writer_error(self) :
+      ncfile = os.path.join(self.tmpdir, 'readonly.nc')
+      cdlparser.nc4.Dataset(ncfile, 'w').close()
+      ncdataset = cdlparser.nc4.Dataset(ncfile, 'r')
+      try :
+         writer = cdlparser.WriterDataset(ncdataset, lineno=lambda : 42)
+         writer.createDimension('lat', 2)
+         writer.createVariable('lat', 'f', ('lat',))
+         try :
+            writer.close()
+            self.fail("CDLWriteError not raised")
+         except cdlparser.CDLWriteError, exc :
+            self.assertTrue("dimension lat" in str(exc))
+            self.assertTrue("line number 42" in str(exc))
+      finally :
+         ncdataset.close()
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,96 @@
+"""
+Unit tests for preview conversions limited to the first N records or data values of each variable.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf preview {
+   dimensions:
+      lat = 3 ;
+      name_len = 6 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+      float lat(lat) ;
+      float tas(time, lat) ;
+      char name(time, name_len) ;
+   data:
+      time = %s ;
+      lat = -45.0f, 0.0f, 45.0f ;
+      tas = %s ;
+      // a comment containing a ';' character
+      name = %s ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestPreview(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'preview.nc')
+      nrecs = 100
+      time = ", ".join([str(i) for i in range(nrecs)])
+      tas = ", ".join(["%d.0f" % i for i in range(nrecs*3)])
+      names = ", ".join(['"n;%d"' % i for i in range(nrecs)])
+      self.cdltext = CDL_TEXT % (time, tas, names)
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def convert(self, **kwargs) :
+      self.parser = cdlparser.CDL3Parser(close_on_completion=True, **kwargs)
+      self.parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      return cdlparser.nc4.Dataset(self.ncfile)
+
+   def test_max_records(self) :
+      ds = self.convert(max_records=2)
+      try :
+         self.assertTrue(len(ds.dimensions['time']) == 2)
+         self.assertTrue(np.array_equal(ds.variables['time'][:], [0, 1]))
+         self.assertTrue(np.array_equal(ds.variables['tas'][:].flatten(), range(6)))
+         self.assertTrue(np.array_equal(ds.variables['lat'][:], [-45.0, 0.0, 45.0]))
+         self.assertTrue(ds.variables['name'][1].tostring().rstrip('\0') == "n;1")
+         self.assertTrue(self.parser.ntokens < 100)
+      finally :
+         ds.close()
+
+   def test_max_values(self) :
+      ds = self.convert(max_values=4)
+      try :
+         self.assertTrue(len(ds.dimensions['time']) == 4)
+         self.assertTrue(np.array_equal(ds.variables['tas'][0:1].flatten(), [0.0, 1.0, 2.0]))
+         lat = ds.variables['lat'][:]
+         self.assertTrue(np.array_equal(lat, [-45.0, 0.0, 45.0]))
+      finally :
+         ds.close()
+
+   def test_fixed_size_fill(self) :
+      ds = self.convert(max_values=2)
+      try :
+         lat = ds.variables['lat'][:]
+         self.assertTrue(np.array_equal(lat[:2], [-45.0, 0.0]))
+         self.assertTrue(lat.mask[2])
+         # record variables keep at least one whole record, and are padded to the record count
+         self.assertTrue(len(ds.dimensions['time']) == 2)
+         tas = ds.variables['tas'][:]
+         self.assertTrue(np.array_equal(tas[0], [0.0, 1.0, 2.0]))
+         self.assertTrue(np.all(tas.mask[1]))
+      finally :
+         ds.close()
+
+   def test_line_numbers(self) :
+      self.cdltext = self.cdltext.replace("name = ", "name =\n").replace("}", "x ;\n}")
+      try :
+         self.convert(max_records=1)
+         self.fail("CDLSyntaxError not raised")
+      except cdlparser.CDLSyntaxError, exc :
+         self.assertTrue("line number 18" in str(exc))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
@@ -0,0 +1,104 @@
+"""
+Unit tests for progress reporting, deadlines and cancellation of parsing operations.
+"""
+import os
+import time
+import threading
+import shutil
+import tempfile
+import unittest
+import cdlparser
+
+#---------------------------------------------------------------------------------------------------
+class TestProgress(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'progress.nc')
+      data = ", ".join(["%d" % i for i in range(2000)])
+      self.cdltext = r"""netcdf progress {
+         dimensions:
+            lat = 2000 ;
+         variables:
+            int a(lat) ;
+            int b(lat) ;
+            int c(lat) ;
+         data:
+            a = %s ;
+            b = %s ;
+            c = %s ;
+      }""" % (data, data, data)
+      self.reports = []
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def test_progress_reports(self) :
+      parser = cdlparser.CDL3Parser(progress=self.reports.append, progress_interval=0,
+         close_on_completion=True)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      self.assertTrue(len(self.reports) > 3)
+      bytes_read = [r['bytes_read'] for r in self.reports]
+      self.assertTrue(bytes_read == sorted(bytes_read))
+      final = self.reports[-1]
+      self.assertTrue(final['bytes_read'] == final['total_bytes'] == len(self.cdltext))
+      self.assertTrue(final['values_written'] == 6000)
+      self.assertTrue(set(r['variable'] for r in self.reports[:-1]) == set(['a', 'b', 'c']))
+
+   def test_cancel(self) :
+      # cancel the parse from within the progress callback, once variable 'b' is reached
+      def progress(report) :
+         if report['variable'] == 'b' : parser.cancel()
+      parser = cdlparser.CDL3Parser(progress=progress, progress_interval=0)
+      self.assertRaises(cdlparser.CDLCancelledError, parser.parse_text, self.cdltext,
+         ncfile=self.ncfile)
+      self.assertTrue(not os.path.exists(self.ncfile))
+      self.assertTrue(not parser.ncdataset.isopen())
+
+   def test_parse_after_cancel(self) :
+      # the parser's own cancel token is cleared at the start of the next parse
+      parser = cdlparser.CDL3Parser(close_on_completion=True)
+      parser.cancel()
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      self.assertTrue(os.path.exists(self.ncfile))
+
+   def test_client_cancel_token(self) :
+      # a cancel token passed in by the client is left for the client to clear
+      token = threading.Event()
+      parser = cdlparser.CDL3Parser(cancel_token=token)
+      parser.cancel()
+      self.assertRaises(cdlparser.CDLCancelledError, parser.parse_text, self.cdltext,
+         ncfile=self.ncfile)
+      self.assertTrue(token.is_set())
+      token.clear()
+      parser.parse_text(self.cdltext, ncfile=self.ncfile).close()
+
+   def test_values_written_while_parsing(self) :
+      # values spilled to a scratch file are reported before the variable's data is complete
+      parser = cdlparser.CDL3Parser(progress=self.reports.append, progress_interval=0,
+         memory_limit=1000, close_on_completion=True)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      counts = [r['values_written'] for r in self.reports if r['variable'] == 'a']
+      self.assertTrue(0 < max(counts) < 2000)
+      counts = [r['values_written'] for r in self.reports]
+      self.assertTrue(counts == sorted(counts))
+      self.assertTrue(counts[-1] == 6000)
+
+   def test_deadline(self) :
+      parser = cdlparser.CDL3Parser(deadline=time.time()-1, pipeline=True)
+      self.assertRaises(cdlparser.CDLDeadlineError, parser.parse_text, self.cdltext,
+         ncfile=self.ncfile)
+      self.assertTrue(os.listdir(self.tmpdir) == [])
+
+   def test_existing_file_kept(self) :
+      parser = cdlparser.CDL3Parser(close_on_completion=True)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      parser = cdlparser.CDL3Parser(update=True, deadline=time.time()-1)
+      self.assertRaises(cdlparser.CDLDeadlineError, parser.parse_text, self.cdltext,
+         ncfile=self.ncfile)
+      self.assertTrue(os.path.exists(self.ncfile))
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
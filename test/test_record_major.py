@@ -0,0 +1,86 @@
+"""
+Unit tests for buffered writing of variable data in record-major order.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf recmajor {
+   dimensions:
+      lat = 3 ;
+      name_len = 4 ;
+      time = unlimited ;
+   variables:
+      float lat(lat) ;
+      int time(time) ;
+      float tas(time, lat) ;
+      short pr(time, lat) ;
+      char name(time, name_len) ;
+      double scale ;
+      float unset(lat) ;
+      float unset_rec(time) ;
+   data:
+      tas = 1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f, 8.0f, 9.0f, 10.0f, 11.0f, 12.0f ;
+      time = 0, 1, 2 ;
+      pr = 1s, 2s, 3s ;
+      name = "ab", "cdef" ;
+      lat = 10.0f, 20.0f, 30.0f ;
+      scale = 0.5 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestRecordMajor(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.block_size = cdlparser.RECORD_BLOCK_SIZE
+
+   def tearDown(self) :
+      cdlparser.RECORD_BLOCK_SIZE = self.block_size
+      shutil.rmtree(self.tmpdir)
+
+   def convert(self, ncname, **kwargs) :
+      parser = cdlparser.CDL3Parser(**kwargs)
+      ncfile = os.path.join(self.tmpdir, ncname)
+      parser.parse_text(CDL_TEXT, ncfile=ncfile).close()
+      return cdlparser.nc4.Dataset(ncfile)
+
+   def check_same_data(self, **kwargs) :
+      expected = self.convert('expected.nc')
+      actual = self.convert('actual.nc', record_major=True, **kwargs)
+      try :
+         self.assertTrue(len(actual.dimensions['time']) == 4)
+         for name, var in expected.variables.items() :
+            exp_data = var[:]
+            act_data = actual.variables[name][:]
+            self.assertTrue(np.array_equal(np.ma.getmaskarray(exp_data),
+               np.ma.getmaskarray(act_data)), name)
+            self.assertTrue(np.array_equal(np.ma.filled(exp_data), np.ma.filled(act_data)), name)
+         self.assertTrue(np.all(actual.variables['unset'][:].mask))
+         self.assertTrue(np.all(actual.variables['pr'][1:].mask))
+      finally :
+         expected.close()
+         actual.close()
+
+   def test_same_data(self) :
+      self.check_same_data()
+
+   def test_small_blocks(self) :
+      cdlparser.RECORD_BLOCK_SIZE = 10
+      self.check_same_data()
+
+   def test_pipeline(self) :
+      self.check_same_data(pipeline=True)
+
+   def test_stats(self) :
+      parser = cdlparser.CDL3Parser(record_major=True, compute_stats=True, close_on_completion=True)
+      parser.parse_text(CDL_TEXT, ncfile=os.path.join(self.tmpdir, 'stats.nc'))
+      self.assertTrue(parser.stats['tas'].asdict()['max'] == 12.0)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
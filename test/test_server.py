@@ -0,0 +1,98 @@
+"""
+Unit tests for the CDL conversion server and client.
+"""
+import os
+import sys
+import time
+import signal
+import shutil
+import subprocess
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf served {
+   dimensions:
+      lat = 2 ;
+   variables:
+      float tas(lat) ;
+         tas:units = "K" ;
+   data:
+      tas = 280.0f, 290.0f ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestServer(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      # the server runs in a separate process, as it would in practice, since its worker processes
+      # must not inherit any netCDF datasets left open by other tests
+      self.tmpdir = tempfile.mkdtemp()
+      address = os.path.join(self.tmpdir, 'cdlparser.sock')
+      self.server = subprocess.Popen([sys.executable, cdlparser.__file__.replace('.pyc', '.py'),
+         'serve', 'address=%r' % address, 'workers=1'])
+      for i in range(100) :
+         if os.path.exists(address) : break
+         time.sleep(0.1)
+      self.client = cdlparser.CDLClient(address, timeout=30)
+
+   def tearDown(self) :
+      self.client.close()
+      self.server.send_signal(signal.SIGINT)
+      self.server.wait()
+      shutil.rmtree(self.tmpdir)
+
+   def test_convert_to_file(self) :
+      cdlfile = os.path.join(self.tmpdir, 'served.cdl')
+      f = open(cdlfile, 'w')
+      f.write(CDL_TEXT)
+      f.close()
+      ncfile = self.client.convert_file(cdlfile)
+      self.assertTrue(ncfile == os.path.join(self.tmpdir, 'served.nc'))
+      ncdataset = cdlparser.nc4.Dataset(ncfile)
+      try :
+         self.assertTrue(np.array_equal(ncdataset.variables['tas'][:], [280.0, 290.0]))
+      finally :
+         ncdataset.close()
+
+   def test_convert_to_bytes(self) :
+      data = self.client.convert_text(CDL_TEXT, return_bytes=True)
+      self.assertTrue(data.startswith('CDF\x01'))
+      self.assertTrue(os.listdir(self.tmpdir) == ['cdlparser.sock'])
+
+   def test_error(self) :
+      self.assertRaises(cdlparser.CDLSyntaxError, self.client.convert_text,
+         CDL_TEXT.replace("280.0f,", "280.0f"), return_bytes=True)
+      self.assertTrue(self.client.get_metrics()['errors'] == 1)
+
+   def test_backpressure(self) :
+      # occupy every request slot, as if the server were busy with other requests
+      server = cdlparser.CDLServer(max_pending=2)
+      for i in range(2) : server.pending.acquire()
+      response = server.handle_request(dict(cdltext=CDL_TEXT))
+      self.assertTrue(response['status'] == 'busy')
+      self.assertTrue(server.get_metrics()['rejected'] == 1)
+
+   def test_interrupt_while_dispatching(self) :
+      # an interrupt caught by the socket server while it is dispatching a request must not be lost
+      server = cdlparser.CDLServer()
+      try :
+         raise KeyboardInterrupt()
+      except KeyboardInterrupt :
+         self.assertRaises(KeyboardInterrupt, server.handle_error, None, 'client')
+      try :
+         raise IOError("connection reset")
+      except IOError :
+         server.handle_error(None, 'client')
+
+   def test_metrics(self) :
+      for i in range(3) : self.client.convert_text(CDL_TEXT, return_bytes=True)
+      metrics = self.client.get_metrics()
+      self.assertTrue(metrics['requests'] == 3)
+      self.assertTrue(0 < metrics['mean_latency'] <= metrics['max_latency'])
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
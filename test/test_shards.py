@@ -0,0 +1,96 @@
+"""
+Unit tests for splitting the output of the parser into several netCDF files, or shards.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf sharded {
+   dimensions:
+      lat = 2 ;
+      time = unlimited ;
+   variables:
+      float lat(lat) ;
+         lat:units = "degrees_north" ;
+      int time(time) ;
+      float tas(time, lat) ;
+      float pr(time, lat) ;
+      short orog(lat) ;
+   // global attributes
+      :comment = "sharding test" ;
+   data:
+      lat = -45.0f, 45.0f ;
+      time = 0, 1, 2, 3, 4 ;
+      tas = 0.0f, 1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f, 8.0f, 9.0f ;
+      pr = 10.0f, 11.0f, 12.0f, 13.0f, 14.0f, 15.0f, 16.0f, 17.0f, 18.0f, 19.0f ;
+      orog = 100s, 200s ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestShards(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'sharded.nc')
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def read_shard(self, index) :
+      ncdataset = cdlparser.nc4.Dataset(os.path.join(self.tmpdir, 'sharded_%03d.nc' % index))
+      try :
+         self.assertTrue(ncdataset.comment == "sharding test")
+         self.assertTrue(np.array_equal(ncdataset.variables['lat'][:], [-45.0, 45.0]))
+         self.assertTrue(ncdataset.variables['lat'].units == "degrees_north")
+         return dict([(name, var[:]) for name, var in ncdataset.variables.items()])
+      finally :
+         ncdataset.close()
+
+   def test_shard_records(self) :
+      parser = cdlparser.CDL3Parser(shard_records=2, shard_workers=2)
+      parser.parse_text(CDL_TEXT, ncfile=self.ncfile)
+      self.assertTrue(len(parser.dataset.filenames) == 3)
+      self.assertTrue(sorted(os.listdir(self.tmpdir)) == \
+         ['sharded_000.nc', 'sharded_001.nc', 'sharded_002.nc'])
+      shards = [self.read_shard(i) for i in range(3)]
+      self.assertTrue(np.array_equal(shards[0]['orog'], [100, 200]))
+      self.assertTrue('orog' not in shards[1])
+      self.assertTrue(np.array_equal(shards[1]['time'], [2, 3]))
+      self.assertTrue(np.array_equal(shards[2]['time'], [4]))
+      tas = np.concatenate([shard['tas'] for shard in shards])
+      self.assertTrue(np.array_equal(tas.flatten(), np.arange(10)))
+      self.assertTrue(np.array_equal(shards[2]['pr'].flatten(), [18.0, 19.0]))
+
+   def test_shard_variables(self) :
+      parser = cdlparser.CDL3Parser(shard_variables=[['tas'], ['pr']], shard_workers=1)
+      parser.parse_text(CDL_TEXT, ncfile=self.ncfile)
+      shards = [self.read_shard(i) for i in range(3)]
+      self.assertTrue(sorted(shards[0].keys()) == ['lat', 'tas', 'time'])
+      self.assertTrue(sorted(shards[1].keys()) == ['lat', 'pr', 'time'])
+      self.assertTrue(sorted(shards[2].keys()) == ['lat', 'orog'])
+      self.assertTrue(np.array_equal(shards[1]['pr'].flatten(), np.arange(10, 20)))
+      self.assertTrue(np.array_equal(shards[0]['time'], np.arange(5)))
+
+   def test_undefined_variable(self) :
+      parser = cdlparser.CDL3Parser(shard_variables=[['tas', 'uas']])
+      self.assertRaises(cdlparser.CDLContentError, parser.parse_text, CDL_TEXT, ncfile=self.ncfile)
+      self.assertTrue(not any(proc.is_alive() for proc, queue in parser.dataset.writers))
+
+   def test_conflicting_options(self) :
+      # options selecting another kind of output are rejected rather than silently ignored
+      for kwargs in (dict(handler=cdlparser.CDLEventHandler()), dict(backend='npy'),
+         dict(update=True), dict(delta=True)) :
+         self.assertRaises(ValueError, cdlparser.CDL3Parser, shard_records=2, **kwargs)
+         self.assertRaises(ValueError, cdlparser.CDL3Parser, shard_variables=[['tas']], **kwargs)
+      self.assertRaises(ValueError, cdlparser.CDL3Parser, shard_variables=[['tas']],
+         shard_records=2)
+      parser = cdlparser.CDL3Parser(shard_records=2, shard_workers=0)
+      self.assertRaises(ValueError, parser.aggregate_files, ['first.cdl', 'second.cdl'])
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
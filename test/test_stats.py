@@ -0,0 +1,128 @@
+"""
+Unit tests for the summary statistics computed while variable data is written.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+#---------------------------------------------------------------------------------------------------
+class TestStats(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      tas = ", ".join(["%d.0f" % i for i in range(1, 101)])
+      self.cdltext = r"""netcdf stats {
+         dimensions:
+            lat = 10 ;
+            lon = 12 ;
+            time = unlimited ;
+         variables:
+            int time(time) ;
+            float tas(lat, lon) ;
+               tas:_FillValue = -99.0f ;
+            double pr(time) ;
+               pr:missing_value = -1.0 ;
+            short flag(lon) ;
+            double height ;
+            char name(lon) ;
+         data:
+            time = 0, 1, 2, 3, 4 ;
+            tas = %s, -99.0f ;
+            pr = 2.5, -1.0, 0.5, 1.0 ;
+            flag = 3s, -2s, _ ;
+            height = 7.0 ;
+            name = "abc" ;
+      }""" % tas
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'stats.nc')
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def check_stats(self, stats) :
+      self.assertTrue(sorted(stats) == ['flag', 'height', 'pr', 'tas', 'time'])
+      tas = stats['tas'].asdict()
+      self.assertTrue(tas['count'] == 120)
+      self.assertTrue(tas['fill_count'] == 20)   # 1 explicit fill value + 19 padding values
+      self.assertTrue(tas['nan_count'] == 0)
+      self.assertTrue(tas['min'] == 1.0 and tas['max'] == 100.0 and tas['mean'] == 50.5)
+      pr = stats['pr']
+      self.assertTrue(pr.count == 5 and pr.fill_count == 2 and pr.nan_count == 0)
+      self.assertTrue(pr.min == 0.5 and pr.max == 2.5 and abs(pr.mean - 4.0/3) < 1e-12)
+      flag = stats['flag']
+      self.assertTrue(flag.fill_count == 10 and flag.min == -2 and flag.max == 3)
+      self.assertTrue(stats['height'].mean == 7.0)
+
+   def test_stats(self) :
+      parser = cdlparser.CDL3Parser(compute_stats=True, close_on_completion=True)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      self.check_stats(parser.stats)
+      ncdataset = cdlparser.nc4.Dataset(self.ncfile)
+      try :
+         self.assertFalse('actual_range' in ncdataset.variables['tas'].ncattrs())
+      finally :
+         ncdataset.close()
+
+   def test_stats_spilled_data(self) :
+      parser = cdlparser.CDL3Parser(compute_stats=True, close_on_completion=True,
+         memory_limit=500, scratch_dir=self.tmpdir)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      self.check_stats(parser.stats)
+
+   def test_stats_attributes(self) :
+      parser = cdlparser.CDL3Parser(stats_attributes=True)
+      ncdataset = parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      try :
+         self.check_stats(parser.stats)
+         tas = ncdataset.variables['tas']
+         self.assertTrue(np.array_equal(tas.actual_range, [1.0, 100.0]))
+         self.assertTrue(tas.actual_range.dtype == np.float32)
+         self.assertTrue(tas.actual_mean == 50.5)
+         self.assertTrue(tas.fill_count == 20 and tas.nan_count == 0)
+         self.assertFalse('actual_range' in ncdataset.variables['name'].ncattrs())
+         data = tas[:].flatten()
+         self.assertTrue(np.array_equal(data[:100], np.arange(1, 101, dtype=np.float32)))
+      finally :
+         ncdataset.close()
+
+   def check_stats_attributes(self, ncfile) :
+      ncdataset = cdlparser.nc4.Dataset(ncfile)
+      try :
+         tas = ncdataset.variables['tas']
+         self.assertTrue(np.array_equal(tas.actual_range, [1.0, 100.0]))
+         self.assertTrue(tas.actual_mean == 50.5)
+         self.assertTrue(tas.fill_count == 20 and tas.nan_count == 0)
+      finally :
+         ncdataset.close()
+
+   def test_stats_attributes_sharded(self) :
+      # statistics attributes are forwarded to shards which were created when the header was parsed
+      parser = cdlparser.CDL3Parser(stats_attributes=True, shard_variables=[['tas']],
+         shard_workers=1)
+      parser.parse_text(self.cdltext, ncfile=self.ncfile)
+      self.check_stats_attributes(os.path.join(self.tmpdir, 'stats_000.nc'))
+
+   def test_stats_attributes_fanout(self) :
+      targets = [os.path.join(self.tmpdir, 'stats%d.nc' % i) for i in range(2)]
+      for workers in (0, 2) :
+         parser = cdlparser.CDL3Parser(stats_attributes=True, targets=targets,
+            target_workers=workers)
+         parser.parse_text(self.cdltext)
+         for ncfile in targets : self.check_stats_attributes(ncfile)
+
+   def test_nan_values(self) :
+      schema = cdlparser.SchemaDataset()
+      schema.createDimension('x', 6)
+      var = schema.createVariable('x', 'd', ('x',))
+      stats = cdlparser.VariableStats(var)
+      stats.update(np.array([1.0, np.nan, 3.0]))
+      stats.update(np.array([np.nan, cdlparser.NC_FILL_DOUBLE, 5.0]))
+      self.assertTrue(stats.count == 6 and stats.nan_count == 2 and stats.fill_count == 1)
+      self.assertTrue(stats.min == 1.0 and stats.max == 5.0 and stats.mean == 3.0)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
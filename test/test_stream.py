@@ -0,0 +1,80 @@
+"""
+Unit tests for parsing a stream of consecutive CDL documents in a single pass.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEMPLATE = r"""netcdf %s {
+   dimensions:
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "%s" ;
+   data:
+      time = %s ;
+}
+"""
+
+#---------------------------------------------------------------------------------------------------
+class TestStream(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.parser = cdlparser.CDL3Parser(close_on_completion=True)
+      self.cdltext = CDL_TEMPLATE % ("first", "days since 2013-01-01", "0, 1") + \
+         CDL_TEMPLATE % ("second", "hours since 2013-01-01", "2, 3, 4") + "// end of stream\n"
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def test_one_output_per_document(self) :
+      datasets = self.parser.parse_stream(self.cdltext, ncdir=self.tmpdir)
+      self.assertTrue(len(datasets) == 2)
+      self.assertTrue(sorted(os.listdir(self.tmpdir)) == ['first.nc', 'second.nc'])
+      ncdataset = cdlparser.nc4.Dataset(os.path.join(self.tmpdir, 'second.nc'))
+      try :
+         self.assertTrue(ncdataset.variables['time'].units == "hours since 2013-01-01")
+         self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [2, 3, 4]))
+      finally :
+         ncdataset.close()
+
+   def test_parser_reused(self) :
+      self.parser.parse_stream(self.cdltext, ncdir=self.tmpdir)
+      lexer, parser = self.parser.lexer, self.parser.parser
+      self.parser.parse_stream(self.cdltext, ncdir=self.tmpdir)
+      self.assertTrue(self.parser.lexer is lexer and self.parser.parser is parser)
+
+   def test_stream_line_numbers(self) :
+      cdltext = self.cdltext.replace("2, 3, 4", "2, 3 4")
+      try :
+         self.parser.parse_stream(cdltext, ncdir=self.tmpdir)
+         self.fail("CDLSyntaxError not raised")
+      except cdlparser.CDLSyntaxError, exc :
+         self.assertTrue("line number 17" in str(exc))
+      self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'first.nc')))
+
+   def test_earlier_datasets_closed(self) :
+      # the datasets produced before an invalid document are closed, since no handles are returned
+      if not os.path.exists('/proc/self/fd') :
+         self.skipTest("open files cannot be listed without the /proc filesystem")
+      parser = cdlparser.CDL3Parser()
+      cdltext = self.cdltext.replace("2, 3, 4", "2, 3 4")
+      self.assertRaises(cdlparser.CDLSyntaxError, parser.parse_stream, cdltext, ncdir=self.tmpdir)
+      ncfile = os.path.join(self.tmpdir, 'first.nc')
+      open_files = [os.path.realpath(os.path.join('/proc/self/fd', fd)) \
+         for fd in os.listdir('/proc/self/fd')]
+      self.assertFalse(os.path.realpath(ncfile) in open_files)
+      ncdataset = cdlparser.nc4.Dataset(ncfile)
+      try :
+         self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [0, 1]))
+      finally :
+         ncdataset.close()
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
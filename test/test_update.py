@@ -0,0 +1,137 @@
+"""
+Unit tests for applying CDL to an existing netCDF file in update mode.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_BASE = r"""netcdf base {
+   dimensions:
+      lat = 2 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float lat(lat) ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+   // global attributes
+      :comment = "original" ;
+   data:
+      time = 0, 1 ;
+      lat = 0.0f, 10.0f ;
+      tas = 1.0f, 2.0f, 3.0f, 4.0f ;
+}"""
+
+CDL_PATCH = r"""netcdf base {
+   dimensions:
+      lat = 2 ;
+      level = 3 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+      float lat(lat) ;
+         lat:units = "degrees_north" ;
+      float tas(time, lat) ;
+         tas:units = "degC" ;
+      double level(level) ;
+   // global attributes
+      :history = "patched" ;
+   data:
+      time = 2 ;
+      lat = -5.0f, 5.0f ;
+      tas = 5.0f, 6.0f ;
+      level = 100.0, 500.0, 1000.0 ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestUpdate(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.ncfile = os.path.join(self.tmpdir, 'base.nc')
+      cdlparser.CDL3Parser(close_on_completion=True).parse_text(CDL_BASE, ncfile=self.ncfile)
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def test_update(self) :
+      parser = cdlparser.CDL3Parser(update=True)
+      ncdataset = parser.parse_text(CDL_PATCH, ncfile=self.ncfile)
+      try :
+         self.assertTrue(ncdataset.comment == "original")
+         self.assertTrue(ncdataset.history == "patched")
+         self.assertTrue(ncdataset.variables['time'].units == "hours since 2013-01-01")
+         self.assertTrue(ncdataset.variables['tas'].units == "degC")
+         self.assertTrue(ncdataset.variables['lat'].units == "degrees_north")
+         self.assertTrue(np.array_equal(ncdataset.variables['lat'][:], [-5.0, 5.0]))
+         self.assertTrue(len(ncdataset.dimensions['time']) == 3)
+         self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [0, 1, 2]))
+         tas = ncdataset.variables['tas'][:]
+         self.assertTrue(np.array_equal(tas.flatten(), np.arange(1, 7, dtype=np.float32)))
+         self.assertTrue(np.array_equal(ncdataset.variables['level'][:], [100.0, 500.0, 1000.0]))
+      finally :
+         ncdataset.close()
+
+   def test_overwrite_records(self) :
+      # fix the data of one record variable without touching the others
+      parser = cdlparser.CDL3Parser(update=True, update_records='overwrite')
+      cdltext = CDL_BASE.replace("time = 0, 1 ;", "").replace("lat = 0.0f, 10.0f ;", "")
+      cdltext = cdltext.replace("1.0f, 2.0f, 3.0f, 4.0f", "9.0f, 9.0f, 8.0f, 8.0f")
+      ncdataset = parser.parse_text(cdltext, ncfile=self.ncfile)
+      try :
+         self.assertTrue(len(ncdataset.dimensions['time']) == 2)
+         self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [0, 1]))
+         self.assertTrue(np.array_equal(ncdataset.variables['tas'][:], [[9.0, 9.0], [8.0, 8.0]]))
+      finally :
+         ncdataset.close()
+
+   def test_overwrite_more_records(self) :
+      parser = cdlparser.CDL3Parser(update=True, update_records='overwrite')
+      cdltext = CDL_BASE.replace("time = 0, 1 ;", "time = 10, 11, 12 ;")
+      ncdataset = parser.parse_text(cdltext, ncfile=self.ncfile)
+      try :
+         self.assertTrue(len(ncdataset.dimensions['time']) == 3)
+         self.assertTrue(np.array_equal(ncdataset.variables['time'][:], [10, 11, 12]))
+         tas = ncdataset.variables['tas'][:]
+         self.assertTrue(np.array_equal(tas[:2].flatten(), [1.0, 2.0, 3.0, 4.0]))
+         self.assertTrue(np.all(tas.mask[2]))
+      finally :
+         ncdataset.close()
+
+   def test_invalid_update_records(self) :
+      self.assertRaises(ValueError, cdlparser.CDL3Parser, update=True, update_records='replace')
+
+   def test_new_file(self) :
+      ncfile = os.path.join(self.tmpdir, 'new.nc')
+      parser = cdlparser.CDL3Parser(update=True)
+      ncdataset = parser.parse_text(CDL_PATCH, ncfile=ncfile)
+      try :
+         self.assertTrue(len(ncdataset.dimensions['time']) == 1)
+         self.assertTrue(np.array_equal(ncdataset.variables['tas'][:].flatten(), [5.0, 6.0]))
+      finally :
+         ncdataset.close()
+
+   def test_incompatible_dimension(self) :
+      parser = cdlparser.CDL3Parser(update=True, close_on_completion=True)
+      cdltext = CDL_PATCH.replace("lat = 2 ;", "lat = 3 ;").replace("history", "other")
+      self.assertRaises(cdlparser.CDLContentError, parser.parse_text, cdltext, ncfile=self.ncfile)
+      ncdataset = cdlparser.nc4.Dataset(self.ncfile)
+      try :
+         self.assertFalse('level' in ncdataset.variables)
+         self.assertFalse('other' in ncdataset.ncattrs())
+      finally :
+         ncdataset.close()
+
+   def test_incompatible_variable(self) :
+      parser = cdlparser.CDL3Parser(update=True, close_on_completion=True)
+      cdltext = CDL_PATCH.replace("float lat(lat)", "double lat(lat)")
+      self.assertRaises(cdlparser.CDLContentError, parser.parse_text, cdltext, ncfile=self.ncfile)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
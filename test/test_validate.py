@@ -0,0 +1,79 @@
+"""
+Unit tests for validation of CDL text without producing any output.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cdlparser
+
+CDL_TEXT = r"""netcdf validate {
+   dimensions:
+      lat = 2 ;
+      name_len = 4 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+      char name(lat, name_len) ;
+   // global attributes
+      :comment = "validation test" ;
+   data:
+      time = 0, 1, 2 ;
+      tas = %s ;
+      name = "abc", "defg" ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestValidate(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.cwd = os.getcwd()
+      os.chdir(self.tmpdir)
+      self.parser = cdlparser.CDL3Parser()
+
+   def tearDown(self) :
+      os.chdir(self.cwd)
+      shutil.rmtree(self.tmpdir)
+
+   def test_valid_text(self) :
+      schema = self.parser.validate_text(CDL_TEXT % "1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f")
+      self.assertTrue(schema.variables.keys() == ['time', 'tas', 'name'])
+      self.assertTrue(schema.variables['tas'].units == "K")
+      self.assertTrue(schema.comment == "validation test")
+      self.assertTrue(len(schema.dimensions['time']) == 3)
+      self.assertTrue(os.listdir(self.tmpdir) == [])
+
+   def test_invalid_data(self) :
+      cdltext = CDL_TEXT % "1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f"
+      self.assertRaises(cdlparser.CDLContentError, self.parser.validate_text, cdltext)
+
+   def test_header_only(self) :
+      # the data section contains a syntax error, which is skipped by header-only validation
+      cdltext = CDL_TEXT % "1.0f 2.0f"
+      schema = self.parser.validate_text(cdltext, header_only=True)
+      self.assertTrue(schema.variables['time'].dimensions == ('time',))
+      self.assertRaises(cdlparser.CDLSyntaxError, self.parser.validate_text, cdltext)
+
+   def test_header_syntax_error(self) :
+      cdltext = CDL_TEXT.replace("float tas", "float tas tas")
+      self.assertRaises(cdlparser.CDLSyntaxError, self.parser.validate_text, cdltext,
+         header_only=True)
+
+   def test_parse_after_validate(self) :
+      cdltext = CDL_TEXT % "1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f"
+      self.parser.validate_text(cdltext, header_only=True)
+      ncdataset = self.parser.parse_text(cdltext, ncfile=os.path.join(self.tmpdir, "valid.nc"))
+      try :
+         self.assertTrue(len(ncdataset.dimensions['time']) == 3)
+         self.assertTrue(ncdataset.variables['name'][1].tostring() == "defg")
+      finally :
+         ncdataset.close()
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
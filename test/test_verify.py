@@ -0,0 +1,153 @@
+"""
+Unit tests for verification of a netCDF file against the CDL file from which it was generated.
+"""
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import unittest
+import cdlparser
+import numpy as np
+
+CDL_TEXT = r"""netcdf verify {
+   dimensions:
+      lat = 3 ;
+      name_len = 4 ;
+      time = unlimited ;
+   variables:
+      int time(time) ;
+         time:units = "hours since 2013-01-01" ;
+         time:step = 1 ;
+      float tas(time, lat) ;
+         tas:units = "K" ;
+         tas:valid_range = 0.0f, 400.0f ;
+      double pr(lat) ;
+         pr:missing_value = -1.0 ;
+      short unset(lat) ;
+      char name(time, name_len) ;
+   // global attributes
+      :comment = "verification test" ;
+   data:
+      time = 0, 1, 2 ;
+      tas = 1.0f, 2.0f, 3.0f, 4.0f, 5.0f, 6.0f, 7.0f, 8.0f, 9.0f ;
+      pr = 0.5, 1.5 ;
+      name = "abc", "defg" ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestVerify(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.cdlfile = os.path.join(self.tmpdir, 'verify.cdl')
+      self.ncfile = os.path.join(self.tmpdir, 'verify.nc')
+      f = open(self.cdlfile, 'w')
+      f.write(CDL_TEXT)
+      f.close()
+      parser = cdlparser.CDL3Parser(close_on_completion=True)
+      parser.parse_file(self.cdlfile, ncfile=self.ncfile)
+
+   def tearDown(self) :
+      shutil.rmtree(self.tmpdir)
+
+   def modify(self, func) :
+      ds = cdlparser.nc4.Dataset(self.ncfile, 'a')
+      try :
+         func(ds)
+      finally :
+         ds.close()
+
+   def test_identical(self) :
+      parser = cdlparser.CDL3Parser(chunk_size=2)
+      self.assertTrue(parser.verify(self.cdlfile, self.ncfile) == [])
+
+   def test_data_difference(self) :
+      def change(ds) :
+         ds.variables['tas'][1,2] = 0.0
+         ds.variables['tas'][2,0] = 0.0
+      self.modify(change)
+      differences = cdlparser.CDL3Parser(chunk_size=3).verify(self.cdlfile, self.ncfile)
+      self.assertTrue(len(differences) == 1)
+      self.assertTrue("tas differs at index (1, 2)" in differences[0])
+
+   def test_fill_difference(self) :
+      def change(ds) :
+         ds.variables['pr'][2] = 1.0
+         ds.variables['unset'][1] = 1
+      self.modify(change)
+      differences = cdlparser.CDL3Parser().verify(self.cdlfile, self.ncfile)
+      self.assertTrue(len(differences) == 2)
+      self.assertTrue("pr differs at index (2,)" in differences[0])
+      self.assertTrue("unset differs at index (1,)" in differences[1])
+
+   def test_attribute_difference(self) :
+      def change(ds) :
+         ds.variables['time'].step = np.float64(1.0)
+         ds.comment = "modified"
+         ds.history = "added"
+      self.modify(change)
+      differences = cdlparser.CDL3Parser().verify(self.cdlfile, self.ncfile)
+      self.assertTrue(len(differences) == 3)
+      self.assertTrue("time:step" in differences[0])
+      self.assertTrue(":comment" in differences[1])
+      self.assertTrue(":history" in differences[2])
+
+   def test_record_difference(self) :
+      self.modify(lambda ds : ds.variables['time'].__setitem__(3, 3))
+      differences = cdlparser.CDL3Parser().verify(self.cdlfile, self.ncfile)
+      self.assertTrue("Number of records differs: 3 (CDL) != 4 (netCDF)" in differences)
+
+   def test_large_variable(self) :
+      # the data for a variable much larger than chunk_size is compared a chunk at a time as it is
+      # parsed, rather than once all of its values have been read
+      cdltext = r"""netcdf large {
+         dimensions: n = 20000 ; time = unlimited ;
+         variables: int fixed(n) ; int rec(time) ;
+         data:
+            fixed = %s ;
+            rec = %s ;
+      }""" % (", ".join([str(i) for i in range(19990)]), ", ".join([str(i) for i in range(20000)]))
+      cdlfile = os.path.join(self.tmpdir, 'large.cdl')
+      ncfile = os.path.join(self.tmpdir, 'large.nc')
+      f = open(cdlfile, 'w')
+      f.write(cdltext)
+      f.close()
+      cdlparser.CDL3Parser(close_on_completion=True).parse_file(cdlfile, ncfile=ncfile)
+      ds = cdlparser.nc4.Dataset(ncfile, 'a')
+      ds.variables['rec'][15000] = -1
+      ds.close()
+      parser = cdlparser.CDL3Parser(chunk_size=100)
+      writes = []
+      write_data = cdlparser.VerifyDataset.write_data
+      def record_write(dataset, var, key, value) :
+         writes.append((var._name, value.size, parser.ntokens))
+         write_data(dataset, var, key, value)
+      cdlparser.VerifyDataset.write_data = record_write
+      try :
+         differences = parser.verify(cdlfile, ncfile)
+      finally :
+         cdlparser.VerifyDataset.write_data = write_data
+      self.assertTrue(differences == ["Data for variable rec differs at index (15000,): " \
+         "15000 (CDL) != -1 (netCDF)"])
+      for varname in ('fixed', 'rec') :
+         sizes = [size for name,size,ntokens in writes if name == varname]
+         self.assertTrue(sum(sizes) == 20000)
+         self.assertTrue(max(sizes) <= 100)
+      self.assertTrue(writes[0][2] < 1000)
+
+   def test_command_line(self) :
+      self.modify(lambda ds : ds.variables['name'].__setitem__(0, list("abd\0")))
+      env = dict(os.environ)
+      modpath = os.path.dirname(os.path.abspath(cdlparser.__file__))
+      env['PYTHONPATH'] = os.pathsep.join([modpath, env.get('PYTHONPATH', '')])
+      proc = subprocess.Popen([sys.executable, os.path.join(modpath, 'cdlparser.py'), 'verify',
+         self.cdlfile, self.ncfile], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+      output = proc.communicate()[0]
+      self.assertTrue(proc.returncode == 1)
+      self.assertTrue("name differs at index (0, 2)" in output)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()
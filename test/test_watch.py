@@ -0,0 +1,105 @@
+"""
+Unit tests for incremental conversion of a directory tree of CDL files by CDLWatcher.
+"""
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import unittest
+import cdlparser
+
+CDL_TEMPLATE = r"""netcdf %s {
+   dimensions:
+      lat = 2 ;
+   variables:
+      float tas(lat) ;
+   data:
+      tas = %s ;
+}"""
+
+#---------------------------------------------------------------------------------------------------
+class TestWatch(unittest.TestCase) :
+#---------------------------------------------------------------------------------------------------
+   def setUp(self) :
+      self.tmpdir = tempfile.mkdtemp()
+      self.srcdir = os.path.join(self.tmpdir, 'cdl')
+      self.outdir = os.path.join(self.tmpdir, 'nc')
+      os.makedirs(os.path.join(self.srcdir, 'sub'))
+      self.write_cdl('first.cdl', "1.0f, 2.0f")
+      self.write_cdl(os.path.join('sub', 'second.cdl'), "3.0f, 4.0f")
+      self.watcher = cdlparser.CDLWatcher(self.srcdir, self.outdir, workers=0, debounce=0)
+
+   def tearDown(self) :
+      self.watcher.close()
+      shutil.rmtree(self.tmpdir)
+
+   def write_cdl(self, relpath, values, mtime=None) :
+      path = os.path.join(self.srcdir, relpath)
+      f = open(path, 'w')
+      f.write(CDL_TEMPLATE % ("watched", values))
+      f.close()
+      # make modification times distinct, regardless of the resolution of the file system clock
+      mtime = mtime or time.time() - 10
+      os.utime(path, (mtime, mtime))
+
+   def read_tas(self, relpath) :
+      ncdataset = cdlparser.nc4.Dataset(os.path.join(self.outdir, relpath))
+      try :
+         return ncdataset.variables['tas'][:].tolist()
+      finally :
+         ncdataset.close()
+
+   def test_initial_conversion(self) :
+      self.assertTrue(self.watcher.poll() == ['first.cdl', os.path.join('sub', 'second.cdl')])
+      self.assertTrue(self.read_tas(os.path.join('sub', 'second.nc')) == [3.0, 4.0])
+      self.assertTrue(self.watcher.poll() == [])
+      # a new watcher only converts files whose output is out of date
+      self.write_cdl('first.cdl', "5.0f, 6.0f")
+      ncfile = os.path.join(self.outdir, 'first.nc')
+      os.utime(ncfile, (time.time() - 100, time.time() - 100))
+      watcher = cdlparser.CDLWatcher(self.srcdir, self.outdir, workers=0, debounce=0)
+      self.assertTrue(watcher.poll() == ['first.cdl'])
+      self.assertTrue(self.read_tas('first.nc') == [5.0, 6.0])
+
+   def test_changed_file(self) :
+      self.watcher.poll()
+      self.write_cdl('first.cdl', "5.0f, 6.0f", mtime=time.time() - 5)
+      self.assertTrue(self.watcher.poll() == ['first.cdl'])
+      self.assertTrue(self.read_tas('first.nc') == [5.0, 6.0])
+
+   def test_debounce(self) :
+      self.watcher.poll()
+      self.watcher.debounce = 60
+      self.write_cdl('first.cdl', "5.0f, 6.0f", mtime=time.time())
+      self.assertTrue(self.watcher.poll() == [])
+      self.watcher.debounce = 0
+      self.assertTrue(self.watcher.poll() == ['first.cdl'])
+
+   def test_deleted_file(self) :
+      self.watcher.poll()
+      os.remove(os.path.join(self.srcdir, 'first.cdl'))
+      self.watcher.poll()
+      self.assertTrue(not os.path.exists(os.path.join(self.outdir, 'first.nc')))
+      self.assertTrue(os.path.exists(os.path.join(self.outdir, 'sub', 'second.nc')))
+
+   def test_conversion_error(self) :
+      self.write_cdl('first.cdl', "5.0f 6.0f")
+      self.watcher.poll()
+      self.assertTrue('first.cdl' in self.watcher.errors)
+      self.assertTrue(os.listdir(self.outdir) == ['sub'])
+
+   def test_watch_command(self) :
+      # worker processes are forked, so run the command in a fresh process without open datasets
+      script = cdlparser.__file__.replace('.pyc', '.py')
+      retcode = subprocess.call([sys.executable, script, 'watch', self.srcdir, self.outdir,
+         'once=True', 'workers=2', 'interval=0'])
+      self.assertTrue(retcode == 0)
+      self.assertTrue(self.read_tas('first.nc') == [1.0, 2.0])
+      self.assertTrue(self.read_tas(os.path.join('sub', 'second.nc')) == [3.0, 4.0])
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+#---------------------------------------------------------------------------------------------------
+   unittest.main()